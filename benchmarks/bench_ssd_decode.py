@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+
+""" Benchmark of the SSD decode modes of deepstream-ssd-parser/ssd_parser.py.
+
+    Runs nvds_infer_parse_custom_tf_ssd on synthetic SSD output layers with
+    both the "per_index" and the "array" decode modes, checks that they keep
+    the same boxes and prints the time spent per frame.
+
+    pyds is replaced by the stand-in of common/tensor_replay.py, installed
+    or not, as the synthetic layers are not pyds objects. The benchmark
+    runs on any CPU.
+"""
+
+import sys
+import os
+import time
+import argparse
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..",
+                             "deepstream-ssd-parser"))
+import numpy as np
+from common.tensor_replay import install_fake_pyds, make_layers, make_ssd_outputs
+
+
+def make_ssd_layers(max_detections, class_nb, rng):
+    """ Build num_detections/detection_scores/detection_classes/detection_boxes
+        layers filled with random but plausible values.
+    """
+    return make_layers(make_ssd_outputs(rng, max_detections, class_nb))
+
+
+def time_mode(parse, layers, params, mode, repeat):
+    """ Return (seconds per frame, last result) for a decode mode. """
+    result = parse(layers, *params, decode_mode=mode)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = parse(layers, *params, decode_mode=mode)
+    return (time.perf_counter() - start) / repeat, result
+
+
+def main(args):
+    parser = argparse.ArgumentParser(description="SSD decode mode benchmark")
+    parser.add_argument("--detections", type=int, default=100,
+                        help="number of raw detections per frame")
+    parser.add_argument("--classes", type=int, default=91, help="number of classes")
+    parser.add_argument("--threshold", type=float, default=0.5,
+                        help="detection threshold for every class")
+    parser.add_argument("--repeat", type=int, default=200, help="timed iterations")
+    parser.add_argument("--seed", type=int, default=0)
+    options = parser.parse_args(args[1:])
+
+    install_fake_pyds(force=True)
+    from ssd_parser import (nvds_infer_parse_custom_tf_ssd, DetectionParam,
+                            BoxSizeParam, NmsParam)
+
+    rng = np.random.default_rng(options.seed)
+    layers = make_ssd_layers(options.detections, options.classes, rng)
+    params = (DetectionParam(options.classes, options.threshold),
+              BoxSizeParam(1080, 1920, 32, 32), NmsParam(20, 0.3))
+
+    per_index, per_index_res = time_mode(nvds_infer_parse_custom_tf_ssd, layers,
+                                         params, "per_index", options.repeat)
+    array, array_res = time_mode(nvds_infer_parse_custom_tf_ssd, layers,
+                                 params, "array", options.repeat)
+
+    def key(objs):
+        return sorted((o.classId, round(o.left, 5), round(o.top, 5)) for o in objs)
+
+    if key(per_index_res) != key(array_res):
+        sys.stderr.write("ERROR: decode modes disagree\n")
+        return 1
+
+    print("detections=%d kept=%d" % (options.detections, len(array_res)))
+    print("per_index : %8.1f us/frame" % (per_index * 1e6))
+    print("array     : %8.1f us/frame" % (array * 1e6))
+    print("speedup   : %8.2fx" % (per_index / array))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,138 @@
+""" Minimal benchmark runner with JSON baselines and regression gates.
+
+    A case is a function decorated with @benchmark returning a callable and
+    the number of work units (boxes, frames, updates...) one call processes:
+
+        @benchmark("nms_100", unit="boxes")
+        def nms_100():
+            boxes = ...
+            return lambda: cluster(boxes), len(boxes)
+
+    Every case is timed over several rounds with the garbage collector
+    disabled, like timeit, and its best throughput in units per second is
+    compared with the baseline file: the best round is the least disturbed
+    by the rest of the machine. A case whose throughput dropped by more
+    than the threshold is a regression.
+"""
+
+import gc
+import re
+import sys
+import json
+import time
+import platform
+from collections import OrderedDict
+
+CASES = OrderedDict()
+
+
+class SkipBenchmark(Exception):
+    """ Raised by a case setup that cannot run in this environment. """
+
+
+def benchmark(name, unit="calls"):
+    """ Decorator registering a case setup function under name. """
+    def decorator(setup):
+        CASES[name] = (setup, unit)
+        return setup
+    return decorator
+
+
+def time_case(work, units, rounds=5, min_time=0.1):
+    """ Return the best throughput, in units per second, of work(). """
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        return measure(work, units, rounds, min_time)
+    finally:
+        if gc_enabled:
+            gc.enable()
+
+
+def measure(work, units, rounds, min_time):
+    work()
+    # Calls per round so that a round lasts at least min_time
+    calls = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(calls):
+            work()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            break
+        calls *= 2 if elapsed <= 0 else max(2, int(min_time / elapsed) + 1)
+    throughputs = [calls * units / elapsed]
+    for _ in range(rounds - 1):
+        start = time.perf_counter()
+        for _ in range(calls):
+            work()
+        throughputs.append(calls * units / (time.perf_counter() - start))
+    return max(throughputs)
+
+
+def run_cases(pattern=None, rounds=5, min_time=0.1):
+    """ Run the cases whose name matches pattern.
+
+        Return:
+        - OrderedDict of name to {"throughput": units/s, "unit": unit}
+    """
+    results = OrderedDict()
+    for name, (setup, unit) in CASES.items():
+        if pattern and not re.search(pattern, name):
+            continue
+        try:
+            work, units = setup()
+        except SkipBenchmark as e:
+            print("%-32s skipped: %s" % (name, e))
+            continue
+        throughput = time_case(work, units, rounds, min_time)
+        results[name] = {"throughput": throughput, "unit": unit}
+        print("%-32s %14.1f %s/s" % (name, throughput, unit))
+    return results
+
+
+def environment():
+    return {
+        "machine": platform.machine(),
+        "processor": platform.processor(),
+        "python": platform.python_version(),
+        "node": platform.node(),
+    }
+
+
+def load_baseline(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def save_baseline(path, results):
+    with open(path, "w") as f:
+        json.dump({"environment": environment(), "results": results}, f, indent=2)
+        f.write("\n")
+
+
+def compare(results, baseline, threshold):
+    """ Print the change of every case against the baseline.
+
+        Return:
+        - the names of the cases slower than the baseline by more than
+          threshold (0.2 = 20 % fewer units per second).
+    """
+    regressions = []
+    reference = baseline.get("results", {})
+    if baseline.get("environment", {}).get("node") != environment()["node"]:
+        sys.stderr.write("WARNING: baseline recorded on another machine\n")
+    for name, result in results.items():
+        if name not in reference:
+            print("%-32s new case" % name)
+            continue
+        ratio = result["throughput"] / reference[name]["throughput"]
+        status = "ok"
+        if ratio < 1.0 - threshold:
+            status = "REGRESSION"
+            regressions.append(name)
+        print("%-32s %+7.1f%%  %s" % (name, (ratio - 1.0) * 100, status))
+    return regressions
@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+
+""" Replay recorded or synthetic output tensors through a Python parser.
+
+    python3 replay_tensors.py --parser yunet --frames 200
+    python3 replay_tensors.py --parser peoplenet --recording peoplenet.npz
+    python3 replay_tensors.py --parser ssd --save ssd.npz
+
+    Prints the throughput in frames and detections per second and the time
+    spent per frame in every stage of the tensor probe. Runs on any CPU:
+    pyds is replaced by a stand-in, installed or not.
+"""
+
+import sys
+import os
+import argparse
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.tensor_replay import (install_fake_pyds, load_recording, print_report, replay,
+                                  save_recording, synthetic_frames)
+
+
+def main(args):
+    install_fake_pyds(force=True)
+    from common.parser_registry import create_parser, parser_names
+
+    parser = argparse.ArgumentParser(description="Output tensor replay benchmark")
+    parser.add_argument("--parser", required=True, choices=parser_names(),
+                        help="registered parser to replay the tensors through")
+    parser.add_argument("--recording", default=None,
+                        help=".npz recording, synthetic tensors are generated if not given")
+    parser.add_argument("--frames", type=int, default=100, help="synthetic frames")
+    parser.add_argument("--repeat", type=int, default=5, help="passes over the frames")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--save", default=None, help="save the frames to a .npz recording")
+    parser.add_argument("--cluster-mode", default="nms", help="peoplenet clustering")
+    options = parser.parse_args(args[1:])
+
+    if options.recording:
+        frames = load_recording(options.recording)
+    else:
+        frames = synthetic_frames(options.parser, options.frames, options.seed)
+    if options.save:
+        save_recording(options.save, frames)
+        print("Saved %d frames to %s" % (len(frames), options.save))
+
+    tensor_parser = create_parser(options.parser, 1920, 1080,
+                                  cluster_mode=options.cluster_mode)
+    # Warm up, then measure
+    replay(frames[:1], tensor_parser)
+    print_report(replay(frames, tensor_parser, options.repeat))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,299 @@
+#!/usr/bin/env python3
+
+""" Benchmark suite of the post-processing hot paths.
+
+    python3 run_benchmarks.py                  # compare with baseline.json
+    python3 run_benchmarks.py --save-baseline  # record baseline.json
+    python3 run_benchmarks.py -k nms --threshold 0.3
+
+    Cases:
+    - nms_cluster_<n> : cluster_and_fill_detection_output_nms on n boxes
+    - nms_<method>_<n> : batched_nms on a crowded frame of n boxes, greedy
+      (dense or same-class pairs) against sweep (overlapping pairs)
+    - ssd_decode_<mode> : nvds_infer_parse_custom_tf_ssd, per frame
+    - ssd_decode_batch : nvds_infer_parse_custom_tf_ssd_batch on 8 frames
+    - fps_update_<n>_threads : PERF_DATA.update_fps from n streaming threads
+    - meta_walk_<loop> : probe loops over synthetic batch metadata
+    - parser_<name> : registered tensor parsers on synthetic tensors
+
+    Exits with 1 when a case is slower than its baseline by more than the
+    threshold, and when there is no baseline to compare with, so that the
+    gate cannot pass unnoticed. Baselines are machine specific: record one
+    per machine with --save-baseline.
+"""
+
+import sys
+import os
+import argparse
+import threading
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(BENCHMARKS_DIR, ".."))
+sys.path.append(os.path.join(BENCHMARKS_DIR, "..", "deepstream-ssd-parser"))
+import numpy as np
+
+from common.tensor_replay import (FakeObjectDetectionInfo, install_fake_pyds, make_layers,
+                                  make_ssd_outputs, synthetic_frames, view_layers)
+from harness import (benchmark, compare, load_baseline, run_cases,
+                     save_baseline)
+
+# The cases feed the parsers stand-in layers, which the real pyds rejects
+install_fake_pyds(force=True)
+DEFAULT_BASELINE = os.path.join(BENCHMARKS_DIR, "baseline.json")
+DEFAULT_THRESHOLD = 0.2
+BATCH_SIZE = 8
+
+
+def make_objects(count, rng, class_nb=4):
+    """ Overlapping NvDsInferObjectDetectionInfo-like boxes in [0, 1]. """
+    objects = []
+    centers = rng.uniform(0.1, 0.9, (max(count // 5, 1), 2))
+    for i in range(count):
+        obj = FakeObjectDetectionInfo()
+        cx, cy = centers[i % len(centers)] + rng.normal(0.0, 0.01, 2)
+        obj.width, obj.height = rng.uniform(0.05, 0.2, 2).tolist()
+        obj.left = float(cx) - obj.width / 2
+        obj.top = float(cy) - obj.height / 2
+        obj.classId = int(rng.integers(class_nb))
+        obj.detectionConfidence = float(rng.uniform(0.3, 1.0))
+        objects.append(obj)
+    return objects
+
+
+def nms_case(count):
+    def setup():
+        from nms import cluster_and_fill_detection_output_nms
+        objects = make_objects(count, np.random.default_rng(count))
+        return lambda: cluster_and_fill_detection_output_nms(objects, 20, 0.4), count
+    return setup
+
+
+for box_count in (10, 100, 1000):
+    benchmark("nms_cluster_%d" % box_count, unit="boxes")(nms_case(box_count))
+
+
+def make_crowd(count, rng, class_nb=3, width=1920, height=1080):
+    """ Corner boxes of a crowded 1080p frame: groups of about 8 boxes of
+        20 to 120 pixels around random centers.
+    """
+    centers = rng.uniform((0, 0), (width, height), (max(count // 8, 1), 2))
+    xy = centers[rng.integers(len(centers), size=count)] + rng.normal(0.0, 6.0, (count, 2))
+    wh = rng.uniform(20, 120, (count, 2))
+    boxes = np.concatenate([xy - wh / 2, xy + wh / 2], axis=1).astype(np.float32)
+    scores = rng.uniform(0.2, 1.0, count).astype(np.float32)
+    return boxes, scores, rng.integers(class_nb, size=count).astype(np.int32)
+
+
+def crowd_nms_case(method, count):
+    def setup():
+        from common.nms_engine import batched_nms
+        boxes, scores, class_ids = make_crowd(count, np.random.default_rng(count))
+        return lambda: batched_nms(boxes, scores, class_ids, 0.5, method), count
+    return setup
+
+
+for nms_method in ("greedy", "sweep"):
+    for box_count in (1000, 3000, 10000):
+        benchmark("nms_%s_%d" % (nms_method, box_count), unit="boxes")(
+            crowd_nms_case(nms_method, box_count))
+
+
+def ssd_params():
+    from ssd_parser import BoxSizeParam, DetectionParam, NmsParam
+    return DetectionParam(91, 0.5), BoxSizeParam(1080, 1920, 32, 32), NmsParam(20, 0.3)
+
+
+def ssd_decode_case(mode):
+    def setup():
+        from ssd_parser import nvds_infer_parse_custom_tf_ssd
+        layers = make_layers(make_ssd_outputs(np.random.default_rng(0)))
+        params = ssd_params()
+        return lambda: nvds_infer_parse_custom_tf_ssd(layers, *params, decode_mode=mode), 1
+    return setup
+
+
+for decode_mode in ("per_index", "array"):
+    benchmark("ssd_decode_%s" % decode_mode, unit="frames")(ssd_decode_case(decode_mode))
+
+
+@benchmark("ssd_decode_batch", unit="frames")
+def ssd_decode_batch():
+    from ssd_parser import nvds_infer_parse_custom_tf_ssd_batch
+    rng = np.random.default_rng(0)
+    batch = [make_layers(make_ssd_outputs(rng)) for _ in range(BATCH_SIZE)]
+    params = ssd_params()
+    return lambda: nvds_infer_parse_custom_tf_ssd_batch(batch, *params), BATCH_SIZE
+
+
+def fps_case(thread_count, updates=20000):
+    def setup():
+        from common.FPS import PERF_DATA
+        perf_data = PERF_DATA(thread_count)
+
+        def stream(index):
+            for _ in range(updates):
+                perf_data.update_fps(index)
+
+        def work():
+            threads = [threading.Thread(target=stream, args=(i,)) for i in range(thread_count)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        return work, thread_count * updates
+    return setup
+
+
+for fps_threads in (1, 4, 16):
+    benchmark("fps_update_%d_threads" % fps_threads, unit="updates")(fps_case(fps_threads))
+
+
+class MetaNode:
+    """ GList node of the synthetic metadata. """
+    __slots__ = ("data", "next")
+
+    def __init__(self, data, next_node):
+        self.data = data
+        self.next = next_node
+
+
+class FakeRect:
+    __slots__ = ("left", "top", "width", "height")
+
+
+class FakeObjMeta:
+    __slots__ = ("class_id", "object_id", "confidence", "rect_params")
+
+
+class FakeFrameMeta:
+    __slots__ = ("frame_num", "pad_index", "num_obj_meta", "obj_meta_list")
+
+
+class FakeBatchMeta:
+    __slots__ = ("frame_meta_list",)
+
+
+def make_list(items):
+    head = None
+    for item in reversed(items):
+        head = MetaNode(item, head)
+    return head
+
+
+def make_batch_meta(rng, frames=BATCH_SIZE, objects=30, class_nb=4):
+    frame_metas = []
+    for frame_index in range(frames):
+        obj_metas = []
+        for object_id in range(objects):
+            obj_meta = FakeObjMeta()
+            obj_meta.class_id = int(rng.integers(class_nb))
+            obj_meta.object_id = object_id
+            obj_meta.confidence = float(rng.uniform())
+            rect = FakeRect()
+            rect.left, rect.top, rect.width, rect.height = rng.uniform(0, 500, 4).tolist()
+            obj_meta.rect_params = rect
+            obj_metas.append(obj_meta)
+        frame_meta = FakeFrameMeta()
+        frame_meta.frame_num = 0
+        frame_meta.pad_index = frame_index
+        frame_meta.num_obj_meta = objects
+        frame_meta.obj_meta_list = make_list(obj_metas)
+        frame_metas.append(frame_meta)
+    batch_meta = FakeBatchMeta()
+    batch_meta.frame_meta_list = make_list(frame_metas)
+    return batch_meta, frames * objects
+
+
+def meta_walk_setup():
+    """ Return the fake batch meta and its object count, walked with the
+        metadata casts of the pyds stand-in.
+    """
+    return make_batch_meta(np.random.default_rng(0))
+
+
+@benchmark("meta_walk_count", unit="objects")
+def meta_walk_count():
+    """ Per-object class counter of the deepstream_test_3/yunet_test probes. """
+    import pyds
+    batch_meta, object_count = meta_walk_setup()
+
+    def walk():
+        l_frame = batch_meta.frame_meta_list
+        while l_frame is not None:
+            frame_meta = pyds.NvDsFrameMeta.cast(l_frame.data)
+            obj_counter = {0: 0, 1: 0, 2: 0, 3: 0}
+            l_obj = frame_meta.obj_meta_list
+            while l_obj is not None:
+                obj_meta = pyds.NvDsObjectMeta.cast(l_obj.data)
+                obj_counter[obj_meta.class_id] += 1
+                l_obj = l_obj.next
+            l_frame = l_frame.next
+
+    return walk, object_count
+
+
+@benchmark("meta_walk_detection_batch", unit="objects")
+def meta_walk_detection_batch():
+    """ Columnar copy of every object with DetectionBatch. """
+    from common.detection_batch import DetectionBatch
+    batch_meta, object_count = meta_walk_setup()
+    detections = DetectionBatch()
+    return lambda: detections.fill_from_batch_meta(batch_meta), object_count
+
+
+def parser_case(name):
+    def setup():
+        from common.parser_registry import create_parser
+        parser = create_parser(name, 1920, 1080)
+        layers = make_layers(synthetic_frames(name, 1)[0])
+        output_names = parser.output_names
+        return lambda: parser.decode(view_layers(layers, output_names)), 1
+    return setup
+
+
+for parser_name in ("ssd", "yunet", "peoplenet"):
+    benchmark("parser_%s" % parser_name, unit="frames")(parser_case(parser_name))
+
+
+def main(args):
+    parser = argparse.ArgumentParser(description="Post-processing benchmark suite")
+    parser.add_argument("-k", dest="pattern", default=None,
+                        help="only run the cases matching this regular expression")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="baseline JSON file")
+    parser.add_argument("--save-baseline", action="store_true",
+                        help="record the results as the new baseline")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="allowed throughput drop before failing (0.2 = 20%%)")
+    parser.add_argument("--rounds", type=int, default=5, help="timed rounds per case")
+    parser.add_argument("--min-time", type=float, default=0.1,
+                        help="minimum duration of a round in seconds")
+    parser.add_argument("--output", default=None, help="also write the results to this file")
+    options = parser.parse_args(args[1:])
+
+    results = run_cases(options.pattern, options.rounds, options.min_time)
+    if options.output:
+        save_baseline(options.output, results)
+    if options.save_baseline:
+        baseline = load_baseline(options.baseline) or {"results": {}}
+        baseline["results"].update(results)
+        save_baseline(options.baseline, baseline["results"])
+        print("Baseline written to", options.baseline)
+        return 0
+
+    baseline = load_baseline(options.baseline)
+    if baseline is None:
+        sys.stderr.write("No baseline at %s, run with --save-baseline to record one\n"
+                         % options.baseline)
+        return 1
+    print()
+    regressions = compare(results, baseline, options.threshold)
+    if regressions:
+        sys.stderr.write("%d case(s) regressed by more than %d%%: %s\n" % (
+            len(regressions), options.threshold * 100, ", ".join(regressions)))
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
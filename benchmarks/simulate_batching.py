@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+
+""" Simulate the nvstreammux batching with a fixed or adaptive timeout.
+
+    python3 simulate_batching.py --fps 30,30,10,5 --slo-ms 60
+    python3 simulate_batching.py --fps 25,25,25,25 --infer-ms 20 --infer-frame-ms 10 --max-interval 4
+    python3 simulate_batching.py --scenario all
+
+    Runs common.batch_controller.simulate on synthetic arrival traces with
+    the fixed MUXER_BATCH_TIMEOUT_USEC of the apps, then with the adaptive
+    controller, and prints the latency, throughput and batch fill of both.
+    --scenario runs the named cases of SCENARIOS instead, among them an
+    SLO the inference alone cannot meet, where the adaptive timeout must
+    not do worse than the fixed one. No GPU or DeepStream installation is
+    needed.
+"""
+
+import sys
+import os
+import argparse
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.batch_controller import BatchTimeoutController, arrival_trace, simulate
+
+MUXER_BATCH_TIMEOUT_USEC = 33000
+
+# Named cases of --scenario, as command line arguments
+SCENARIOS = {
+    "full-batches": ["--fps", "30,30,30,30"],
+    "mixed-rates": ["--fps", "30,30,10,5", "--slo-ms", "60"],
+    "slow-sources": ["--fps", "10,10,10,10"],
+    "overloaded-pgie": ["--fps", "25,25,25,25", "--infer-ms", "20", "--infer-frame-ms", "10",
+                        "--max-interval", "4"],
+    # A full batch takes 24 ms to infer: no timeout meets a 30 ms SLO
+    "infeasible-slo": ["--fps", "30,30,30,30", "--slo-ms", "30"],
+}
+
+
+def make_parser():
+    parser = argparse.ArgumentParser(description="nvstreammux batching simulation")
+    parser.add_argument("--fps", default="30,30,30,30",
+                        help="comma separated frame rates, one per source")
+    parser.add_argument("--jitter", type=float, default=0.1,
+                        help="arrival jitter in frame periods")
+    parser.add_argument("--duration", type=float, default=60.0, help="simulated seconds")
+    parser.add_argument("--infer-ms", type=float, default=8.0, help="inference time of a batch")
+    parser.add_argument("--infer-frame-ms", type=float, default=4.0,
+                        help="inference time added per frame of a batch")
+    parser.add_argument("--slo-ms", type=float, default=100.0, help="frame latency target")
+    parser.add_argument("--max-interval", type=int, default=0,
+                        help="highest pgie interval the controller may set")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--scenario", choices=sorted(SCENARIOS) + ["all"], default=None,
+                        help="run a named case, or all of them, instead of the options")
+    return parser
+
+
+def run_case(options):
+    """ Simulate the fixed and the adaptive timeout and print the results. """
+    rates = [float(fps) for fps in options.fps.split(",")]
+    traces = []
+    for source, fps in enumerate(rates):
+        # Sources start out of phase, as cameras do
+        start = (source * 0.37 / fps) % (1.0 / fps)
+        traces.append(arrival_trace(fps, options.duration, options.jitter, start,
+                                    seed=options.seed + source))
+
+    def inference_time(num_frames):
+        return (options.infer_ms + options.infer_frame_ms * num_frames) / 1e3
+
+    controllers = [
+        ("fixed %d us" % MUXER_BATCH_TIMEOUT_USEC,
+         BatchTimeoutController(len(rates), options.slo_ms / 1e3,
+                                min_timeout_usec=MUXER_BATCH_TIMEOUT_USEC,
+                                max_timeout_usec=MUXER_BATCH_TIMEOUT_USEC)),
+        ("adaptive", BatchTimeoutController(len(rates), options.slo_ms / 1e3,
+                                            max_interval=options.max_interval)),
+    ]
+    print("%-16s %8s %8s %8s %8s %9s %12s %8s" % (
+        "timeout", "fps", "fill", "p50 ms", "p99 ms", "slo miss", "final usec", "interval"))
+    for name, controller in controllers:
+        result = simulate(controller, traces, inference_time,
+                          skip_time=options.infer_ms / 1e3 / 4)
+        print("%-16s %8.1f %8.3f %8.1f %8.1f %9.4f %12d %8d" % (
+            name, result["fps"], result["batch_fill"], result["p50_ms"], result["p99_ms"],
+            result["slo_miss"], controller.timeout_usec, controller.interval))
+
+
+def main(args):
+    parser = make_parser()
+    options = parser.parse_args(args[1:])
+    if options.scenario is None:
+        run_case(options)
+        return 0
+    names = sorted(SCENARIOS) if options.scenario == "all" else [options.scenario]
+    for name in names:
+        print("== %s: %s" % (name, " ".join(SCENARIOS[name])))
+        run_case(parser.parse_args(SCENARIOS[name]))
+        print()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
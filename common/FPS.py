@@ -15,53 +15,137 @@
 # limitations under the License.
 ################################################################################
 
+import math
 import time
-from threading import Lock
-start_time=time.time()
+from array import array
+
+# Number of frame intervals kept per stream for the sliding-window percentiles
+FPS_WINDOW = 128
+FPS_PERCENTILES = (50, 90, 99)
+
+
+def percentile(sorted_values, pct):
+    """ Nearest-rank percentile of an already sorted sequence. """
+    if not sorted_values:
+        return 0
+    rank = max(0, min(len(sorted_values) - 1,
+                      math.ceil(pct / 100.0 * len(sorted_values)) - 1))
+    return sorted_values[rank]
 
-fps_mutex = Lock()
 
 class GETFPS:
-    def __init__(self,stream_id):
-        global start_time
-        self.start_time=start_time
-        self.is_first=True
-        self.frame_count=0
-        self.stream_id=stream_id
+    """ FPS of one stream, backed by a slot of a PERF_DATA counter table. """
+    def __init__(self, stream_id, perf_data=None):
+        if perf_data is None:
+            perf_data = PERF_DATA(stream_id + 1)
+        self.perf_data = perf_data
+        self.stream_id = stream_id
 
     def update_fps(self):
-        end_time = time.time()
-        if self.is_first:
-            self.start_time = end_time
-            self.is_first = False
-        else:
-            global fps_mutex
-            with fps_mutex:
-                self.frame_count = self.frame_count + 1
+        self.perf_data.update_fps(self.stream_id)
 
     def get_fps(self):
-        end_time = time.time()
-        with fps_mutex:
-            stream_fps = float(self.frame_count/(end_time - self.start_time))
-            self.frame_count = 0
-        self.start_time = end_time
-        return round(stream_fps, 2)
+        return self.perf_data.get_fps(self.stream_id)
 
     def print_data(self):
-        print('frame_count=',self.frame_count)
-        print('start_time=',self.start_time)
+        print('frame_count=', self.perf_data.frame_counts[self.stream_id])
+        print('last_frame_ns=', self.perf_data.last_frame_ns[self.stream_id])
+
 
 class PERF_DATA:
-    def __init__(self, num_streams=1):
+    """ Per-stream frame counters stored in preallocated arrays indexed by
+        pad_index.
+
+        There is no lock: a stream slot is only written by the streaming
+        thread calling update_fps for that pad_index, and the reporting
+        thread only reads the counters and keeps its own snapshot of them
+        instead of resetting them.
+    """
+    def __init__(self, num_streams=1, window=FPS_WINDOW):
+        self.num_streams = num_streams
+        self.window = window
+        self.stream_names = ["stream{0}".format(i) for i in range(num_streams)]
+        self.frame_counts = array('q', [0] * num_streams)
+        self.last_frame_ns = array('q', [0] * num_streams)
+        # Ring of the last frame intervals of every stream, in nanoseconds
+        self.intervals = [array('q', [0] * window) for _ in range(num_streams)]
+        self.interval_pos = array('q', [0] * num_streams)
+        # Reporting side state, only touched by the reporting thread
+        now = time.perf_counter_ns()
+        self.report_counts = array('q', [0] * num_streams)
+        self.report_ns = array('q', [now] * num_streams)
+        self.fps_min = [None] * num_streams
+        self.fps_max = [0.0] * num_streams
+        self.first_frame_ns = array('q', [0] * num_streams)
         self.perf_dict = {}
-        self.all_stream_fps = {}
-        for i in range(num_streams):
-            self.all_stream_fps["stream{0}".format(i)]=GETFPS(i)
+        self.all_stream_fps = {name: GETFPS(i, self) for i, name in enumerate(self.stream_names)}
+
+    def update_fps(self, stream_index):
+        """ Count a frame of a stream. stream_index is the pad_index, the
+            "stream<N>" names are still accepted for compatibility.
+        """
+        if isinstance(stream_index, str):
+            stream_index = int(stream_index[6:])
+        now = time.perf_counter_ns()
+        last = self.last_frame_ns[stream_index]
+        if last:
+            pos = self.interval_pos[stream_index]
+            self.intervals[stream_index][pos % self.window] = now - last
+            self.interval_pos[stream_index] = pos + 1
+        else:
+            self.first_frame_ns[stream_index] = now
+        self.last_frame_ns[stream_index] = now
+        self.frame_counts[stream_index] += 1
+
+    def get_fps(self, stream_index):
+        """ Return the FPS of a stream since the previous call. """
+        now = time.perf_counter_ns()
+        count = self.frame_counts[stream_index]
+        start = self.report_ns[stream_index]
+        frames = count - self.report_counts[stream_index]
+        first = self.first_frame_ns[stream_index]
+        if first > start:
+            # The period starts at the first frame of the stream, not at
+            # startup, so that frame opens the period and is not counted
+            start = first
+            frames -= 1
+        self.report_counts[stream_index] = count
+        self.report_ns[stream_index] = now
+        if frames <= 0 or now <= start:
+            return 0.0
+        stream_fps = round(frames * 1e9 / (now - start), 2)
+        if self.fps_min[stream_index] is None or stream_fps < self.fps_min[stream_index]:
+            self.fps_min[stream_index] = stream_fps
+        self.fps_max[stream_index] = max(self.fps_max[stream_index], stream_fps)
+        return stream_fps
+
+    def get_window_fps(self, stream_index):
+        """ Return the mean FPS over the sliding window of frame intervals. """
+        filled = min(self.interval_pos[stream_index], self.window)
+        total = sum(self.intervals[stream_index][:filled])
+        return round(filled * 1e9 / total, 2) if total else 0.0
+
+    def get_stats(self, stream_index):
+        """ Return min/avg/max FPS since the first frame and the percentiles
+            of the frame interval (ms) over the sliding window.
+        """
+        count = self.frame_counts[stream_index]
+        elapsed = self.last_frame_ns[stream_index] - self.first_frame_ns[stream_index]
+        avg = round((count - 1) * 1e9 / elapsed, 2) if count > 1 and elapsed > 0 else 0.0
+        filled = min(self.interval_pos[stream_index], self.window)
+        intervals = sorted(self.intervals[stream_index][:filled])
+        stats = {
+            "min": self.fps_min[stream_index] or 0.0,
+            "avg": avg,
+            "max": self.fps_max[stream_index],
+        }
+        for pct in FPS_PERCENTILES:
+            stats["p{0}_ms".format(pct)] = round(percentile(intervals, pct) / 1e6, 2)
+        return stats
 
     def perf_print_callback(self):
-        self.perf_dict = {stream_index:stream.get_fps() for (stream_index, stream) in self.all_stream_fps.items()}
+        self.perf_dict = {name: self.get_fps(i) for i, name in enumerate(self.stream_names)}
         print ("\n**PERF: ", self.perf_dict, "\n")
+        stats = {name: self.get_stats(i) for i, name in enumerate(self.stream_names)}
+        print ("**PERF STATS: ", stats, "\n")
         return True
-    
-    def update_fps(self, stream_index):
-        self.all_stream_fps[stream_index].update_fps()
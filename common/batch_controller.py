@@ -0,0 +1,298 @@
+"""
+    Feedback control of the nvstreammux batched-push-timeout.
+
+    nvstreammux pushes a batch when it holds a frame of every source or
+    when batched-push-timeout expires. A long timeout fills the batches,
+    which is what the throughput wants, but every frame may wait that long
+    before inference, and a batch takes one frame per source: past the
+    arrival period of the fastest source its frames back up. A
+    BatchTimeoutController keeps the timeout just below that period, as
+    long as the wait plus the measured inference time stays within a
+    latency SLO. Only the wait is cut for the SLO, and never below the
+    inference time of a batch: shorter, the batches would be pushed faster
+    than they are inferred and back up in front of pgie.
+
+        controller = BatchTimeoutController(
+            batch_size, latency_slo=0.1,
+            on_timeout=lambda usec: streammux.set_property("batched-push-timeout", usec))
+        ...
+        controller.batch_pushed(buffer.pts)                      # streammux src probe
+        controller.batch_inferred(buffer.pts, num_frames)        # pgie src probe
+        ...
+        GLib.timeout_add(1000, controller.poll, perf_data)
+
+    When the inference alone misses the SLO, cutting the wait cannot help:
+    the timeout is held, and the controller can raise the pgie interval
+    (batches skipped between inferences, given on_interval and
+    max_interval > 0), and lowers it again once there is room.
+
+    simulate() runs a controller against synthetic arrival traces and an
+    inference time model instead of a pipeline, see
+    benchmarks/simulate_batching.py.
+"""
+
+import time
+import random
+from collections import deque
+
+from common.FPS import percentile
+
+# Seconds without frames after which a source no longer counts as active
+STALE_SOURCE_SECONDS = 1.0
+# Batch latencies kept for the percentile the controller acts on
+LATENCY_WINDOW = 256
+
+
+def arrival_trace(fps, duration, jitter=0.0, start=0.0, stall=None, seed=0):
+    """ Return the sorted arrival times in seconds of a synthetic source.
+
+        Keyword arguments:
+        - fps : nominal frame rate
+        - jitter : standard deviation of the arrival time, in frame periods
+        - start : time of the first frame
+        - stall : optional (begin, end) period without frames
+    """
+    rng = random.Random(seed)
+    period = 1.0 / fps
+    times = []
+    t = start
+    while t < duration:
+        if stall is None or not stall[0] <= t < stall[1]:
+            times.append(max(0.0, t + rng.gauss(0.0, jitter * period) if jitter else t))
+        t += period
+    times.sort()
+    return times
+
+
+class BatchTimeoutController:
+    """ Tunes batched-push-timeout, and optionally the pgie interval,
+        against a latency SLO. See the module docstring.
+
+        Keyword arguments:
+        - batch_size : nvstreammux batch size
+        - latency_slo : target latency in seconds of a frame, from its
+          arrival at nvstreammux to the end of the inference
+        - min_timeout_usec, max_timeout_usec : bounds of the timeout
+        - period_fraction : timeout as a fraction of the arrival period of
+          the fastest source, below 1 for the batches to keep up with it
+        - smoothing : weight of a new target in the timeout, 1 jumps to it
+        - latency_pct : latency percentile compared to the SLO
+        - max_interval : highest pgie interval to set, 0 never changes it
+        - on_timeout, on_interval : functions applying a new value
+    """
+    def __init__(self, batch_size, latency_slo=0.1, min_timeout_usec=1000,
+                 max_timeout_usec=100000, period_fraction=0.9, smoothing=0.5, latency_pct=90,
+                 max_interval=0, on_timeout=None, on_interval=None, timeout_usec=33000):
+        self.batch_size = batch_size
+        self.latency_slo = latency_slo
+        self.min_timeout_usec = min_timeout_usec
+        self.max_timeout_usec = max_timeout_usec
+        self.period_fraction = period_fraction
+        self.smoothing = smoothing
+        self.latency_pct = latency_pct
+        self.max_interval = max_interval
+        self.on_timeout = on_timeout
+        self.on_interval = on_interval
+        self.timeout_usec = min(max(timeout_usec, min_timeout_usec), max_timeout_usec)
+        self.interval = 0
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+        self.service_times = deque(maxlen=LATENCY_WINDOW)
+        self.frames = 0
+        self.batches = 0
+        # pts -> perf_counter_ns of the batches between the two probes
+        self.pushed_ns = {}
+        self.inferred_ns = 0
+
+    def batch_pushed(self, pts):
+        """ Record a batch leaving nvstreammux, from a probe upstream of pgie. """
+        if len(self.pushed_ns) > LATENCY_WINDOW:
+            # Batches dropped between the probes never come back
+            self.pushed_ns.clear()
+        self.pushed_ns[pts] = time.perf_counter_ns()
+
+    def batch_inferred(self, pts, num_frames):
+        """ Record a batch of num_frames frames leaving pgie. """
+        pushed = self.pushed_ns.pop(pts, None)
+        now = time.perf_counter_ns()
+        if pushed is not None:
+            # Batches are inferred in order: a batch pushed while the
+            # previous one was inferred waited for it
+            service = now - max(pushed, self.inferred_ns)
+            self.observe_batch((now - pushed) / 1e9, num_frames, service / 1e9)
+        self.inferred_ns = now
+
+    def observe_batch(self, latency, num_frames, service_time=None):
+        """ Record the latency in seconds of a batch, from its push to the
+            end of its inference, and its inference time alone, the same
+            if not given.
+        """
+        self.latencies.append(latency)
+        self.service_times.append(latency if service_time is None else service_time)
+        self.frames += num_frames
+        self.batches += 1
+
+    def inference_latency(self):
+        """ Latency percentile of the batches, queueing in front of pgie included. """
+        return percentile(sorted(self.latencies), self.latency_pct)
+
+    def inference_time(self):
+        """ Inference time percentile of the batches. """
+        return percentile(sorted(self.service_times), self.latency_pct)
+
+    def mean_batch_fill(self):
+        return self.frames / (self.batches * self.batch_size) if self.batches else 0.0
+
+    def update(self, source_rates):
+        """ Compute and apply the timeout for the arrival rates (fps) of the
+            sources, 0 for the inactive ones.
+
+            Return:
+            - the timeout in microseconds
+        """
+        rates = [rate for rate in source_rates if rate > 0]
+        if not rates:
+            return self.timeout_usec
+        service = self.inference_time()
+        # Longest wait that still takes every frame of the fastest source
+        fill_wait = self.period_fraction / max(rates)
+        # Time left to wait for frames within the SLO, the queueing in
+        # front of pgie is not counted: a shorter wait only makes it worse
+        budget = self.latency_slo - service
+        if budget > 0:
+            # Pushing batches faster than they are inferred backs them up
+            target = max(min(fill_wait, budget), service) * 1e6
+            target = min(max(target, self.min_timeout_usec), self.max_timeout_usec)
+            timeout = int(round(self.timeout_usec
+                                + self.smoothing * (target - self.timeout_usec)))
+            if timeout != self.timeout_usec:
+                self.timeout_usec = timeout
+                if self.on_timeout:
+                    self.on_timeout(timeout)
+
+        if self.max_interval and self.service_times:
+            # Share of the time pgie needs to infer a batch per frame of the
+            # fastest source, above 1 the batches back up whatever the timeout
+            load = sum(self.service_times) / len(self.service_times) * max(rates)
+            interval = self.interval
+            if budget * 1e6 < self.min_timeout_usec or load > 1.0:
+                interval = min(interval + 1, self.max_interval)
+            elif service + fill_wait < self.latency_slo / 2 and load < 0.5:
+                interval = max(interval - 1, 0)
+            if interval != self.interval:
+                self.interval = interval
+                # The latencies of the previous interval no longer apply
+                self.latencies.clear()
+                self.service_times.clear()
+                if self.on_interval:
+                    self.on_interval(interval)
+        return self.timeout_usec
+
+    def poll(self, perf_data):
+        """ GLib timeout callback updating from the PERF_DATA frame rates. """
+        now = time.perf_counter_ns()
+        rates = []
+        for stream_index in range(perf_data.num_streams):
+            last_frame = perf_data.last_frame_ns[stream_index]
+            active = last_frame and now - last_frame < STALE_SOURCE_SECONDS * 1e9
+            rates.append(perf_data.get_window_fps(stream_index) if active else 0.0)
+        self.update(rates)
+        return True
+
+    def stats(self):
+        return {
+            "timeout_usec": self.timeout_usec,
+            "interval": self.interval,
+            "latency_ms": round(self.inference_latency() * 1e3, 2),
+            "inference_ms": round(self.inference_time() * 1e3, 2),
+            "batch_fill": round(self.mean_batch_fill(), 3),
+        }
+
+
+def simulate(controller, traces, inference_time, update_period=1.0, rate_window=1.0,
+             skip_time=0.0):
+    """ Run a controller against an nvstreammux and pgie model.
+
+        The muxer takes at most one frame per source per batch and pushes it
+        when every source is in, or timeout_usec after its first frame. One
+        batch is inferred at a time, batches skipped by the interval cost
+        skip_time.
+
+        Keyword arguments:
+        - traces : per source sorted arrival times in seconds, see arrival_trace
+        - inference_time : function (num_frames) returning seconds
+        - update_period : seconds between controller updates
+        - rate_window : seconds over which the arrival rates are measured
+
+        Return:
+        - dict of the frame latency percentiles (ms), throughput, batch
+          fill, SLO misses and the (time, timeout_usec, interval) history
+    """
+    arrivals = sorted((t, source) for source, trace in enumerate(traces) for t in trace)
+    pending = [deque() for _ in traces]
+    recent = [deque() for _ in traces]
+    latencies = []
+    history = [(0.0, controller.timeout_usec, controller.interval)]
+    state = {"busy_until": 0.0, "batches": 0, "frames": 0}
+    batch_start = None
+    next_update = update_period
+
+    def push(now):
+        frames = [queue.popleft() for queue in pending if queue]
+        if controller.interval and state["batches"] % (controller.interval + 1):
+            cost = skip_time
+        else:
+            cost = inference_time(len(frames))
+        start = max(now, state["busy_until"])
+        done = start + cost
+        state["busy_until"] = done
+        state["batches"] += 1
+        state["frames"] += len(frames)
+        controller.observe_batch(done - now, len(frames), cost)
+        latencies.extend(done - arrival for arrival in frames)
+        return now if any(pending) else None
+
+    # Past the last arrival, long enough to push the last batch
+    end = (arrivals[-1][0] if arrivals else 0.0) + controller.max_timeout_usec / 1e6
+    for t, source in arrivals + [(end, None)]:
+        # Events before this arrival: batch timeouts and controller updates
+        while True:
+            deadline = batch_start + controller.timeout_usec / 1e6 \
+                if batch_start is not None else float("inf")
+            if deadline <= t and deadline <= next_update:
+                batch_start = push(deadline)
+            elif next_update <= t:
+                rates = []
+                for queue in recent:
+                    while queue and queue[0] < next_update - rate_window:
+                        queue.popleft()
+                    rates.append(len(queue) / rate_window)
+                controller.update(rates)
+                history.append((next_update, controller.timeout_usec, controller.interval))
+                next_update += update_period
+            else:
+                break
+        if source is None:
+            if any(pending):
+                push(t)
+            break
+        pending[source].append(t)
+        recent[source].append(t)
+        if batch_start is None:
+            batch_start = t
+        if all(pending):
+            batch_start = push(t)
+
+    latencies.sort()
+    duration = max(state["busy_until"], arrivals[-1][0]) if arrivals else 0.0
+    return {
+        "frames": state["frames"],
+        "batches": state["batches"],
+        "fps": round(state["frames"] / duration, 2) if duration else 0.0,
+        "batch_fill": round(state["frames"] / (state["batches"] * len(traces)), 3)
+        if state["batches"] else 0.0,
+        "p50_ms": round(percentile(latencies, 50) * 1e3, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1e3, 2),
+        "slo_miss": round(sum(latency > controller.latency_slo for latency in latencies)
+                          / len(latencies), 4) if latencies else 0.0,
+        "history": history,
+    }
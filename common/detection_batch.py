@@ -0,0 +1,200 @@
+"""
+    Columnar container for the detections of a batch.
+
+    DetectionBatch keeps one preallocated NumPy array per field instead of
+    one Python object per detection. A probe fills it in a single pass over
+    the batch metadata and consumers read the columns as zero-copy views:
+
+        detections = DetectionBatch()
+        ...
+        detections.fill_from_batch_meta(batch_meta)    # in the probe
+        boxes = detections.boxes()                     # (n, 4) view
+        for pad_index, frame_num, frame in detections.iter_frames():
+            ...
+
+    The arrays are reused from one batch to the next and only grow, so a
+    probe keeping its DetectionBatch does not allocate in steady state.
+    Views are only valid until the next clear() or fill.
+
+    Detections are added per frame: begin_frame(), append() for every
+    object, end_frame(). append() only collects a tuple, end_frame()
+    stores the frame with one slice assignment per column, as NumPy
+    scalar assignments cost more than the metadata walk itself. extend()
+    adds a whole frame from arrays.
+"""
+
+import numpy as np
+
+# Object id of objects not assigned by a tracker (UNTRACKED_OBJECT_ID)
+UNTRACKED_OBJECT_ID = 0xFFFFFFFFFFFFFFFF
+
+DETECTION_FIELDS = (
+    ("frame_num", np.int64),
+    ("pad_index", np.int32),
+    ("class_id", np.int32),
+    ("object_id", np.uint64),
+    ("confidence", np.float32),
+    ("left", np.float32),
+    ("top", np.float32),
+    ("width", np.float32),
+    ("height", np.float32),
+)
+FIELD_NAMES = tuple(name for name, _ in DETECTION_FIELDS)
+# Row layout of DetectionBatch.to_records(), packed without padding
+DETECTION_DTYPE = np.dtype([(name, np.dtype(dtype).newbyteorder("<"))
+                            for name, dtype in DETECTION_FIELDS])
+BOX_FIELDS = ("left", "top", "width", "height")
+
+
+class DetectionBatch:
+    """ Structure of arrays holding frame_num, pad_index, class_id,
+        object_id, confidence and left/top/width/height of detections.
+    """
+    __slots__ = FIELD_NAMES + ("size", "capacity", "frame_offsets", "frame_keys", "pending")
+
+    def __init__(self, capacity=256):
+        self.size = 0
+        self.capacity = 0
+        # frame_offsets[i]:frame_offsets[i + 1] are the detections of the
+        # frame frame_keys[i] = (pad_index, frame_num)
+        self.frame_offsets = [0]
+        self.frame_keys = []
+        # Rows appended to the open frame, stored by end_frame
+        self.pending = []
+        for name, dtype in DETECTION_FIELDS:
+            setattr(self, name, np.empty(0, dtype))
+        self.reserve(capacity)
+
+    def __len__(self):
+        return self.size
+
+    def reserve(self, capacity):
+        """ Make room for capacity detections, keeping the current ones. """
+        if capacity <= self.capacity:
+            return
+        capacity = max(capacity, 2 * self.capacity)
+        for name, dtype in DETECTION_FIELDS:
+            column = np.empty(capacity, dtype)
+            column[:self.size] = getattr(self, name)[:self.size]
+            setattr(self, name, column)
+        self.capacity = capacity
+
+    def clear(self):
+        self.size = 0
+        self.frame_offsets = [0]
+        self.frame_keys = []
+        self.pending.clear()
+
+    def begin_frame(self, pad_index, frame_num):
+        """ Start the detections of a new frame, see end_frame. """
+        self.frame_keys.append((pad_index, frame_num))
+
+    def end_frame(self):
+        """ Store the detections appended since begin_frame. """
+        pending = self.pending
+        if pending:
+            start = self.size
+            end = start + len(pending)
+            self.reserve(end)
+            for name, values in zip(FIELD_NAMES, zip(*pending)):
+                getattr(self, name)[start:end] = values
+            self.size = end
+            pending.clear()
+        self.frame_offsets.append(self.size)
+
+    def append(self, frame_num, pad_index, class_id, object_id, confidence,
+               left, top, width, height):
+        """ Add a detection to the open frame, stored by end_frame. """
+        self.pending.append((frame_num, pad_index, class_id, object_id, confidence,
+                             left, top, width, height))
+
+    def extend(self, frame_num, pad_index, columns):
+        """ Add a frame and its detections from arrays. Not to be called
+            between begin_frame and end_frame: it is a frame of its own.
+
+            Keyword arguments:
+            - frame_num, pad_index : frame of the detections
+            - columns : dict of field name to array, missing fields are
+              filled with 0 (UNTRACKED_OBJECT_ID for object_id)
+        """
+        count = len(next(iter(columns.values()))) if columns else 0
+        self.begin_frame(pad_index, frame_num)
+        start = self.size
+        self.reserve(start + count)
+        end = start + count
+        self.frame_num[start:end] = frame_num
+        self.pad_index[start:end] = pad_index
+        for name in FIELD_NAMES[2:]:
+            if name in columns:
+                getattr(self, name)[start:end] = columns[name]
+            else:
+                getattr(self, name)[start:end] = UNTRACKED_OBJECT_ID if name == "object_id" else 0
+        self.size = end
+        self.end_frame()
+
+    def fill_from_batch_meta(self, batch_meta):
+        """ Replace the contents with the objects of a NvDsBatchMeta. """
+        import pyds
+        self.clear()
+        append = self.pending.append
+        l_frame = batch_meta.frame_meta_list
+        while l_frame is not None:
+            frame_meta = pyds.NvDsFrameMeta.cast(l_frame.data)
+            frame_num = frame_meta.frame_num
+            pad_index = frame_meta.pad_index
+            self.begin_frame(pad_index, frame_num)
+            l_obj = frame_meta.obj_meta_list
+            while l_obj is not None:
+                obj_meta = pyds.NvDsObjectMeta.cast(l_obj.data)
+                rect_params = obj_meta.rect_params
+                append((frame_num, pad_index, obj_meta.class_id, obj_meta.object_id,
+                        obj_meta.confidence, rect_params.left, rect_params.top,
+                        rect_params.width, rect_params.height))
+                l_obj = l_obj.next
+            self.end_frame()
+            l_frame = l_frame.next
+        return self.size
+
+    def column(self, name):
+        """ Return a view of the filled part of a column. """
+        return getattr(self, name)[:self.size]
+
+    def columns(self):
+        return {name: getattr(self, name)[:self.size] for name in FIELD_NAMES}
+
+    def boxes(self):
+        """ Return the (n, 4) left, top, width, height boxes. This one is a
+            copy as the columns are stored separately.
+        """
+        return np.stack([getattr(self, name)[:self.size] for name in BOX_FIELDS], axis=1)
+
+    def frame_slice(self, index):
+        """ Return the slice of the detections of the index-th frame. """
+        return slice(self.frame_offsets[index], self.frame_offsets[index + 1])
+
+    def iter_frames(self):
+        """ Yield (pad_index, frame_num, columns) for every frame, columns
+            being a dict of views.
+        """
+        for index, (pad_index, frame_num) in enumerate(self.frame_keys):
+            frame = self.frame_slice(index)
+            yield pad_index, frame_num, {name: getattr(self, name)[frame]
+                                         for name in FIELD_NAMES}
+
+    def counts_by_class(self, class_nb):
+        """ Return the number of detections of each class id below class_nb. """
+        class_ids = self.class_id[:self.size]
+        return np.bincount(class_ids[(class_ids >= 0) & (class_ids < class_nb)],
+                           minlength=class_nb)
+
+    def to_records(self, out=None):
+        """ Return the detections as a DETECTION_DTYPE structured array,
+            written into out if it is given and large enough.
+        """
+        if out is None or len(out) < self.size:
+            out = np.empty(self.size, DETECTION_DTYPE)
+        else:
+            out = out[:self.size]
+        for name in FIELD_NAMES:
+            out[name] = getattr(self, name)[:self.size]
+        return out
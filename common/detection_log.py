@@ -0,0 +1,225 @@
+"""
+    Append-only binary log of detections, with a memory-mapped reader.
+
+    File layout, all little endian:
+    - header : magic "DSDLOG1\\0", version (u32), record size (u32)
+    - records : DETECTION_DTYPE rows (see common.detection_batch), in the
+      order the frames were written
+    - frame index : one FRAME_INDEX_DTYPE entry per frame written, frames
+      without detections included
+    - trailer : index offset (u64), index entries (u64), magic "DSDIDX1\\0"
+
+    The index and trailer are written by close(). A log that was not closed
+    (e.g. the app was killed) is still readable: the reader rebuilds the
+    index from the records, only losing the frames without detections.
+
+    A writer opened on an existing log continues it: the old index and
+    trailer are dropped, new records follow the old ones and close()
+    writes the index of both. overwrite=True starts a new log instead.
+
+        log = DetectionLogWriter("detections.dslog")
+        log.write_batch(detections)      # DetectionBatch, in the probe
+        log.close()
+
+        reader = DetectionLogReader("detections.dslog")
+        records = reader.query(pad_index=0, start_frame=100, end_frame=200)
+"""
+
+import os
+import sys
+import struct
+from array import array
+
+import numpy as np
+
+from common.detection_batch import DETECTION_DTYPE
+from common.offload_queue import OffloadQueue
+
+LOG_MAGIC = b"DSDLOG1\0"
+INDEX_MAGIC = b"DSDIDX1\0"
+LOG_VERSION = 1
+HEADER = struct.Struct("<8sII")
+TRAILER = struct.Struct("<QQ8s")
+FRAME_INDEX_DTYPE = np.dtype([
+    ("pad_index", "<i4"),
+    ("count", "<u4"),
+    ("frame_num", "<i8"),
+    ("first_record", "<u8"),
+])
+
+
+class DetectionLogWriter:
+    """ Writes DetectionBatch contents to a detection log. Records are
+        copied on the streaming thread and written by the worker of an
+        OffloadQueue, which also flushes the file after each batch it gets.
+
+        Keyword arguments:
+        - path : log file, continued if it is a detection log already
+        - queue_size : batches queued before the policy applies
+        - policy : OffloadQueue drop policy, "block" by default so that a
+          slow disk throttles the pipeline instead of leaving gaps in the
+          log, see dropped_batches for the others
+        - overwrite : truncate an existing file instead of continuing it
+    """
+    def __init__(self, path, queue_size=256, policy="block", overwrite=False):
+        self.path = path
+        self.record_count = 0
+        self.index_pad = array("i")
+        self.index_count = array("I")
+        self.index_frame = array("q")
+        self.index_first = array("Q")
+        if not overwrite and os.path.exists(path) and os.path.getsize(path):
+            self.open_existing()
+        else:
+            self.file = open(path, "wb")
+            self.file.write(HEADER.pack(LOG_MAGIC, LOG_VERSION, DETECTION_DTYPE.itemsize))
+        self.queue = OffloadQueue(self.write_items, queue_size, policy, "detection-log")
+
+    def open_existing(self):
+        """ Continue the log at path, raises ValueError if it is not one. """
+        reader = DetectionLogReader(self.path)
+        self.record_count = len(reader)
+        index = reader.index
+        self.index_pad.extend(index["pad_index"].tolist())
+        self.index_count.extend(index["count"].tolist())
+        self.index_frame.extend(index["frame_num"].tolist())
+        self.index_first.extend(index["first_record"].tolist())
+        del reader, index
+        self.file = open(self.path, "r+b")
+        # Drop the index, the trailer and a partially written last record
+        self.file.truncate(HEADER.size + self.record_count * DETECTION_DTYPE.itemsize)
+        self.file.seek(0, os.SEEK_END)
+
+    def write_batch(self, detections):
+        """ Queue the frames and detections of a DetectionBatch. """
+        offsets = detections.frame_offsets
+        counts = [offsets[i + 1] - offsets[i] for i in range(len(detections.frame_keys))]
+        return self.queue.put((list(detections.frame_keys), counts, detections.to_records()))
+
+    def write_items(self, items):
+        for frame_keys, counts, records in items:
+            first = self.record_count
+            for (pad_index, frame_num), count in zip(frame_keys, counts):
+                self.index_pad.append(pad_index)
+                self.index_count.append(count)
+                self.index_frame.append(frame_num)
+                self.index_first.append(first)
+                first += count
+            self.file.write(records.tobytes())
+            self.record_count += len(records)
+        self.file.flush()
+
+    @property
+    def dropped_batches(self):
+        """ Batches discarded by a drop policy, missing from the log. """
+        return self.queue.dropped
+
+    def close(self):
+        """ Write the pending records and the frame index. """
+        self.queue.close()
+        index = np.empty(len(self.index_pad), FRAME_INDEX_DTYPE)
+        index["pad_index"] = self.index_pad
+        index["count"] = self.index_count
+        index["frame_num"] = self.index_frame
+        index["first_record"] = self.index_first
+        index_offset = self.file.tell()
+        self.file.write(index.tobytes())
+        self.file.write(TRAILER.pack(index_offset, len(index), INDEX_MAGIC))
+        self.file.close()
+        if self.queue.dropped:
+            sys.stderr.write("Detection log dropped %d batches\n" % self.queue.dropped)
+
+
+class DetectionLogReader:
+    """ Random access to a detection log by stream and frame range. The
+        records are memory-mapped, only the pages of the queried frames
+        are read from disk.
+    """
+    def __init__(self, path):
+        self.path = path
+        size = os.path.getsize(path)
+        with open(path, "rb") as f:
+            magic, version, record_size = HEADER.unpack(f.read(HEADER.size))
+            if magic != LOG_MAGIC:
+                raise ValueError("%s is not a detection log" % path)
+            if version != LOG_VERSION or record_size != DETECTION_DTYPE.itemsize:
+                raise ValueError("Unsupported detection log version %d" % version)
+            trailer = None
+            if size >= HEADER.size + TRAILER.size:
+                f.seek(size - TRAILER.size)
+                trailer = TRAILER.unpack(f.read(TRAILER.size))
+        if trailer and trailer[2] == INDEX_MAGIC:
+            index_offset, index_entries, _ = trailer
+            record_count = (index_offset - HEADER.size) // record_size
+            self.index = np.fromfile(path, FRAME_INDEX_DTYPE, index_entries, offset=index_offset)
+        else:
+            # Not closed, ignore a partially written last record
+            record_count = (size - HEADER.size) // record_size
+            self.index = None
+        self.records = np.memmap(path, DETECTION_DTYPE, "r", HEADER.size, (record_count,))
+        if self.index is None:
+            self.index = self.rebuild_index()
+
+    def rebuild_index(self):
+        """ Build the frame index from the records, frames are contiguous. """
+        pad_index = self.records["pad_index"]
+        frame_num = self.records["frame_num"]
+        starts = np.flatnonzero(np.concatenate(
+            ([True], (pad_index[1:] != pad_index[:-1]) | (frame_num[1:] != frame_num[:-1]))
+        )) if len(self.records) else np.empty(0, np.int64)
+        index = np.empty(len(starts), FRAME_INDEX_DTYPE)
+        index["pad_index"] = pad_index[starts]
+        index["frame_num"] = frame_num[starts]
+        index["first_record"] = starts
+        index["count"] = np.diff(np.append(starts, len(self.records)))
+        return index
+
+    def __len__(self):
+        return len(self.records)
+
+    def streams(self):
+        """ Return the pad indexes present in the log. """
+        return np.unique(self.index["pad_index"]).tolist()
+
+    def frame_range(self, pad_index):
+        """ Return the (first, last) frame numbers logged for a stream. """
+        frames = self.index["frame_num"][self.index["pad_index"] == pad_index]
+        if not len(frames):
+            return None
+        return int(frames.min()), int(frames.max())
+
+    def select_frames(self, pad_index=None, start_frame=None, end_frame=None):
+        """ Return the index entries of the frames in [start_frame, end_frame]. """
+        mask = np.ones(len(self.index), bool)
+        if pad_index is not None:
+            mask &= self.index["pad_index"] == pad_index
+        if start_frame is not None:
+            mask &= self.index["frame_num"] >= start_frame
+        if end_frame is not None:
+            mask &= self.index["frame_num"] <= end_frame
+        return self.index[mask]
+
+    def query(self, pad_index=None, start_frame=None, end_frame=None):
+        """ Return the records of a stream (all streams if pad_index is None)
+            in the frame range [start_frame, end_frame], in file order.
+        """
+        frames = self.select_frames(pad_index, start_frame, end_frame)
+        counts = frames["count"].astype(np.int64)
+        total = int(counts.sum())
+        if not total:
+            return self.records[:0]
+        first = frames["first_record"].astype(np.int64)
+        if first[-1] + counts[-1] - first[0] == total:
+            # Contiguous frames, return a view of the mapping
+            return self.records[first[0]:first[0] + total]
+        # Record numbers of every selected frame without a Python loop
+        ends = np.cumsum(counts)
+        positions = np.arange(total) + np.repeat(first - ends + counts, counts)
+        return self.records[positions]
+
+    def iter_frames(self, pad_index=None, start_frame=None, end_frame=None):
+        """ Yield (pad_index, frame_num, records) for the selected frames. """
+        for entry in self.select_frames(pad_index, start_frame, end_frame):
+            first = int(entry["first_record"])
+            yield (int(entry["pad_index"]), int(entry["frame_num"]),
+                   self.records[first:first + int(entry["count"])])
@@ -0,0 +1,167 @@
+"""
+    Per-stream inference scheduling driven by scene activity.
+
+    The pgie interval applies to every stream of a batch. An
+    InferenceScheduler instead picks an interval per stream from the
+    detection counts, and the parser probe skips the tensor parsing of the
+    frames a stream skips: a static camera is parsed every max_interval + 1
+    frames, a busy one every frame. Skipped frames are not dropped, they go
+    on through the pipeline with the detections of the last parsed frame of
+    their stream, so the display and the outputs keep every frame.
+
+        scheduler = InferenceScheduler(num_streams, max_interval=4)
+        pgie_src_pad.add_probe(Gst.PadProbeType.BUFFER, parser_probe, (parser, scheduler))
+
+    common.tensor_meta.parser_probe then calls, for every frame:
+
+        if scheduler.should_infer(frame_meta.pad_index):
+            result = parser.decode(outputs)
+            scheduler.observe_detections(frame_meta.pad_index, len(result[0]))
+            scheduler.hold(frame_meta.pad_index, result)
+        else:
+            result = scheduler.held(frame_meta.pad_index)
+
+    nvinfer still runs on every frame: what is saved is the Python parsing,
+    the costly part of a tensor-meta pipeline. The GPU load itself is
+    reduced by the pgie interval, see common.batch_controller.
+
+    The activity is an exponential moving average in [0, 1] of the relative
+    change of the detection count between two parsed frames.
+
+    report() gives the effective inference rate of every stream.
+"""
+
+import time
+
+
+class StreamSchedule:
+    """ Activity and counters of a stream. """
+    __slots__ = ("activity", "interval", "skipped", "seen", "inferred", "previous_count",
+                 "held", "report_seen", "report_inferred")
+
+    def __init__(self):
+        # Streams start busy, until the activity says otherwise
+        self.activity = 1.0
+        self.interval = 0
+        self.skipped = 0
+        self.seen = 0
+        self.inferred = 0
+        self.previous_count = None
+        # Result of the last parsed frame, reused by the skipped ones
+        self.held = None
+        self.report_seen = 0
+        self.report_inferred = 0
+
+
+class InferenceScheduler:
+    """ Chooses which frames of every stream are inferred.
+
+        Keyword arguments:
+        - num_streams : number of streams, the pad_index range
+        - max_interval : frames skipped between two inferences of an idle
+          stream
+        - idle_activity, busy_activity : activity at or below which a stream
+          gets max_interval, and at or above which it gets 0, linear between
+        - smoothing : weight of a new activity sample in the average
+    """
+    def __init__(self, num_streams, max_interval=4, idle_activity=0.05, busy_activity=0.3,
+                 smoothing=0.3):
+        self.max_interval = max_interval
+        self.idle_activity = idle_activity
+        self.busy_activity = busy_activity
+        self.smoothing = smoothing
+        self.streams = [StreamSchedule() for _ in range(num_streams)]
+        self.report_ns = time.perf_counter_ns()
+
+    def reset(self, stream_id):
+        """ Forget the activity of a stream, e.g. when its source changes.
+            The frame counters go on: they are exported as counters.
+        """
+        stream = self.streams[stream_id]
+        stream.activity = 1.0
+        stream.interval = 0
+        stream.skipped = 0
+        stream.previous_count = None
+        stream.held = None
+
+    def should_infer(self, stream_id):
+        """ Count a frame of a stream, return whether to infer it. """
+        stream = self.streams[stream_id]
+        stream.seen += 1
+        if stream.skipped < stream.interval:
+            stream.skipped += 1
+            return False
+        stream.skipped = 0
+        stream.inferred += 1
+        return True
+
+    def observe(self, stream_id, activity):
+        """ Add an activity sample in [0, 1] and update the interval. """
+        stream = self.streams[stream_id]
+        stream.activity += self.smoothing * (min(max(activity, 0.0), 1.0) - stream.activity)
+        span = self.busy_activity - self.idle_activity
+        idleness = min(max((self.busy_activity - stream.activity) / span, 0.0), 1.0)
+        stream.interval = int(round(idleness * self.max_interval))
+
+    def observe_detections(self, stream_id, num_objects):
+        """ Activity from the detection count of an inferred frame. """
+        stream = self.streams[stream_id]
+        previous = stream.previous_count
+        stream.previous_count = num_objects
+        if previous is not None:
+            self.observe(stream_id, abs(num_objects - previous) / max(num_objects, previous, 1))
+
+    def hold(self, stream_id, result):
+        """ Keep the result of a parsed frame for the frames skipped next. """
+        self.streams[stream_id].held = result
+
+    def held(self, stream_id):
+        """ Return the result of the last parsed frame of a stream, or None. """
+        return self.streams[stream_id].held
+
+    def report(self):
+        """ Return per stream the frame rate, the effective inference rate,
+            the interval and the activity, since the previous report.
+        """
+        now = time.perf_counter_ns()
+        elapsed = (now - self.report_ns) / 1e9
+        self.report_ns = now
+        report = {}
+        for stream_id, stream in enumerate(self.streams):
+            seen = stream.seen - stream.report_seen
+            inferred = stream.inferred - stream.report_inferred
+            stream.report_seen = stream.seen
+            stream.report_inferred = stream.inferred
+            report["stream{0}".format(stream_id)] = {
+                "fps": round(seen / elapsed, 2) if elapsed > 0 else 0.0,
+                "inferred_fps": round(inferred / elapsed, 2) if elapsed > 0 else 0.0,
+                "interval": stream.interval,
+                "activity": round(stream.activity, 3),
+            }
+        return report
+
+    def print_report(self):
+        """ GLib timeout callback printing the report. """
+        print("**INFERENCE: ", self.report(), "\n")
+        return True
+
+    def register_metrics(self, registry):
+        """ Expose the schedule in a common.metrics_exporter registry. """
+        seen = registry.counter("stream_frames_seen", "Frames reaching the parser probe", ["stream"])
+        inferred = registry.counter("stream_frames_inferred", "Frames whose output tensors were parsed",
+                                    ["stream"])
+        interval = registry.gauge("stream_inference_interval",
+                                  "Frames skipped between two inferences", ["stream"])
+        activity = registry.gauge("stream_activity", "Scene activity average", ["stream"])
+        # Totals at the previous scrape, the counters are incremented by the difference
+        counted = [[0, 0] for _ in self.streams]
+
+        def collect():
+            for stream_id, stream in enumerate(self.streams):
+                seen.labels(stream_id).inc(stream.seen - counted[stream_id][0])
+                inferred.labels(stream_id).inc(stream.inferred - counted[stream_id][1])
+                counted[stream_id] = [stream.seen, stream.inferred]
+                interval.labels(stream_id).set(stream.interval)
+                activity.labels(stream_id).set(round(stream.activity, 3))
+
+        registry.add_collector(collect)
@@ -0,0 +1,77 @@
+"""
+    Label names loaded once and shared by every probe of an app.
+
+    The label file is read when the registry is created. With hot_reload,
+    refresh() re-reads it when its mtime changes, checking the file at most
+    once every check_interval seconds, so calling it once per buffer only
+    costs a clock read on the streaming thread.
+"""
+
+import io
+import os
+import sys
+import time
+
+
+def read_label_file(filepath):
+    """ Read a label file and convert it to string list """
+    with io.open(filepath, "r") as f:
+        return [line.rstrip("\n") for line in f]
+
+
+class LabelRegistry:
+    """ Label names of a label file, with name to class id lookup. """
+    def __init__(self, filepath, hot_reload=False, check_interval=1.0):
+        self.filepath = filepath
+        self.hot_reload = hot_reload
+        self.check_interval = check_interval
+        self.next_check = 0.0
+        self.mtime = None
+        # (names, ids) is swapped in a single assignment so readers on other
+        # threads never see names and ids from different files.
+        self.labels = ([], {})
+        self.load()
+
+    def load(self):
+        """ (Re)read the label file. """
+        mtime = os.stat(self.filepath).st_mtime
+        names = read_label_file(self.filepath)
+        self.labels = (names, {name: index for index, name in enumerate(names)})
+        self.mtime = mtime
+
+    def refresh(self):
+        """ Reload the label file if hot reload is enabled and it changed.
+            Return True if the labels were reloaded.
+        """
+        if not self.hot_reload:
+            return False
+        now = time.monotonic()
+        if now < self.next_check:
+            return False
+        self.next_check = now + self.check_interval
+        try:
+            if os.stat(self.filepath).st_mtime == self.mtime:
+                return False
+            self.load()
+        except OSError as e:
+            sys.stderr.write("Unable to reload %s: %s\n" % (self.filepath, e))
+            return False
+        print("Reloaded labels from", self.filepath)
+        return True
+
+    @property
+    def names(self):
+        return self.labels[0]
+
+    def index_of(self, name):
+        """ Return the class id of a label name. """
+        return self.labels[1][name]
+
+    def name_of(self, class_id, default=0):
+        """ Return the label of a class id, or the label of default if the
+            class id is out of range.
+        """
+        names = self.labels[0]
+        if class_id >= len(names):
+            class_id = default
+        return names[class_id]
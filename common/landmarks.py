@@ -0,0 +1,80 @@
+"""
+    Facial landmarks carried in the object meta.
+
+    The 5 landmarks (10 coordinates) of a face are packed in the 4 int64
+    slots of NvDsObjectMeta.misc_obj_info, so they travel with the object
+    through the pipeline without a user meta allocation:
+    - every slot holds 3 coordinates as 16-bit quarter-pixel fixed point
+      (0 to 16383.75 pixels) and LANDMARK_MAGIC in its upper 16 bits
+    - the last 2 coordinates of the 4th slot are unused
+
+    Downstream probes read them back with object_landmarks(obj_meta).
+    draw_landmarks adds them to the frame as OSD circles.
+"""
+
+import numpy as np
+import pyds
+
+LANDMARK_MAGIC = 0x4C4D
+LANDMARK_SLOTS = 4
+COORDS_PER_SLOT = 3
+FIXED_POINT_SCALE = 4.0
+# nvdsosd circles per display meta (MAX_ELEMENTS_IN_DISPLAY_META)
+MAX_CIRCLES_PER_DISPLAY_META = 16
+
+
+def pack_landmarks(landmarks):
+    """ Pack (N, 10) landmark coordinates in frame pixels into an (N, 4)
+        int64 array of misc_obj_info slots.
+    """
+    landmarks = np.asarray(landmarks, dtype=np.float32).reshape(len(landmarks), -1)
+    coords = np.zeros((len(landmarks), LANDMARK_SLOTS * COORDS_PER_SLOT), dtype=np.int64)
+    coords[:, :landmarks.shape[1]] = np.clip(
+        np.rint(landmarks * FIXED_POINT_SCALE), 0, 0xFFFF)
+    coords = coords.reshape(len(landmarks), LANDMARK_SLOTS, COORDS_PER_SLOT)
+    return (coords[:, :, 0] | (coords[:, :, 1] << 16) | (coords[:, :, 2] << 32)
+            | (LANDMARK_MAGIC << 48))
+
+
+def unpack_landmarks(slots, count=5):
+    """ Unpack misc_obj_info slots into a (count, 2) array of coordinates,
+        or return None if the slots do not hold landmarks.
+    """
+    slots = np.asarray(slots, dtype=np.int64)
+    if slots.shape[-1] < LANDMARK_SLOTS or np.any((slots[:LANDMARK_SLOTS] >> 48) != LANDMARK_MAGIC):
+        return None
+    shifts = np.array([0, 16, 32], dtype=np.int64)
+    coords = (slots[:LANDMARK_SLOTS, None] >> shifts) & 0xFFFF
+    return (coords.reshape(-1)[:2 * count] / FIXED_POINT_SCALE).reshape(count, 2)
+
+
+def set_object_landmarks(obj_meta, packed):
+    """ Store a row of pack_landmarks in the object meta. """
+    misc_obj_info = obj_meta.misc_obj_info
+    for i, value in enumerate(packed.tolist()):
+        misc_obj_info[i] = value
+
+
+def object_landmarks(obj_meta):
+    """ Return the (5, 2) landmarks of an object, or None if it has none. """
+    return unpack_landmarks(obj_meta.misc_obj_info)
+
+
+def draw_landmarks(batch_meta, frame_meta, landmarks, radius=3):
+    """ Add the (N, 10) landmarks of a frame as OSD circles, as many display
+        metas as needed being acquired.
+    """
+    points = np.rint(np.asarray(landmarks).reshape(-1, 2)).astype(np.int64).tolist()
+    for start in range(0, len(points), MAX_CIRCLES_PER_DISPLAY_META):
+        chunk = points[start:start + MAX_CIRCLES_PER_DISPLAY_META]
+        display_meta = pyds.nvds_acquire_display_meta_from_pool(batch_meta)
+        display_meta.num_circles = len(chunk)
+        for i, (x, y) in enumerate(chunk):
+            circle_params = display_meta.circle_params[i]
+            circle_params.xc = x
+            circle_params.yc = y
+            circle_params.radius = radius
+            circle_params.circle_color.set(0.0, 1.0, 0.0, 1.0)
+            circle_params.has_bg_color = 1
+            circle_params.bg_color.set(0.0, 1.0, 0.0, 1.0)
+        pyds.nvds_add_display_meta_to_frame(frame_meta, display_meta)
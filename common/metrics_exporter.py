@@ -0,0 +1,316 @@
+"""
+    Minimal OpenMetrics exporter for the pipeline probes.
+
+    Metrics are kept in a MetricsRegistry and served as OpenMetrics text by
+    a MetricsServer running an HTTP server on a background thread:
+
+        registry = MetricsRegistry()
+        frames = registry.counter("frames", "Frames seen by the probe", ["stream"])
+        MetricsServer(registry, 9100).start()
+        ...
+        frames.labels("0").inc()
+
+    Updates are not locked: each labelled child is expected to be updated
+    from a single streaming thread, which is the case for pad probes.
+    Values are plain Python numbers so a concurrent scrape at worst reads
+    a value one update old.
+"""
+
+import sys
+import threading
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+OPENMETRICS_CONTENT_TYPE = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+# Probe execution time buckets, in seconds
+PROBE_TIME_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+                      0.025, 0.05, 0.1)
+
+
+def escape_label_value(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def format_labels(names, values, extra=""):
+    pairs = ['%s="%s"' % (name, escape_label_value(value))
+             for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class CounterChild:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+
+class GaugeChild:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def set(self, value):
+        self.value = value
+
+
+class HistogramChild:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        # Non cumulative counts, the last one is the +Inf bucket
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Metric:
+    """ A metric family: one child per label value combination. """
+    type_name = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.children = {}
+        self.lock = threading.Lock()
+
+    def new_child(self):
+        raise NotImplementedError
+
+    def labels(self, *values):
+        """ Return the child for the given label values, creating it once. """
+        child = self.children.get(values)
+        if child is None:
+            with self.lock:
+                child = self.children.setdefault(values, self.new_child())
+        return child
+
+    def render_samples(self, lines):
+        raise NotImplementedError
+
+    def render(self, lines):
+        lines.append("# TYPE %s %s" % (self.name, self.type_name))
+        lines.append("# HELP %s %s" % (self.name, self.documentation))
+        self.render_samples(lines)
+
+
+class Counter(Metric):
+    type_name = "counter"
+
+    def new_child(self):
+        return CounterChild()
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+    def render_samples(self, lines):
+        for values, child in list(self.children.items()):
+            lines.append("%s_total%s %s" % (self.name, format_labels(self.labelnames, values),
+                                            child.value))
+
+
+class Gauge(Metric):
+    type_name = "gauge"
+
+    def new_child(self):
+        return GaugeChild()
+
+    def set(self, value):
+        self.labels().set(value)
+
+    def render_samples(self, lines):
+        for values, child in list(self.children.items()):
+            lines.append("%s%s %s" % (self.name, format_labels(self.labelnames, values),
+                                      child.value))
+
+
+class Histogram(Metric):
+    type_name = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=PROBE_TIME_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def new_child(self):
+        return HistogramChild(self.buckets)
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+    def render_samples(self, lines):
+        for values, child in list(self.children.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, child.counts):
+                cumulative += count
+                labels = format_labels(self.labelnames, values, 'le="%s"' % bound)
+                lines.append("%s_bucket%s %d" % (self.name, labels, cumulative))
+            labels = format_labels(self.labelnames, values, 'le="+Inf"')
+            lines.append("%s_bucket%s %d" % (self.name, labels, child.count))
+            labels = format_labels(self.labelnames, values)
+            lines.append("%s_count%s %d" % (self.name, labels, child.count))
+            lines.append("%s_sum%s %s" % (self.name, labels, child.sum))
+
+
+class MetricsRegistry:
+    """ Holds the metrics of an app. Collectors are called before every
+        scrape to refresh values that are pulled rather than pushed.
+    """
+    def __init__(self, prefix="deepstream_"):
+        self.prefix = prefix
+        self.metrics = []
+        self.collectors = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(self.prefix + name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self.register(Gauge(self.prefix + name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=PROBE_TIME_BUCKETS):
+        return self.register(Histogram(self.prefix + name, documentation, labelnames,
+                                       buckets))
+
+    def add_collector(self, collector):
+        """ collector() is called before each scrape. """
+        self.collectors.append(collector)
+
+    def render(self):
+        """ Return the OpenMetrics text exposition of every metric. """
+        for collector in self.collectors:
+            try:
+                collector()
+            except Exception as e:
+                sys.stderr.write("Metrics collector failed: %s\n" % e)
+        lines = []
+        for metric in self.metrics:
+            metric.render(lines)
+        lines.append("# EOF")
+        return "\n".join(lines) + "\n"
+
+
+class MetricsServer:
+    """ Serves registry.render() on http://<address>:<port>/metrics from a
+        daemon thread. Port 0 picks a free port, see self.port.
+    """
+    def __init__(self, registry, port, address="127.0.0.1"):
+        self.registry = registry
+        self.address = address
+        self.port = port
+        self.httpd = None
+        self.thread = None
+
+    def make_handler(self):
+        registry = self.registry
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = registry.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", OPENMETRICS_CONTENT_TYPE)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        self.httpd = ThreadingHTTPServer((self.address, self.port), self.make_handler())
+        self.httpd.daemon_threads = True
+        self.port = self.httpd.server_address[1]
+        self.thread = threading.Thread(target=self.httpd.serve_forever,
+                                       name="metrics-server", daemon=True)
+        self.thread.start()
+        print("Serving metrics on http://%s:%d/metrics" % (self.address, self.port))
+        return self
+
+    def stop(self):
+        if self.httpd:
+            self.httpd.shutdown()
+            self.httpd.server_close()
+            self.httpd = None
+
+
+class PipelineMetrics:
+    """ Standard metrics fed by the probes of the multi-stream apps. """
+    def __init__(self, registry, perf_data=None, class_names=()):
+        self.registry = registry
+        self.perf_data = perf_data
+        self.class_names = list(class_names)
+        self.frames = registry.counter("frames", "Frames seen by the probe", ["stream"])
+        self.objects = registry.counter("objects", "Objects detected", ["stream", "class"])
+        self.dropped_buffers = registry.counter(
+            "dropped_buffers", "Buffers dropped by the pipeline elements", ["element"])
+        self.queue_overruns = registry.counter(
+            "queue_overruns", "Times a queue was full when a buffer came", ["element"])
+        # Element name -> dropped total of its last QoS message
+        self.qos_dropped = {}
+        self.probe_time = registry.histogram(
+            "probe_duration_seconds", "Probe execution time", ["probe"])
+        self.stream_fps = registry.gauge("stream_fps", "Stream frame rate", ["stream"])
+        if perf_data is not None:
+            registry.add_collector(self.collect_fps)
+
+    def collect_fps(self):
+        for i in range(self.perf_data.num_streams):
+            if self.perf_data.frame_counts[i]:
+                self.stream_fps.labels(i).set(self.perf_data.get_window_fps(i))
+
+    def class_name(self, class_id):
+        if 0 <= class_id < len(self.class_names):
+            return self.class_names[class_id]
+        return str(class_id)
+
+    def count_frame(self, pad_index, obj_counter):
+        """ Count a frame and its objects, obj_counter maps class id to count. """
+        self.frames.labels(pad_index).inc()
+        for class_id, count in obj_counter.items():
+            if count:
+                self.objects.labels(pad_index, self.class_name(class_id)).inc(count)
+
+    def on_qos_message(self, bus, message):
+        """ Bus "message::qos" handler counting the buffers dropped by the
+            elements posting QoS messages: sinks and decoders with qos on.
+        """
+        _format, _processed, dropped = message.parse_qos_stats()
+        name = message.src.get_name()
+        # The messages carry the element total, -1 when unknown
+        previous = self.qos_dropped.get(name, 0)
+        if dropped > previous:
+            self.dropped_buffers.labels(name).inc(dropped - previous)
+            self.qos_dropped[name] = dropped
+        return True
+
+    def watch_queue(self, queue):
+        """ Count the overruns of a queue element, and as dropped buffers
+            those of a leaky queue.
+        """
+        name = queue.get_name()
+
+        def on_overrun(element):
+            self.queue_overruns.labels(name).inc()
+            if element.get_property("leaky"):
+                self.dropped_buffers.labels(name).inc()
+
+        queue.connect("overrun", on_overrun)
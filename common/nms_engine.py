@@ -0,0 +1,350 @@
+"""
+    NumPy non maximum suppression engine.
+
+    Boxes are (N, 4) float32 arrays of corners (x1, y1, x2, y2) and scores
+    are (N,) arrays. The IoU matrix is computed block by block so memory
+    stays bounded at block_size * N whatever the number of candidates.
+    Class-aware suppression is done in a single pass (batched_nms), either
+    by shifting every class into its own coordinate range or, when there
+    are many small classes, by only computing the IoU of boxes sharing a
+    class. The "sweep" method only computes the IoU of boxes that overlap,
+    found with a sort along x, which keeps crowded frames of thousands of
+    boxes close to linear.
+"""
+
+import numpy as np
+
+IOU_BLOCK_SIZE = 256
+NMS_METHODS = ("greedy", "sweep", "linear", "gaussian")
+SOFT_NMS_METHODS = ("linear", "gaussian")
+# batched_nms switches to same-class pairs when they are this many times
+# fewer than the N * N entries of the IoU matrix.
+SPARSE_PAIR_RATIO = 4
+# Maximum number of candidate pairs overlap_pairs holds at once
+SWEEP_CHUNK_PAIRS = 1 << 20
+
+
+def ltwh_to_corners(left, top, width, height):
+    """ Stack left/top/width/height columns into an (N, 4) corner array. """
+    boxes = np.empty((len(left), 4), dtype=np.float32)
+    boxes[:, 0] = left
+    boxes[:, 1] = top
+    boxes[:, 2] = boxes[:, 0] + width
+    boxes[:, 3] = boxes[:, 1] + height
+    return boxes
+
+
+def box_areas(boxes):
+    """ Return the area of every box of an (N, 4) corner array. """
+    return (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+
+
+def iou_matrix(boxes_a, boxes_b, areas_a=None, areas_b=None):
+    """ Return the (Na, Nb) intersection over union of 2 box arrays.
+        A pair whose union is null has an IoU of 0.
+    """
+    if areas_a is None:
+        areas_a = box_areas(boxes_a)
+    if areas_b is None:
+        areas_b = box_areas(boxes_b)
+    overlap_x = np.minimum(boxes_a[:, None, 2], boxes_b[None, :, 2])
+    overlap_x -= np.maximum(boxes_a[:, None, 0], boxes_b[None, :, 0])
+    overlap_y = np.minimum(boxes_a[:, None, 3], boxes_b[None, :, 3])
+    overlap_y -= np.maximum(boxes_a[:, None, 1], boxes_b[None, :, 1])
+    intersection = np.clip(overlap_x, 0, None) * np.clip(overlap_y, 0, None)
+    union = areas_a[:, None] + areas_b[None, :] - intersection
+    return np.divide(intersection, union, out=np.zeros_like(intersection),
+                     where=union > 0)
+
+
+def pairwise_iou(boxes_a, boxes_b):
+    """ Return the IoU of boxes_a[i] and boxes_b[i] for every i. """
+    overlap_x = np.minimum(boxes_a[:, 2], boxes_b[:, 2])
+    overlap_x -= np.maximum(boxes_a[:, 0], boxes_b[:, 0])
+    overlap_y = np.minimum(boxes_a[:, 3], boxes_b[:, 3])
+    overlap_y -= np.maximum(boxes_a[:, 1], boxes_b[:, 1])
+    intersection = np.clip(overlap_x, 0, None) * np.clip(overlap_y, 0, None)
+    union = box_areas(boxes_a) + box_areas(boxes_b) - intersection
+    return np.divide(intersection, union, out=np.zeros_like(intersection),
+                     where=union > 0)
+
+
+def same_key_pairs(keys):
+    """ Return (first, second) index arrays of every unordered pair of
+        elements sharing the same key.
+    """
+    count = len(keys)
+    order = np.argsort(keys, kind="stable")
+    sorted_keys = keys[order]
+    starts = np.flatnonzero(np.r_[True, sorted_keys[1:] != sorted_keys[:-1]])
+    sizes = np.diff(np.r_[starts, count])
+    # Each element pairs with the elements after it in its group.
+    partners = np.repeat(starts + sizes, sizes) - np.arange(count) - 1
+    first = np.repeat(np.arange(count), partners)
+    second = first + 1 + np.arange(len(first)) - np.repeat(np.cumsum(partners) - partners,
+                                                           partners)
+    return order[first], order[second]
+
+
+def same_key_pair_count(keys):
+    """ Return the number of pairs same_key_pairs would list, without
+        listing them.
+    """
+    sizes = np.unique(keys, return_counts=True)[1].astype(np.int64)
+    return int((sizes * (sizes - 1) // 2).sum())
+
+
+def overlap_pairs(boxes, chunk_pairs=SWEEP_CHUNK_PAIRS):
+    """ Return (first, second) index arrays of every unordered pair of
+        boxes with a non empty intersection.
+
+        Boxes are sorted by x1 so the boxes overlapping a box along x are
+        the next ones up to its x2. Those candidates are generated for
+        rows of boxes holding about chunk_pairs of them at a time, then
+        filtered along y.
+    """
+    count = len(boxes)
+    order = np.argsort(boxes[:, 0], kind="stable")
+    sorted_boxes = boxes[order]
+    ends = np.searchsorted(sorted_boxes[:, 0], sorted_boxes[:, 2], side="left")
+    partners = np.maximum(ends - np.arange(count) - 1, 0)
+    bounds = np.searchsorted(np.cumsum(partners), np.arange(chunk_pairs, partners.sum(),
+                                                            chunk_pairs))
+    firsts, seconds = [], []
+    for start, stop in zip(np.r_[0, bounds + 1], np.r_[bounds + 1, count]):
+        rows = np.arange(start, stop)
+        row_partners = partners[start:stop]
+        first = np.repeat(rows, row_partners)
+        second = first + 1 + np.arange(len(first)) - np.repeat(
+            np.cumsum(row_partners) - row_partners, row_partners)
+        overlap = (sorted_boxes[second, 1] < sorted_boxes[first, 3]) & \
+            (sorted_boxes[first, 1] < sorted_boxes[second, 3])
+        firsts.append(first[overlap])
+        seconds.append(second[overlap])
+    first = np.concatenate(firsts)
+    second = np.concatenate(seconds)
+    return order[first], order[second]
+
+
+def nms_pairs(boxes, scores, first, second, iou_threshold):
+    """ Greedy non maximum suppression restricted to candidate pairs.
+
+        Only the (first[i], second[i]) pairs can suppress each other, which
+        gives the same result as nms when every overlapping pair is listed.
+
+        Return:
+        - indices of the kept boxes, sorted by decreasing score.
+    """
+    order = np.argsort(-scores, kind="stable")
+    rank = np.empty(len(order), dtype=np.intp)
+    rank[order] = np.arange(len(order))
+    over = pairwise_iou(boxes[first], boxes[second]) > iou_threshold
+    rank_a = rank[first[over]]
+    rank_b = rank[second[over]]
+    # Edges go from the higher scored box to the box it may suppress.
+    src = np.minimum(rank_a, rank_b)
+    dst = np.maximum(rank_a, rank_b)
+    edge_order = np.argsort(src, kind="stable")
+    src = src[edge_order]
+    dst = dst[edge_order]
+    suppressed = np.zeros(len(order), dtype=bool)
+    sources, starts = np.unique(src, return_index=True)
+    stops = np.r_[starts[1:], len(src)]
+    for source, start, stop in zip(sources.tolist(), starts.tolist(), stops.tolist()):
+        if not suppressed[source]:
+            suppressed[dst[start:stop]] = True
+    return order[~suppressed]
+
+
+def top_k_indices(scores, k):
+    """ Return the indices of the k highest scores sorted by decreasing
+        score, like np.argsort(-scores, kind="stable")[:k] but selecting
+        them with a partition in O(n + k log k).
+    """
+    count = len(scores)
+    if k <= 0 or k >= count:
+        return np.argsort(-scores, kind="stable")
+    negated = -np.asarray(scores)
+    kth = np.partition(negated, k - 1)[k - 1]
+    above = np.flatnonzero(negated < kth)
+    # Boxes tied with the k-th score are taken in input order
+    ties = np.flatnonzero(negated == kth)[:k - len(above)]
+    selected = np.concatenate((above, ties))
+    return selected[np.argsort(negated[selected], kind="stable")]
+
+
+def per_key_top_k(scores, keys, k):
+    """ Return the sorted indices of the elements ranking in the k highest
+        scores of their key, e.g. the pre-NMS top-k of every class.
+    """
+    count = len(scores)
+    if k <= 0 or k >= count:
+        return np.arange(count)
+    _, inverse, counts = np.unique(keys, return_inverse=True, return_counts=True)
+    if counts.max() <= k:
+        return np.arange(count)
+    keep = np.ones(count, dtype=bool)
+    for key_index in np.flatnonzero(counts > k):
+        members = np.flatnonzero(inverse == key_index)
+        keep[members] = False
+        keep[members[top_k_indices(scores[members], k)]] = True
+    return np.flatnonzero(keep)
+
+
+def nms(boxes, scores, iou_threshold, block_size=IOU_BLOCK_SIZE, max_keep=0):
+    """ Greedy non maximum suppression.
+
+        A box is suppressed when its IoU with a higher scored kept box is
+        above iou_threshold. Ties keep the input order.
+
+        With max_keep, the suppression stops as soon as max_keep boxes are
+        kept: lower scored boxes can not change the first kept ones, so the
+        result is nms(...)[:max_keep] for a fraction of the work.
+
+        Return:
+        - indices of the kept boxes, sorted by decreasing score.
+    """
+    order = np.argsort(-scores, kind="stable")
+    sorted_boxes = boxes[order]
+    areas = box_areas(sorted_boxes)
+    count = len(order)
+    suppressed = np.zeros(count, dtype=bool)
+    kept = 0
+    for start in range(0, count, block_size):
+        stop = min(start + block_size, count)
+        if suppressed[start:stop].all():
+            continue
+        # One block of rows against every box that may still be suppressed.
+        # Only the upper triangle matters: a box never suppresses a box
+        # with a higher score.
+        over = iou_matrix(sorted_boxes[start:stop], sorted_boxes[start:],
+                          areas[start:stop], areas[start:]) > iou_threshold
+        over = np.triu(over, k=1)
+        # Boxes overlapping nothing can be skipped, which leaves very few
+        # Python iterations once class offsets separate the boxes.
+        for row in np.flatnonzero(over.any(axis=1)):
+            if not suppressed[start + row]:
+                suppressed[start:] |= over[row]
+        if max_keep:
+            # The block rows are final once the block is processed
+            kept += stop - start - int(np.count_nonzero(suppressed[start:stop]))
+            if kept >= max_keep:
+                return order[:stop][~suppressed[:stop]][:max_keep]
+    return order[~suppressed]
+
+
+def soft_nms(boxes, scores, iou_threshold=0.3, sigma=0.5, method="linear",
+             score_threshold=0.001, max_keep=0):
+    """ Soft non maximum suppression (Bodla et al. 2017).
+
+        Instead of dropping overlapping boxes, their score is decayed:
+        - linear : score * (1 - iou) when iou > iou_threshold
+        - gaussian : score * exp(-iou^2 / sigma)
+        Boxes whose decayed score falls under score_threshold are dropped.
+        With max_keep, the loop stops once max_keep boxes are kept.
+
+        Return:
+        - indices of the kept boxes, sorted by decreasing decayed score.
+        - decayed scores of the kept boxes.
+    """
+    if method not in ("linear", "gaussian"):
+        raise ValueError("unknown soft-nms method: %s" % method)
+    scores = np.array(scores, dtype=np.float32)
+    areas = box_areas(boxes)
+    active = np.flatnonzero(scores >= score_threshold)
+    keep = []
+    kept_scores = []
+    while active.size:
+        best = active[np.argmax(scores[active])]
+        keep.append(best)
+        kept_scores.append(scores[best])
+        active = active[active != best]
+        if not active.size or len(keep) == max_keep:
+            break
+        ious = iou_matrix(boxes[best:best + 1], boxes[active],
+                          areas[best:best + 1], areas[active])[0]
+        if method == "linear":
+            decay = np.where(ious > iou_threshold, 1.0 - ious, 1.0)
+        else:
+            decay = np.exp(-(ious * ious) / sigma)
+        scores[active] *= decay
+        active = active[scores[active] >= score_threshold]
+    return (np.asarray(keep, dtype=np.intp),
+            np.asarray(kept_scores, dtype=np.float32))
+
+
+def class_offset_boxes(boxes, class_ids):
+    """ Shift boxes so that boxes of different classes can never overlap.
+        Running a class agnostic NMS on the result is equivalent to running
+        one NMS per class.
+    """
+    if not len(boxes):
+        return boxes
+    span = float(boxes.max() - boxes.min()) + 1.0
+    # float64 keeps sub-pixel precision even with thousands of ids, e.g.
+    # when ids combine a frame index and a class.
+    offsets = class_ids.astype(np.float64) * span
+    return boxes.astype(np.float64) + offsets[:, None]
+
+
+def batched_nms(boxes, scores, class_ids, iou_threshold, method="greedy",
+                sigma=0.5, score_threshold=0.001, block_size=IOU_BLOCK_SIZE,
+                max_keep=0, pre_nms_top_k=0):
+    """ Class aware NMS over every class at once.
+
+        Keyword arguments:
+        - boxes : (N, 4) corner array
+        - scores : (N,) confidence array
+        - class_ids : (N,) integer array, boxes only suppress boxes sharing
+            the same id
+        - iou_threshold : maximum overlap allowance between 2 boxes
+        - method : one of NMS_METHODS, "sweep" gives the "greedy" result
+            from the overlapping pairs only
+        - sigma, score_threshold : soft-nms parameters
+        - max_keep : stop once this many boxes are kept over every class,
+            see nms (0 means no limit)
+        - pre_nms_top_k : only the pre_nms_top_k best scored boxes of every class
+            enter the suppression (0 means no limit)
+
+        Return:
+        - indices of the kept boxes, sorted by decreasing score.
+        - scores of the kept boxes (decayed for soft-nms).
+    """
+    if method not in NMS_METHODS:
+        raise ValueError("unknown nms method: %s" % method)
+    if not len(boxes):
+        return np.empty(0, dtype=np.intp), np.empty(0, dtype=np.float32)
+    if pre_nms_top_k:
+        candidates = per_key_top_k(scores, class_ids, pre_nms_top_k)
+        if len(candidates) < len(boxes):
+            keep, kept_scores = batched_nms(boxes[candidates], scores[candidates],
+                                            class_ids[candidates], iou_threshold, method,
+                                            sigma, score_threshold, block_size, max_keep)
+            return candidates[keep], kept_scores
+    if method == "sweep":
+        # Boxes only intersect when they overlap, whatever iou_threshold >= 0
+        first, second = overlap_pairs(class_offset_boxes(boxes, class_ids))
+        keep = nms_pairs(boxes, scores, first, second, iou_threshold)
+        if max_keep:
+            keep = keep[:max_keep]
+        return keep, np.asarray(scores, dtype=np.float32)[keep]
+    if method == "greedy":
+        if max_keep and max_keep < block_size < len(boxes):
+            # Skipping the blocks after the first max_keep kept boxes beats
+            # listing every pair once there are several blocks
+            keep = nms(class_offset_boxes(boxes, class_ids), scores, iou_threshold,
+                       block_size, max_keep)
+            return keep, np.asarray(scores, dtype=np.float32)[keep]
+        # Counted first: with few classes the pairs outweigh the matrix
+        if same_key_pair_count(class_ids) * SPARSE_PAIR_RATIO < len(boxes) ** 2:
+            first, second = same_key_pairs(class_ids)
+            keep = nms_pairs(boxes, scores, first, second, iou_threshold)
+        else:
+            keep = nms(class_offset_boxes(boxes, class_ids), scores, iou_threshold,
+                       block_size)
+        if max_keep:
+            keep = keep[:max_keep]
+        return keep, np.asarray(scores, dtype=np.float32)[keep]
+    shifted = class_offset_boxes(boxes, class_ids)
+    return soft_nms(shifted, scores, iou_threshold, sigma, method, score_threshold,
+                    max_keep)
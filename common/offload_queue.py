@@ -0,0 +1,151 @@
+"""
+    Bounded queue moving probe output off the GStreamer streaming thread.
+
+    Probes copy the fields they need into compact records and put them in
+    an OffloadQueue, which returns immediately. A worker thread drains the
+    queue and hands the records, in batches, to a handler that does the
+    formatting, logging or publishing:
+
+        queue = OffloadQueue(print_detections, maxsize=4096)
+        ...
+        queue.put_many(records)        # in the probe
+        ...
+        queue.close()                  # at exit, drains what is left
+
+    When the handler cannot keep up, the drop policy decides what happens:
+    - "drop_oldest" : the oldest queued records are discarded (default)
+    - "drop_newest" : the records being put are discarded
+    - "block" : the probe waits for room, throttling the pipeline
+"""
+
+import sys
+import threading
+from collections import deque, namedtuple
+
+DROP_POLICIES = ("drop_oldest", "drop_newest", "block")
+
+DetectionRecord = namedtuple(
+    "DetectionRecord",
+    ["frame_num", "pad_index", "class_id", "object_id", "confidence",
+     "left", "top", "width", "height"],
+)
+
+
+def format_detection(record):
+    """ Format a DetectionRecord like the probes used to print it. """
+    left = int(record.left)
+    top = int(record.top)
+    return (
+        f"Frame={record.frame_num}, Object={record.object_id}, "
+        f"Class={record.class_id}, "
+        f"Bounding Box=({left},{top}),({left + int(record.width)},{top + int(record.height)})"
+    )
+
+
+def print_detections(records):
+    """ Handler printing DetectionRecords, one line each. """
+    sys.stdout.write("".join(format_detection(record) + "\n" for record in records))
+
+
+class OffloadQueue:
+    """ Bounded queue drained by a worker thread calling handler(records). """
+    def __init__(self, handler, maxsize=4096, policy="drop_oldest", name="offload"):
+        if policy not in DROP_POLICIES:
+            raise ValueError("unknown drop policy: %s" % policy)
+        self.handler = handler
+        self.maxsize = maxsize
+        self.policy = policy
+        # deque appends and pops are atomic, the probe never takes a lock
+        # unless the policy is "block" and the queue is full.
+        self.records = deque(maxlen=maxsize if policy == "drop_oldest" else None)
+        self.ready = threading.Event()
+        self.room = threading.Condition()
+        self.running = True
+        self.enqueued = 0
+        self.dropped = 0
+        self.processed = 0
+        self.worker = threading.Thread(target=self.run, name=name, daemon=True)
+        self.worker.start()
+
+    def put(self, record):
+        """ Queue one record. Return False if it was dropped. """
+        return self.put_many((record,))
+
+    def put_many(self, records):
+        """ Queue several records at once, e.g. every object of a frame.
+            Return False if some records were dropped.
+        """
+        count = len(records)
+        if not count:
+            return True
+        free = self.maxsize - len(self.records)
+        accepted = True
+        if count > free:
+            if self.policy == "drop_newest":
+                self.dropped += count - max(free, 0)
+                records = records[:max(free, 0)]
+                accepted = False
+            elif self.policy == "drop_oldest":
+                # the deque maxlen discards the oldest records by itself
+                self.dropped += count - max(free, 0)
+                accepted = False
+            else:
+                # In parts as room frees up: more than maxsize records would
+                # never fit at once
+                records = list(records)
+                while len(records) > free:
+                    if free > 0:
+                        self.records.extend(records[:free])
+                        self.enqueued += free
+                        records = records[free:]
+                    self.ready.set()
+                    with self.room:
+                        while self.running and len(self.records) >= self.maxsize:
+                            self.room.wait(0.1)
+                    free = self.maxsize - len(self.records)
+                    if not self.running:
+                        # Closed while waiting, the worker is stopping
+                        break
+        self.records.extend(records)
+        self.enqueued += len(records)
+        if not self.ready.is_set():
+            self.ready.set()
+        return accepted
+
+    def run(self):
+        while True:
+            self.ready.wait()
+            self.ready.clear()
+            batch = []
+            try:
+                while True:
+                    batch.append(self.records.popleft())
+            except IndexError:
+                pass
+            if batch:
+                if self.policy == "block":
+                    with self.room:
+                        self.room.notify_all()
+                try:
+                    self.handler(batch)
+                except Exception as e:
+                    sys.stderr.write("Offload handler failed: %s\n" % e)
+                self.processed += len(batch)
+            if not self.running and not self.records:
+                return
+
+    def close(self, timeout=5.0):
+        """ Stop the worker once the queued records are handled. """
+        self.running = False
+        with self.room:
+            self.room.notify_all()
+        self.ready.set()
+        self.worker.join(timeout)
+
+    def stats(self):
+        return {
+            "enqueued": self.enqueued,
+            "dropped": self.dropped,
+            "processed": self.processed,
+            "pending": len(self.records),
+        }
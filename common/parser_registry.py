@@ -0,0 +1,202 @@
+"""
+    Registry of the Python output tensor parsers.
+
+    Every parser declares the output layers it expects and decodes them
+    from the tensor meta attached by nvinfer/nvinferserver when the built-in
+    parsing is disabled (network-type=100 + output-tensor-meta=1, or
+    postprocess { other {} } + output_control { output_tensor_meta: true }).
+    Apps pick one by name and add its probe after the inference element:
+
+        parser = create_parser("yunet", MUXER_OUTPUT_WIDTH, MUXER_OUTPUT_HEIGHT)
+        check_config_layers(parser, config_file)
+        pgie_src_pad.add_probe(Gst.PadProbeType.BUFFER, parser_probe, parser)
+
+    parser_probe is in common.tensor_meta, this module does not need pyds.
+
+    New parsers are added with the register_parser decorator on a factory
+    taking the frame resolution and keyword options.
+"""
+
+import os
+import sys
+import configparser
+from collections import namedtuple
+
+import numpy as np
+
+from common.label_registry import read_label_file
+from common.nms_engine import ltwh_to_corners
+
+ParserSpec = namedtuple("ParserSpec", ["name", "factory", "output_layers", "description"])
+PARSERS = {}
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def register_parser(name, output_layers, description=""):
+    """ Decorator registering a parser factory under name. """
+    def decorator(factory):
+        PARSERS[name] = ParserSpec(name, factory, tuple(output_layers), description)
+        return factory
+    return decorator
+
+
+def parser_names():
+    return sorted(PARSERS)
+
+
+def create_parser(name, frame_width, frame_height, **options):
+    """ Create the parser registered under name.
+
+        Keyword arguments:
+        - frame_width, frame_height : resolution of the frames the objects
+          are added to (muxer output resolution)
+        - options : parser specific options, unknown ones are ignored
+    """
+    if name not in PARSERS:
+        raise ValueError("unknown parser %s, available: %s" % (name, ", ".join(parser_names())))
+    return PARSERS[name].factory(frame_width, frame_height, **options)
+
+
+def config_output_layers(config_path):
+    """ Return the output-blob-names of a nvinfer config file, or None if
+        the file does not declare them (e.g. nvinferserver configs).
+    """
+    config = configparser.ConfigParser()
+    try:
+        config.read(config_path)
+    except configparser.Error:
+        return None
+    if not config.has_option("property", "output-blob-names"):
+        return None
+    return [name for name in config.get("property", "output-blob-names").split(";") if name]
+
+
+def check_config_layers(parser, config_path):
+    """ Warn about the layers parser needs that the config does not output.
+        Return False if some are missing.
+    """
+    layers = config_output_layers(config_path)
+    if layers is None:
+        return True
+    missing = [name for name in parser.output_names if name not in layers]
+    if missing:
+        sys.stderr.write("Parser %s needs output layers missing from %s: %s\n"
+                         % (parser.name, config_path, ", ".join(missing)))
+        return False
+    return True
+
+
+class TensorParser:
+    """ Base of the registered parsers.
+
+        decode(outputs) receives a dict of layer name to array and returns
+        (boxes, scores, class_ids, extra) with left, top, width, height
+        boxes in network resolution. annotate() is called with extra once
+        the objects are added to the frame meta.
+    """
+    name = None
+
+    def __init__(self, frame_width, frame_height, labels):
+        self.frame_width = frame_width
+        self.frame_height = frame_height
+        self.labels = labels
+        self.warned = False
+
+    @property
+    def output_names(self):
+        return list(PARSERS[self.name].output_layers)
+
+    def decode(self, outputs):
+        raise NotImplementedError
+
+    def annotate(self, batch_meta, frame_meta, obj_metas, extra, scale):
+        pass
+
+
+@register_parser("yunet", ["cls_8", "cls_16", "cls_32", "obj_8", "obj_16", "obj_32",
+                           "bbox_8", "bbox_16", "bbox_32", "kps_8", "kps_16", "kps_32"],
+                 "YuNet faces with 5 landmarks, 640x640")
+class YuNetParser(TensorParser):
+    name = "yunet"
+
+    def __init__(self, frame_width, frame_height, show_landmarks=False, **options):
+        from common.yunet_decoder import YuNetDecoder
+        super().__init__(frame_width, frame_height, ["Face"])
+        self.decoder = YuNetDecoder(options.get("input_width", 640),
+                                    options.get("input_height", 640),
+                                    nms_method=options.get("nms_method", "greedy"))
+        self.show_landmarks = show_landmarks
+
+    def decode(self, outputs):
+        boxes, scores, landmarks = self.decoder.decode(outputs)
+        return boxes, scores, np.zeros(len(scores), dtype=np.int32), landmarks
+
+    def annotate(self, batch_meta, frame_meta, obj_metas, landmarks, scale):
+        from common.landmarks import draw_landmarks, pack_landmarks, set_object_landmarks
+        landmarks = landmarks * np.tile(np.asarray(scale, dtype=np.float32), 5)
+        for obj_meta, packed in zip(obj_metas, pack_landmarks(landmarks)):
+            set_object_landmarks(obj_meta, packed)
+        if self.show_landmarks:
+            draw_landmarks(batch_meta, frame_meta, landmarks)
+
+
+@register_parser("peoplenet", ["output_bbox/BiasAdd:0", "output_cov/Sigmoid:0"],
+                 "PeopleNet Person/Bag/Face grid outputs, 960x544")
+class PeopleNetParser(TensorParser):
+    name = "peoplenet"
+
+    def __init__(self, frame_width, frame_height, cluster_mode="nms", **options):
+        from common.peoplenet_decoder import PEOPLENET_CLASSES, PeopleNetDecoder
+        super().__init__(frame_width, frame_height, list(PEOPLENET_CLASSES))
+        self.decoder = PeopleNetDecoder(options.get("input_width", 960),
+                                        options.get("input_height", 544),
+                                        cluster_mode=cluster_mode,
+                                        nms_method=options.get("nms_method", "greedy"))
+
+    def decode(self, outputs):
+        boxes, scores, class_ids = self.decoder.decode(outputs)
+        return boxes, scores, class_ids, None
+
+
+@register_parser("ssd", ["num_detections", "detection_scores", "detection_classes",
+                         "detection_boxes"],
+                 "TensorFlow SSD detection outputs (deepstream-ssd-parser)")
+class SsdParser(TensorParser):
+    name = "ssd"
+    parser_dir = os.path.join(REPO_DIR, "deepstream-ssd-parser")
+
+    def __init__(self, frame_width, frame_height, class_nb=91, threshold=0.5,
+                 min_box_size=32, top_k=20, iou_threshold=0.3, pre_nms_top_k=0, **options):
+        # ssd_parser imports its nms module from its own directory
+        if self.parser_dir not in sys.path:
+            sys.path.append(self.parser_dir)
+        from ssd_parser import BoxSizeParam, DetectionParam, NmsParam, decode_detection_arrays
+        from nms import cluster_detection_arrays
+        self.decode_detection_arrays = decode_detection_arrays
+        self.cluster_detection_arrays = cluster_detection_arrays
+        super().__init__(frame_width, frame_height,
+                         read_label_file(os.path.join(self.parser_dir, "labels.txt")))
+        self.input_width = options.get("input_width", 300)
+        self.input_height = options.get("input_height", 300)
+        self.detection_param = DetectionParam(class_nb, threshold)
+        self.box_size_param = BoxSizeParam(frame_height, frame_width, min_box_size, min_box_size)
+        self.nms_param = NmsParam(top_k, iou_threshold, options.get("nms_method", "greedy"),
+                                  pre_nms_top_k=pre_nms_top_k)
+
+    def decode(self, outputs):
+        scores = outputs["detection_scores"].reshape(-1)
+        num_detection = min(int(outputs["num_detections"].reshape(-1)[0]), len(scores))
+        left, top, width, height, scores, class_ids, _ = self.decode_detection_arrays(
+            scores[:num_detection], outputs["detection_classes"].reshape(-1)[:num_detection],
+            outputs["detection_boxes"].reshape(-1, 4)[:num_detection],
+            self.detection_param, self.box_size_param)
+        if not len(scores):
+            return np.empty((0, 4), np.float32), scores, class_ids, None
+        keep, kept_scores = self.cluster_detection_arrays(
+            ltwh_to_corners(left, top, width, height), scores, class_ids,
+            self.nms_param.top_k, self.nms_param.iou_threshold, self.nms_param.method,
+            pre_nms_top_k=self.nms_param.pre_nms_top_k)
+        # Normalized coordinates to network resolution
+        boxes = np.stack([left[keep], top[keep], width[keep], height[keep]], axis=1)
+        boxes *= (self.input_width, self.input_height, self.input_width, self.input_height)
+        return boxes, kept_scores, class_ids[keep], None
@@ -0,0 +1,185 @@
+"""
+    NumPy decoder of the PeopleNet (DetectNet_v2) grid outputs.
+
+    PeopleNet predicts on a grid of stride 16 over its 960x544 input:
+    - output_cov/Sigmoid:0 [classes, rows, cols] : coverage of every cell
+    - output_bbox/BiasAdd:0 [4 * classes, rows, cols] : box corners of every
+      cell, relative to the cell center and normalized by bbox_norm
+
+    Cells above the coverage threshold of their class are decoded, then
+    clustered per class (Person, Bag, Face) with NMS or DBSCAN, like the
+    nvinfer cluster-mode 2 and 0:
+
+        decoder = PeopleNetDecoder(cluster_mode="nms")
+        boxes, scores, class_ids = decoder.decode(outputs)
+"""
+
+import numpy as np
+
+from common.nms_engine import batched_nms, box_areas, iou_matrix, per_key_top_k
+
+PEOPLENET_BBOX_LAYER = "output_bbox/BiasAdd:0"
+PEOPLENET_COV_LAYER = "output_cov/Sigmoid:0"
+PEOPLENET_CLASSES = ("Person", "Bag", "Face")
+CLUSTER_MODES = ("nms", "dbscan")
+
+
+def dbscan_clusters(boxes, scores, eps=0.7, min_boxes=3):
+    """ DBSCAN of boxes with 1 - IoU as distance.
+
+        Keyword arguments:
+        - boxes : (N, 4) corner array
+        - scores : (N,) array
+        - eps : maximum distance between neighbours
+        - min_boxes : minimum neighbours, itself included, of a core box
+
+        Return:
+        - (N,) cluster label of every box, -1 for noise
+    """
+    count = len(boxes)
+    if not count:
+        return np.empty(0, dtype=np.intp)
+    areas = box_areas(boxes)
+    neighbours = iou_matrix(boxes, boxes, areas, areas) >= 1.0 - eps
+    core = neighbours.sum(axis=1) >= min_boxes
+    if not core.any():
+        return np.full(count, -1, dtype=np.intp)
+    # Connected components of the core boxes: propagate the smallest
+    # index through core to core links until it settles.
+    core_links = neighbours & core[:, None] & core[None, :]
+    labels = np.where(core, np.arange(count), count)
+    while True:
+        propagated = np.where(core_links, labels[None, :], count).min(axis=1)
+        propagated = np.minimum(propagated, labels)
+        if np.array_equal(propagated, labels):
+            break
+        labels = propagated
+    # Border boxes join the cluster of their best scored core neighbour
+    border = ~core & (neighbours & core[None, :]).any(axis=1)
+    if border.any():
+        candidate_scores = np.where(neighbours[border] & core[None, :], scores[None, :], -np.inf)
+        labels[border] = labels[np.argmax(candidate_scores, axis=1)]
+    labels[labels == count] = -1
+    # Renumber the clusters 0..n-1
+    _, labels[labels >= 0] = np.unique(labels[labels >= 0], return_inverse=True)
+    return labels
+
+
+class PeopleNetDecoder:
+    """ Decodes PeopleNet outputs into boxes, scores and class ids.
+
+        Keyword arguments:
+        - input_width, input_height : network input resolution
+        - coverage_thresholds : minimum coverage per class
+        - cluster_mode : one of CLUSTER_MODES
+        - iou_threshold : NMS overlap threshold
+        - nms_method : "greedy", or "sweep" for crowded frames
+        - eps, min_boxes : DBSCAN parameters
+        - top_k : maximum number of objects per class and frame
+        - pre_nms_top_k : maximum number of cells per class entering the
+          NMS, a bound for crowded frames (0 means no limit)
+    """
+    def __init__(self, input_width=960, input_height=544, stride=16, bbox_norm=35.0,
+                 offset=0.5, coverage_thresholds=(0.4, 0.2, 0.2), cluster_mode="nms",
+                 iou_threshold=0.5, eps=0.7, min_boxes=3, top_k=20, pre_nms_top_k=0,
+                 nms_method="greedy"):
+        if cluster_mode not in CLUSTER_MODES:
+            raise ValueError("unknown cluster mode: %s" % cluster_mode)
+        self.input_width = input_width
+        self.input_height = input_height
+        self.bbox_norm = bbox_norm
+        self.coverage_thresholds = np.asarray(coverage_thresholds, dtype=np.float32)
+        self.cluster_mode = cluster_mode
+        self.iou_threshold = iou_threshold
+        self.eps = eps
+        self.min_boxes = min_boxes
+        self.top_k = top_k
+        self.pre_nms_top_k = pre_nms_top_k
+        self.nms_method = nms_method
+        self.grid_width = input_width // stride
+        self.grid_height = input_height // stride
+        # Normalized cell centers, indexed like the flattened grid
+        centers_x = (np.arange(self.grid_width, dtype=np.float32) * stride + offset) / bbox_norm
+        centers_y = (np.arange(self.grid_height, dtype=np.float32) * stride + offset) / bbox_norm
+        self.centers_x = np.tile(centers_x, self.grid_height)
+        self.centers_y = np.repeat(centers_y, self.grid_width)
+
+    @property
+    def output_names(self):
+        return [PEOPLENET_BBOX_LAYER, PEOPLENET_COV_LAYER]
+
+    def decode(self, outputs):
+        """ Decode the outputs of one frame.
+
+            Return:
+            - boxes : (N, 4) float32 left, top, width, height in input pixels
+            - scores : (N,) float32 coverage (maximum of the cluster for dbscan)
+            - class_ids : (N,) int32
+        """
+        cells = self.grid_width * self.grid_height
+        coverage = outputs[PEOPLENET_COV_LAYER].reshape(-1, cells)
+        bbox = outputs[PEOPLENET_BBOX_LAYER].reshape(-1, 4, cells)
+        class_nb = coverage.shape[0]
+        thresholds = np.resize(self.coverage_thresholds, class_nb)
+        class_ids, cell_ids = np.nonzero(coverage > thresholds[:, None])
+        scores = coverage[class_ids, cell_ids]
+        selected = bbox[class_ids, :, cell_ids]
+        centers_x = self.centers_x[cell_ids]
+        centers_y = self.centers_y[cell_ids]
+        corners = np.empty((len(cell_ids), 4), dtype=np.float32)
+        corners[:, 0] = (selected[:, 0] - centers_x) * -self.bbox_norm
+        corners[:, 1] = (selected[:, 1] - centers_y) * -self.bbox_norm
+        corners[:, 2] = (selected[:, 2] + centers_x) * self.bbox_norm
+        corners[:, 3] = (selected[:, 3] + centers_y) * self.bbox_norm
+        np.clip(corners[:, 0::2], 0, self.input_width - 1, out=corners[:, 0::2])
+        np.clip(corners[:, 1::2], 0, self.input_height - 1, out=corners[:, 1::2])
+        valid = (corners[:, 2] > corners[:, 0]) & (corners[:, 3] > corners[:, 1])
+        corners, scores, class_ids = corners[valid], scores[valid], class_ids[valid]
+
+        if self.cluster_mode == "nms":
+            keep, scores = batched_nms(corners, scores, class_ids, self.iou_threshold,
+                                       self.nms_method, pre_nms_top_k=self.pre_nms_top_k)
+            corners, class_ids = corners[keep], class_ids[keep]
+        else:
+            corners, scores, class_ids = self.cluster_dbscan(corners, scores, class_ids)
+        corners, scores, class_ids = self.limit_per_class(corners, scores, class_ids)
+
+        boxes = corners.copy()
+        boxes[:, 2:] -= boxes[:, :2]
+        return boxes, scores.astype(np.float32), class_ids.astype(np.int32)
+
+    def cluster_dbscan(self, corners, scores, class_ids):
+        """ Replace every DBSCAN cluster of a class by its score weighted
+            mean box, noise boxes are dropped.
+        """
+        out_boxes = []
+        out_scores = []
+        out_classes = []
+        for class_id in np.unique(class_ids):
+            members = np.flatnonzero(class_ids == class_id)
+            labels = dbscan_clusters(corners[members], scores[members], self.eps,
+                                     self.min_boxes)
+            clustered = labels >= 0
+            if not clustered.any():
+                continue
+            labels = labels[clustered]
+            boxes = corners[members][clustered]
+            weights = scores[members][clustered]
+            cluster_nb = labels.max() + 1
+            weight_sums = np.bincount(labels, weights, cluster_nb)
+            means = np.stack([np.bincount(labels, boxes[:, i] * weights, cluster_nb)
+                              for i in range(4)], axis=1) / weight_sums[:, None]
+            best = np.full(cluster_nb, -np.inf)
+            np.maximum.at(best, labels, weights)
+            out_boxes.append(means.astype(np.float32))
+            out_scores.append(best.astype(np.float32))
+            out_classes.append(np.full(cluster_nb, class_id, dtype=np.int32))
+        if not out_boxes:
+            return (np.empty((0, 4), np.float32), np.empty(0, np.float32),
+                    np.empty(0, np.int32))
+        return np.concatenate(out_boxes), np.concatenate(out_scores), np.concatenate(out_classes)
+
+    def limit_per_class(self, corners, scores, class_ids):
+        """ Keep the top_k best scored objects of every class. """
+        keep = per_key_top_k(scores, class_ids, self.top_k)
+        return corners[keep], scores[keep], class_ids[keep]
@@ -0,0 +1,262 @@
+"""
+    Declarative construction of GStreamer pipelines.
+
+    A spec lists the elements, how they are linked, the queues to insert
+    and the probes to add. It is a dict, or a JSON/YAML file (YAML needs
+    PyYAML):
+
+        spec = {
+            "name": "ssd-pipeline",
+            "elements": [
+                {"name": "file-source", "factory": "filesrc",
+                 "properties": {"location": "sample.h264"}},
+                {"name": "Stream-muxer", "factory": "nvstreammux",
+                 "properties": {"batch-size": 1, "width": 1920, "height": 1080}},
+                {"name": "primary-inference", "factory": "nvinfer", "queue": True},
+                ...
+            ],
+            "links": [
+                ["file-source", "h264-parser", "decoder", "Stream-muxer.sink_0"],
+                ["Stream-muxer", "primary-inference", ...],
+            ],
+            "queues": {"before": ["nvtracker", "nvdsosd"],
+                       "properties": {"max-size-buffers": 4, "leaky": 2}},
+            "probes": [{"pad": "primary-inference.src", "callback": "pgie_src"}],
+        }
+        builder = PipelineBuilder(spec, callbacks={"pgie_src": pgie_src_pad_buffer_probe})
+        pipeline = builder.build()
+        pgie = builder.elements["primary-inference"]
+
+    Links are chains of "element" or "element.pad" endpoints. Missing pads
+    are requested, e.g. the sink_%u pads of nvstreammux. Without "links"
+    the elements are chained in list order. Sometimes pads (uridecodebin)
+    are still linked by the app.
+
+    A queue, which starts a new streaming thread, is inserted in front of
+    the elements whose factory is in queues["before"] or whose "queue" is
+    true. queues["properties"] sets the leaky/max-size-* properties of all
+    of them and a "queue" dict overrides them for one element, so the
+    buffering is tuned in the spec instead of the code. Each queue is
+    named after the link it sits on, e.g. "queue-decoder-Stream-muxer-sink_0",
+    so an element fed by several links gets one queue per link.
+"""
+
+import os
+import sys
+import json
+
+import gi
+gi.require_version("Gst", "1.0")
+from gi.repository import Gst
+
+PROBE_TYPES = {
+    "buffer": Gst.PadProbeType.BUFFER,
+    "event": Gst.PadProbeType.EVENT_DOWNSTREAM,
+    "query": Gst.PadProbeType.QUERY_DOWNSTREAM,
+}
+
+
+class PipelineSpecError(ValueError):
+    """ Raised with every problem found in a spec. """
+    def __init__(self, errors):
+        super().__init__("invalid pipeline spec:\n  " + "\n  ".join(errors))
+        self.errors = errors
+
+
+def load_spec(path):
+    """ Load a spec from a .json, .yml or .yaml file. """
+    with open(path) as f:
+        if os.path.splitext(path)[1] in (".yml", ".yaml"):
+            try:
+                import yaml
+            except ImportError:
+                raise ImportError("PyYAML is needed to load %s, pip3 install pyyaml" % path)
+            return yaml.safe_load(f)
+        return json.load(f)
+
+
+def split_endpoint(endpoint):
+    """ Split "element.pad" into (element, pad), pad is None if not given. """
+    element, _, pad = endpoint.partition(".")
+    return element, pad or None
+
+
+def queue_name(src, sink):
+    """ Return the name of the queue inserted on the src -> sink link. """
+    return "-".join(["queue"] + [part for endpoint in (src, sink)
+                                 for part in split_endpoint(endpoint) if part])
+
+
+def spec_links(spec):
+    """ Return the (src endpoint, sink endpoint) pairs of the spec links. """
+    chains = spec.get("links")
+    if chains is None:
+        chains = [[element["name"] for element in spec.get("elements", [])]]
+    return [(chain[i], chain[i + 1]) for chain in chains for i in range(len(chain) - 1)]
+
+
+def validate_spec(spec, callbacks=None):
+    """ Check names, links and probes of a spec without creating anything.
+        Raise PipelineSpecError listing every problem.
+    """
+    errors = []
+    names = set()
+    for index, element in enumerate(spec.get("elements", [])):
+        name = element.get("name")
+        if not name or not element.get("factory"):
+            errors.append("element %d needs a name and a factory" % index)
+        elif name in names:
+            errors.append("duplicate element name %s" % name)
+        names.add(name)
+    for src, sink in spec_links(spec):
+        for endpoint in (src, sink):
+            if split_endpoint(endpoint)[0] not in names:
+                errors.append("link %s -> %s: unknown element %s" % (
+                    src, sink, split_endpoint(endpoint)[0]))
+    for probe in spec.get("probes", []):
+        element, pad = split_endpoint(probe.get("pad", ""))
+        if element not in names or not pad:
+            errors.append("probe on %s: expected a known element.pad" % probe.get("pad"))
+        callback = probe.get("callback")
+        if isinstance(callback, str) and callback not in (callbacks or {}):
+            errors.append("probe on %s: unknown callback %s" % (probe.get("pad"), callback))
+        elif callback is None:
+            errors.append("probe on %s: no callback" % probe.get("pad"))
+        if probe.get("type", "buffer") not in PROBE_TYPES:
+            errors.append("probe on %s: unknown type %s" % (probe.get("pad"), probe["type"]))
+    if errors:
+        raise PipelineSpecError(errors)
+
+
+class PipelineBuilder:
+    """ Builds the pipeline described by a spec, see the module docstring.
+
+        Keyword arguments:
+        - spec : dict, or path of a JSON/YAML file
+        - callbacks : dict of name to probe function, for probes whose
+          callback is given by name (always the case in files)
+    """
+    def __init__(self, spec, callbacks=None):
+        if isinstance(spec, str):
+            spec = load_spec(spec)
+        self.spec = spec
+        self.callbacks = callbacks or {}
+        self.pipeline = None
+        self.elements = {}
+        self.element_specs = {element.get("name"): element
+                              for element in spec.get("elements", [])}
+
+    def build(self):
+        """ Create, add and link the elements, then add the probes.
+
+            Return:
+            - the Gst.Pipeline
+        """
+        validate_spec(self.spec, self.callbacks)
+        errors = []
+        self.pipeline = Gst.Pipeline.new(self.spec.get("name", "pipeline"))
+        for element_spec in self.spec.get("elements", []):
+            element = self.make_element(element_spec, errors)
+            if element:
+                self.elements[element_spec["name"]] = element
+                self.add_element(element, errors)
+        if errors:
+            raise PipelineSpecError(errors)
+
+        for src, sink in spec_links(self.spec):
+            sink_name = split_endpoint(sink)[0]
+            queue_properties = self.queue_properties(self.element_specs[sink_name])
+            if queue_properties is not None:
+                queue = self.make_queue(queue_name(src, sink), queue_properties, errors)
+                if queue:
+                    self.link(src, queue.get_name(), errors)
+                    src = queue.get_name()
+            self.link(src, sink, errors)
+        for probe in self.spec.get("probes", []):
+            self.add_probe(probe, errors)
+        if errors:
+            raise PipelineSpecError(errors)
+        return self.pipeline
+
+    def make_element(self, element_spec, errors):
+        name = element_spec["name"]
+        print("Creating", name)
+        element = Gst.ElementFactory.make(element_spec["factory"], name)
+        if not element:
+            errors.append("unable to create %s (%s)" % (name, element_spec["factory"]))
+            if element_spec.get("detail"):
+                sys.stderr.write(element_spec["detail"])
+            return None
+        for prop, value in element_spec.get("properties", {}).items():
+            # Caps are given as strings in specs
+            if prop == "caps" and isinstance(value, str):
+                value = Gst.Caps.from_string(value)
+            try:
+                element.set_property(prop, value)
+            except (TypeError, ValueError) as e:
+                errors.append("%s: cannot set %s=%r: %s" % (name, prop, value, e))
+        return element
+
+    def queue_properties(self, element_spec):
+        """ Return the properties of the queue to insert in front of an
+            element, or None if it gets no queue.
+        """
+        queues = self.spec.get("queues", {})
+        wanted = element_spec.get("queue")
+        if wanted is None:
+            wanted = element_spec["factory"] in queues.get("before", ())
+        if not wanted:
+            return None
+        properties = dict(queues.get("properties", {}))
+        if isinstance(wanted, dict):
+            properties.update(wanted)
+        return properties
+
+    def make_queue(self, name, properties, errors):
+        queue = self.make_element({"name": name, "factory": "queue", "properties": properties},
+                                  errors)
+        if queue and self.add_element(queue, errors):
+            self.elements[name] = queue
+            return queue
+        return None
+
+    def add_element(self, element, errors):
+        """ Add an element to the pipeline, return False if it failed
+            (e.g. the name is already taken).
+        """
+        if not self.pipeline.add(element):
+            errors.append("unable to add %s to the pipeline" % element.get_name())
+            return False
+        return True
+
+    def get_pad(self, endpoint, default):
+        """ Return the pad of an "element.pad" endpoint, requesting it if
+            it is not a static pad.
+        """
+        name, pad_name = split_endpoint(endpoint)
+        element = self.elements[name]
+        pad_name = pad_name or default
+        return element.get_static_pad(pad_name) or element.request_pad_simple(pad_name)
+
+    def link(self, src, sink, errors):
+        if split_endpoint(src)[1] is None and split_endpoint(sink)[1] is None:
+            if not self.elements[src].link(self.elements[sink]):
+                errors.append("unable to link %s -> %s" % (src, sink))
+            return
+        src_pad = self.get_pad(src, "src")
+        sink_pad = self.get_pad(sink, "sink")
+        if not src_pad or not sink_pad:
+            errors.append("unable to get the pads of %s -> %s" % (src, sink))
+        elif src_pad.link(sink_pad) != Gst.PadLinkReturn.OK:
+            errors.append("unable to link %s -> %s" % (src, sink))
+
+    def add_probe(self, probe, errors):
+        name, pad_name = split_endpoint(probe["pad"])
+        pad = self.elements[name].get_static_pad(pad_name)
+        if not pad:
+            errors.append("unable to get pad %s for a probe" % probe["pad"])
+            return
+        callback = probe["callback"]
+        if isinstance(callback, str):
+            callback = self.callbacks[callback]
+        pad.add_probe(PROBE_TYPES[probe.get("type", "buffer")], callback, probe.get("data"))
@@ -0,0 +1,237 @@
+"""
+    Process pool decoding output tensors off the GIL of the streaming thread.
+
+    Python post-processing in a probe runs under the GIL: with many streams
+    a single core decodes every frame. A PostprocessPool runs a registered
+    parser (see common.parser_registry) in worker processes instead:
+
+        pool = PostprocessPool("ssd", 1920, 1080, workers=4)
+        ...
+        results = pool.decode_batch(frames)   # in the probe
+        ...
+        pool.close()                          # at exit
+
+    The layers of every frame are copied once into a slot of a shared
+    memory block, the workers view them in place and only return the
+    compact detection arrays through a queue.
+
+    decode_batch returns the results in the order of its frames, before
+    the probe returns, so objects are attached to the right frames and the
+    buffer order is unchanged. A frame whose result is not back after
+    timeout seconds, or that finds no free slot, is decoded in the calling
+    thread instead: the latency of a batch is bounded whatever the workers
+    do. Late results are discarded.
+"""
+
+import sys
+import time
+import queue
+import multiprocessing
+from multiprocessing import shared_memory
+
+import numpy as np
+
+# Detection array columns before the parser specific extra columns
+DETECTION_COLUMNS = ("left", "top", "width", "height", "score", "class_id")
+
+
+def pack_detections(boxes, scores, class_ids, extra=None):
+    """ Stack decoded detections into one (N, 6 + E) float32 array. """
+    columns = [np.asarray(boxes, dtype=np.float32).reshape(-1, 4),
+               np.asarray(scores, dtype=np.float32).reshape(-1, 1),
+               np.asarray(class_ids, dtype=np.float32).reshape(-1, 1)]
+    if extra is not None:
+        columns.append(np.asarray(extra, dtype=np.float32).reshape(len(columns[1]), -1))
+    return np.concatenate(columns, axis=1)
+
+
+def unpack_detections(detections):
+    """ Inverse of pack_detections.
+
+        Return:
+        - boxes, scores, class_ids (int32), extra (None without extra columns)
+    """
+    extra = detections[:, 6:] if detections.shape[1] > 6 else None
+    return (detections[:, :4], detections[:, 4], detections[:, 5].astype(np.int32), extra)
+
+
+def slot_layout(outputs, slot_bytes):
+    """ Return the [(name, offset, shape)] placing outputs in a slot, or
+        None if they do not fit in slot_bytes.
+    """
+    layout = []
+    offset = 0
+    for name, array in outputs.items():
+        layout.append((name, offset, tuple(np.shape(array))))
+        # Keep every layer 16 bytes aligned
+        offset += (np.size(array) * 4 + 15) // 16 * 16
+    if offset > slot_bytes:
+        return None
+    return layout
+
+
+def view_slot(buffer, slot_offset, layout):
+    """ Return the dict of layer name to float32 views of a slot. """
+    return {name: np.ndarray(shape, dtype=np.float32, buffer=buffer, offset=slot_offset + offset)
+            for name, offset, shape in layout}
+
+
+def worker_main(shm_name, slot_bytes, parser_name, frame_width, frame_height, options,
+                tasks, results):
+    """ Worker process loop: decode the slots named by tasks until None. """
+    from common.parser_registry import create_parser
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        parser = create_parser(parser_name, frame_width, frame_height, **options)
+        while True:
+            task = tasks.get()
+            if task is None:
+                break
+            seq, slot, layout = task
+            try:
+                outputs = view_slot(shm.buf, slot * slot_bytes, layout)
+                boxes, scores, class_ids, extra = parser.decode(outputs)
+                results.put((seq, slot, pack_detections(boxes, scores, class_ids, extra), None))
+            except Exception as e:
+                results.put((seq, slot, None, "%s: %s" % (type(e).__name__, e)))
+            # Views must not outlive the shared memory
+            outputs = None
+    finally:
+        shm.close()
+
+
+class PostprocessPool:
+    """ Pool of worker processes running a registered parser.
+
+        Keyword arguments:
+        - parser_name, frame_width, frame_height, options : see
+          common.parser_registry.create_parser. The same parser is created
+          in the calling process for the inline fallback.
+        - workers : number of worker processes
+        - slots : number of frames in flight, at least the batch size
+        - slot_bytes : shared memory per frame, larger frames are decoded
+          inline
+        - timeout : seconds decode_batch waits for the workers
+    """
+    def __init__(self, parser_name, frame_width, frame_height, workers=4, slots=32,
+                 slot_bytes=1 << 20, timeout=0.02, **options):
+        from common.parser_registry import create_parser
+        self.parser = create_parser(parser_name, frame_width, frame_height, **options)
+        self.slot_bytes = slot_bytes
+        self.timeout = timeout
+        self.free_slots = list(range(slots))
+        self.seq = 0
+        self.pooled = 0
+        self.inline = 0
+        self.timeouts = 0
+        self.errors = 0
+        self.shm = shared_memory.SharedMemory(create=True, size=slots * slot_bytes)
+        # Forking a process running GStreamer and CUDA threads is unsafe
+        context = multiprocessing.get_context("spawn")
+        self.tasks = context.Queue()
+        self.results = context.Queue()
+        self.processes = [
+            context.Process(target=worker_main, daemon=True, name="postprocess-%d" % i,
+                            args=(self.shm.name, slot_bytes, parser_name, frame_width,
+                                  frame_height, options, self.tasks, self.results))
+            for i in range(workers)
+        ]
+        for process in self.processes:
+            process.start()
+
+    @property
+    def output_names(self):
+        return self.parser.output_names
+
+    def decode_batch(self, frames):
+        """ Decode frames, a list of dicts of layer name to array.
+
+            Return:
+            - one (boxes, scores, class_ids, extra) tuple per frame, in
+              frames order, like parser.decode
+        """
+        deadline = time.monotonic() + self.timeout
+        self.collect(0)
+        pending = {}
+        inline = []
+        for index, outputs in enumerate(frames):
+            layout = slot_layout(outputs, self.slot_bytes)
+            if layout is None or not self.free_slots:
+                inline.append(index)
+                continue
+            slot = self.free_slots.pop()
+            for name, offset, shape in layout:
+                view = np.ndarray(shape, dtype=np.float32, buffer=self.shm.buf,
+                                  offset=slot * self.slot_bytes + offset)
+                np.copyto(view, outputs[name])
+            view = None
+            self.seq += 1
+            pending[self.seq] = index
+            self.tasks.put((self.seq, slot, layout))
+
+        results = [None] * len(frames)
+        # The calling thread decodes its share while the workers run
+        for index in inline:
+            results[index] = self.parser.decode(frames[index])
+        self.inline += len(inline)
+        while pending:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            for seq, detections in self.collect(remaining, pending):
+                index = pending.pop(seq)
+                if detections is None:
+                    results[index] = self.parser.decode(frames[index])
+                    self.inline += 1
+                else:
+                    results[index] = unpack_detections(detections)
+                    self.pooled += 1
+        for seq, index in pending.items():
+            results[index] = self.parser.decode(frames[index])
+        self.timeouts += len(pending)
+        self.inline += len(pending)
+        return results
+
+    def collect(self, timeout, pending=()):
+        """ Free the slots of the results received within timeout seconds.
+
+            Return:
+            - the (seq, detections) results of the pending sequence numbers,
+              detections is None when the worker failed
+        """
+        collected = []
+        try:
+            message = self.results.get(timeout=timeout) if timeout > 0 \
+                else self.results.get_nowait()
+            while True:
+                seq, slot, detections, error = message
+                self.free_slots.append(slot)
+                if error is not None:
+                    self.errors += 1
+                    sys.stderr.write("Postprocess worker error: %s\n" % error)
+                if seq in pending:
+                    collected.append((seq, detections))
+                message = self.results.get_nowait()
+        except queue.Empty:
+            pass
+        return collected
+
+    def stats(self):
+        return {
+            "pooled": self.pooled,
+            "inline": self.inline,
+            "timeouts": self.timeouts,
+            "errors": self.errors,
+            "workers_alive": sum(process.is_alive() for process in self.processes),
+        }
+
+    def close(self, timeout=1.0):
+        """ Stop the workers and release the shared memory. """
+        for _ in self.processes:
+            self.tasks.put(None)
+        for process in self.processes:
+            process.join(timeout)
+            if process.is_alive():
+                process.terminate()
+        self.shm.close()
+        self.shm.unlink()
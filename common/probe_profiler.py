@@ -0,0 +1,302 @@
+"""
+    Execution-time profiler for GStreamer pad probes.
+
+    A ProbeProfiler wraps probe functions and records, for every probe:
+    - a latency histogram of the calls (log scale, 4 buckets per octave)
+    - the cost per frame and per object, when a work counter is given
+    - the garbage collector pauses that happened inside the probe
+
+    On demand it can also capture a cProfile of the probe calls (dumped as
+    pstats) and sample the stacks of threads running a probe (dumped as a
+    collapsed-stack file that flamegraph.pl or speedscope can read):
+
+        profiler = ProbeProfiler()
+        pad.add_probe(Gst.PadProbeType.BUFFER,
+                      profiler.wrap(pgie_src_pad_buffer_probe, "pgie_src",
+                                    count_batch_work), 0)
+        profiler.install_signal_handler()   # kill -USR1 starts/dumps a capture
+"""
+
+import os
+import sys
+import gc
+import time
+import signal
+import cProfile
+import pstats
+import functools
+import threading
+
+SAMPLING_INTERVAL = 0.001
+# Latency histogram resolution: 2 ** LATENCY_SUB_BITS buckets per octave
+LATENCY_SUB_BITS = 2
+
+
+def latency_bucket(ns):
+    """ Return the log scale histogram bucket of a duration in ns. """
+    bits = ns.bit_length()
+    if bits <= LATENCY_SUB_BITS + 1:
+        return ns
+    shift = bits - LATENCY_SUB_BITS - 1
+    return (shift << LATENCY_SUB_BITS) + (ns >> shift)
+
+
+def bucket_upper_ns(bucket):
+    """ Return the upper bound in ns of a latency_bucket. """
+    if bucket < 1 << (LATENCY_SUB_BITS + 1):
+        return bucket
+    octave, offset = divmod(bucket, 1 << LATENCY_SUB_BITS)
+    mantissa = offset + (1 << LATENCY_SUB_BITS)
+    return ((mantissa + 1) << (octave - 1)) - 1
+
+
+def count_batch_work(info):
+    """ Work counter returning (frames, objects) of the buffer of a probe. """
+    import pyds
+    gst_buffer = info.get_buffer()
+    if not gst_buffer:
+        return 0, 0
+    batch_meta = pyds.gst_buffer_get_nvds_batch_meta(hash(gst_buffer))
+    frames = 0
+    objects = 0
+    l_frame = batch_meta.frame_meta_list
+    while l_frame is not None:
+        frame_meta = pyds.NvDsFrameMeta.cast(l_frame.data)
+        frames += 1
+        objects += frame_meta.num_obj_meta
+        l_frame = l_frame.next
+    return frames, objects
+
+
+class ProbeStats:
+    """ Accumulated measurements of one probe. """
+    def __init__(self, name):
+        self.name = name
+        self.calls = 0
+        self.total_ns = 0
+        self.max_ns = 0
+        self.histogram = {}
+        self.frames = 0
+        self.objects = 0
+        self.gc_pauses = 0
+        self.gc_ns = 0
+
+    def record(self, elapsed_ns):
+        self.calls += 1
+        self.total_ns += elapsed_ns
+        if elapsed_ns > self.max_ns:
+            self.max_ns = elapsed_ns
+        bucket = latency_bucket(elapsed_ns)
+        self.histogram[bucket] = self.histogram.get(bucket, 0) + 1
+
+    def percentile_ns(self, pct):
+        """ Upper bound of the histogram bucket holding the percentile. """
+        if not self.calls:
+            return 0
+        rank = pct / 100.0 * self.calls
+        seen = 0
+        for bucket in sorted(self.histogram):
+            seen += self.histogram[bucket]
+            if seen >= rank:
+                return min(bucket_upper_ns(bucket), self.max_ns)
+        return self.max_ns
+
+    def summary(self):
+        mean_ns = self.total_ns / self.calls if self.calls else 0
+        return {
+            "calls": self.calls,
+            "mean_us": round(mean_ns / 1e3, 1),
+            "p50_us": round(self.percentile_ns(50) / 1e3, 1),
+            "p90_us": round(self.percentile_ns(90) / 1e3, 1),
+            "p99_us": round(self.percentile_ns(99) / 1e3, 1),
+            "max_us": round(self.max_ns / 1e3, 1),
+            "per_frame_us": round(self.total_ns / self.frames / 1e3, 2) if self.frames else None,
+            "per_object_us": round(self.total_ns / self.objects / 1e3, 2) if self.objects else None,
+            "gc_pauses": self.gc_pauses,
+            "gc_ms": round(self.gc_ns / 1e6, 2),
+        }
+
+
+class ProbeProfiler:
+    """ Registry of wrapped probes and their measurements.
+
+        When metrics (common.metrics_exporter.PipelineMetrics) is given,
+        the probe execution time is also observed in its histogram.
+    """
+    def __init__(self, metrics=None, track_gc=True):
+        self.metrics = metrics
+        self.stats = {}
+        self.local = threading.local()
+        # thread id -> name of the probe it is running, read by the sampler
+        self.active = {}
+        self.profiles = {}
+        self.cprofile_enabled = False
+        # Held by the thread whose probe call is being profiled
+        self.profile_lock = threading.Lock()
+        self.samples = {}
+        self.sampler = None
+        self.sampling = threading.Event()
+        self.gc_pauses = 0
+        self.gc_ns = 0
+        if track_gc:
+            gc.callbacks.append(self.gc_callback)
+
+    def gc_callback(self, phase, info):
+        if phase == "start":
+            self.local.gc_start = time.perf_counter_ns()
+            return
+        start = getattr(self.local, "gc_start", None)
+        if start is None:
+            return
+        pause = time.perf_counter_ns() - start
+        self.gc_pauses += 1
+        self.gc_ns += pause
+        current = getattr(self.local, "current", None)
+        if current is not None:
+            current.gc_pauses += 1
+            current.gc_ns += pause
+
+    def wrap(self, probe, name=None, work_counter=None):
+        """ Return probe wrapped with measurements.
+
+            work_counter(info) -> (frames, objects) is called after each
+            call to compute the per-frame and per-object cost, see
+            count_batch_work.
+        """
+        name = name or probe.__name__
+        stats = self.stats.setdefault(name, ProbeStats(name))
+        histogram = self.metrics.probe_time.labels(name) if self.metrics else None
+        local = self.local
+        active = self.active
+
+        @functools.wraps(probe)
+        def wrapper(pad, info, u_data):
+            thread_id = threading.get_ident()
+            profile = self.enable_profile(thread_id) if self.cprofile_enabled else None
+            local.current = stats
+            active[thread_id] = name
+            start = time.perf_counter_ns()
+            try:
+                return probe(pad, info, u_data)
+            finally:
+                elapsed = time.perf_counter_ns() - start
+                if profile:
+                    profile.disable()
+                    self.profile_lock.release()
+                active.pop(thread_id, None)
+                local.current = None
+                stats.record(elapsed)
+                if histogram:
+                    histogram.observe(elapsed / 1e9)
+                if work_counter:
+                    frames, objects = work_counter(info)
+                    stats.frames += frames
+                    stats.objects += objects
+
+        return wrapper
+
+    def enable_profile(self, thread_id):
+        """ Start profiling the probe call of the current thread, return
+            its profile, or None to only time the call.
+
+            Only one thread is profiled at a time: since Python 3.12 a
+            second active profiler raises ValueError. Calls that find
+            another call being profiled, or another profiler active (e.g.
+            python -m cProfile), are only timed.
+        """
+        if not self.profile_lock.acquire(blocking=False):
+            return None
+        # cProfile.Profile objects are not shared between threads
+        profile = self.profiles.get(thread_id) or cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            self.profile_lock.release()
+            return None
+        # Only profiles that ran are kept, pstats rejects empty ones
+        self.profiles[thread_id] = profile
+        return profile
+
+    def start_capture(self, sampling_interval=SAMPLING_INTERVAL):
+        """ Start recording a cProfile of probe calls and sampling stacks. """
+        self.profiles = {}
+        self.samples = {}
+        self.cprofile_enabled = True
+        self.sampling.set()
+        self.sampler = threading.Thread(target=self.sample_stacks, args=(sampling_interval,),
+                                        name="probe-sampler", daemon=True)
+        self.sampler.start()
+
+    def stop_capture(self):
+        self.cprofile_enabled = False
+        self.sampling.clear()
+        if self.sampler:
+            self.sampler.join()
+            self.sampler = None
+
+    def sample_stacks(self, interval):
+        while self.sampling.is_set():
+            frames = sys._current_frames()
+            for thread_id, name in list(self.active.items()):
+                frame = frames.get(thread_id)
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append("%s (%s:%d)" % (code.co_name, os.path.basename(code.co_filename),
+                                                 code.co_firstlineno))
+                    frame = frame.f_back
+                stack.append(name)
+                key = ";".join(reversed(stack))
+                self.samples[key] = self.samples.get(key, 0) + 1
+            time.sleep(interval)
+
+    def dump_pstats(self, path):
+        """ Write the captured cProfile data, readable with pstats. """
+        profiles = list(self.profiles.values())
+        if not profiles:
+            sys.stderr.write("No probe profile captured\n")
+            return False
+        stats = pstats.Stats(profiles[0])
+        for profile in profiles[1:]:
+            stats.add(profile)
+        stats.dump_stats(path)
+        return True
+
+    def dump_collapsed(self, path):
+        """ Write the sampled stacks in collapsed-stack format. """
+        with open(path, "w") as f:
+            for stack, count in sorted(self.samples.items()):
+                f.write("%s %d\n" % (stack, count))
+        return bool(self.samples)
+
+    def dump_capture(self, directory="."):
+        """ Stop the capture and write <directory>/probes-<time>.pstats and
+            .collapsed files.
+        """
+        self.stop_capture()
+        base = os.path.join(directory, time.strftime("probes-%Y%m%d-%H%M%S"))
+        if self.dump_pstats(base + ".pstats"):
+            print("Probe profile written to", base + ".pstats")
+        if self.dump_collapsed(base + ".collapsed"):
+            print("Probe stacks written to", base + ".collapsed")
+
+    def install_signal_handler(self, signum=signal.SIGUSR1, directory="."):
+        """ The first signal starts a capture, the next one dumps it along
+            with the report. Must be called from the main thread.
+        """
+        def handler(signum, frame):
+            if self.cprofile_enabled:
+                self.dump_capture(directory)
+                self.print_report()
+            else:
+                print("Probe capture started")
+                self.start_capture()
+
+        signal.signal(signum, handler)
+
+    def report(self):
+        return {name: stats.summary() for name, stats in self.stats.items()}
+
+    def print_report(self):
+        print("\n**PROBES: ", self.report())
+        print("**GC: pauses=%d total_ms=%.2f\n" % (self.gc_pauses, self.gc_ns / 1e6))
@@ -0,0 +1,504 @@
+"""
+    Runtime addition and removal of the sources of a multi-stream pipeline.
+
+    Every source is a bin with a "src" ghost pad (see create_source_bin in
+    the apps) linked to a request pad of nvstreammux. The pad index is the
+    source id, and the pad_index of its frames:
+
+        manager = SourceManager(pipeline, streammux, max_sources=8,
+                                source_factory=create_source_bin)
+        manager.add_source("file:///videos/a.mp4")
+        ControlServer(manager, 8555).start()
+
+    nvstreammux and the inference element are created with batch-size
+    max_sources, so adding a source does not rebuild the engine.
+
+    The control API serves on localhost only:
+    - GET /sources : list the sources
+    - POST /sources {"uri": "rtsp://..."} : add a source, returns its id
+    - DELETE /sources/<id> : remove a source
+
+    URIs starting with videotestsrc:// create test sources, e.g.
+    videotestsrc://?pattern=ball, so the API can be tried without cameras.
+
+    Connect manager.bus_call as the bus watch to reconnect failing sources:
+    an error posted by an element of a source bin, or a source without
+    frames for stall_timeout, takes only that source "down". Its bin is
+    removed and rebuilt after an exponential backoff, keeping the muxer
+    pad, while the other streams go on. The source is "up" again once its
+    frames reach the perf_data probe. A file:///missing.mp4 source with
+    reconnect="all" exercises the whole cycle.
+"""
+
+import sys
+import json
+import time
+import threading
+from urllib.parse import parse_qs, urlparse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import gi
+gi.require_version("Gst", "1.0")
+from gi.repository import GLib, Gst
+
+from common.bus_call import bus_call
+
+TEST_SOURCE_SCHEME = "videotestsrc://"
+RECONNECT_POLICIES = ("off", "live", "all")
+SOURCE_HEALTH_STATES = ("up", "down", "reconnecting")
+LIVE_SCHEMES = ("rtsp://", "rtsps://")
+# Seconds an HTTP request waits for the main loop to apply a change
+CONTROL_TIMEOUT = 5.0
+
+
+class SourceError(Exception):
+    """ Raised when a source cannot be added or removed. """
+
+
+def test_source_bin(index, uri, width=1280, height=720, framerate=30):
+    """ Source bin of a live videotestsrc converted to NVMM memory.
+        Query parameters of the uri are videotestsrc properties.
+    """
+    nbin = Gst.Bin.new("source-bin-%02d" % index)
+    source = Gst.ElementFactory.make("videotestsrc", "test-source")
+    convert = Gst.ElementFactory.make("nvvideoconvert", "test-convert")
+    capsfilter = Gst.ElementFactory.make("capsfilter", "test-caps")
+    if not source or not convert or not capsfilter:
+        sys.stderr.write(" Unable to create the test source elements \n")
+        return None
+    source.set_property("is-live", True)
+    for name, values in parse_qs(urlparse(uri).query).items():
+        # Parses enums and numbers like gst-launch does
+        Gst.util_set_object_arg(source, name, values[-1])
+    capsfilter.set_property("caps", Gst.Caps.from_string(
+        "video/x-raw(memory:NVMM), format=NV12, width=%d, height=%d, framerate=%d/1"
+        % (width, height, framerate)))
+    for element in (source, convert, capsfilter):
+        nbin.add(element)
+    source.link(convert)
+    convert.link(capsfilter)
+    nbin.add_pad(Gst.GhostPad.new("src", capsfilter.get_static_pad("src")))
+    return nbin
+
+
+class SourceState:
+    """ A source and its health: "up" once frames flow, "down" after an
+        error or a stall, "reconnecting" until the rebuilt bin delivers.
+    """
+    __slots__ = ("source_id", "uri", "bin", "state", "errors", "reconnects", "attempts",
+                 "last_error", "changed_ns", "timer_id")
+
+    def __init__(self, source_id, uri, source_bin):
+        self.source_id = source_id
+        self.uri = uri
+        self.bin = source_bin
+        # Also the state of a new source until its first frame
+        self.state = "reconnecting"
+        self.errors = 0
+        self.reconnects = 0
+        # Failed attempts since the source was last up, drives the backoff
+        self.attempts = 0
+        self.last_error = ""
+        self.changed_ns = time.perf_counter_ns()
+        self.timer_id = None
+
+    def set_state(self, state):
+        self.state = state
+        self.changed_ns = time.perf_counter_ns()
+
+
+class SourceManager:
+    """ Adds, removes and reconnects source bins on a live pipeline.
+
+        Keyword arguments:
+        - pipeline, streammux : the pipeline and its nvstreammux
+        - max_sources : number of streammux pads, the batch size
+        - source_factory : function (index, uri) returning a source bin,
+          videotestsrc:// uris always use test_source_bin
+        - remove_on_eos : remove a source once its stream ends, instead of
+          waiting for every stream to end
+        - on_change : optional function (event, source_id, uri) called
+          after a source is "added", "removed", goes "down" or is back "up"
+        - reconnect : which sources are rebuilt after an error or a stall,
+          one of RECONNECT_POLICIES: "off", "live" (rtsp) or "all"
+        - perf_data : common.FPS.PERF_DATA of the pipeline, its last frame
+          times tell when a source is up or stalled
+        - stall_timeout : seconds without frames before a source that was
+          up is considered down
+        - backoff_min, backoff_max : first and maximum reconnect delay in
+          seconds, doubled after every failed attempt
+        - max_attempts : failed attempts before giving up (0 = never)
+
+        Pipeline changes must happen on the thread running the GLib main
+        loop: call_in_main_loop runs the methods there for other threads.
+    """
+    def __init__(self, pipeline, streammux, max_sources, source_factory, remove_on_eos=False,
+                 on_change=None, reconnect="off", perf_data=None, stall_timeout=10.0,
+                 backoff_min=1.0, backoff_max=60.0, max_attempts=0):
+        if reconnect not in RECONNECT_POLICIES:
+            raise ValueError("unknown reconnect policy: %s" % reconnect)
+        self.pipeline = pipeline
+        self.streammux = streammux
+        self.max_sources = max_sources
+        self.source_factory = source_factory
+        self.remove_on_eos = remove_on_eos
+        self.on_change = on_change
+        self.reconnect = reconnect
+        self.perf_data = perf_data
+        self.stall_timeout = stall_timeout
+        self.backoff_min = backoff_min
+        self.backoff_max = backoff_max
+        self.max_attempts = max_attempts
+        # source id -> SourceState
+        self.sources = {}
+        self.health_timer = None
+
+    def free_id(self):
+        for source_id in range(self.max_sources):
+            if source_id not in self.sources:
+                return source_id
+        raise SourceError("all %d sources are in use" % self.max_sources)
+
+    def make_bin(self, source_id, uri):
+        if uri.startswith(TEST_SOURCE_SCHEME):
+            return test_source_bin(source_id, uri)
+        return self.source_factory(source_id, uri)
+
+    def add_source(self, uri):
+        """ Create, link and start the bin of uri. Return its source id. """
+        source_id = self.free_id()
+        source_bin = self.make_bin(source_id, uri)
+        if not source_bin:
+            raise SourceError("unable to create the source bin of %s" % uri)
+        self.pipeline.add(source_bin)
+        sinkpad = self.streammux.request_pad_simple("sink_%d" % source_id)
+        srcpad = source_bin.get_static_pad("src")
+        if not sinkpad or not srcpad or srcpad.link(sinkpad) != Gst.PadLinkReturn.OK:
+            if sinkpad:
+                self.streammux.release_request_pad(sinkpad)
+            self.pipeline.remove(source_bin)
+            raise SourceError("unable to link the source bin of %s" % uri)
+        self.sources[source_id] = SourceState(source_id, uri, source_bin)
+        # Starts the bin if the pipeline is already playing
+        source_bin.sync_state_with_parent()
+        print("Added source %d: %s" % (source_id, uri))
+        self.notify("added", source_id)
+        return source_id
+
+    def stop_bin(self, source):
+        """ Stop and remove the bin of a source, leaving its muxer pad. """
+        state_return = source.bin.set_state(Gst.State.NULL)
+        if state_return == Gst.StateChangeReturn.FAILURE:
+            sys.stderr.write("Unable to stop source %d\n" % source.source_id)
+        elif state_return == Gst.StateChangeReturn.ASYNC:
+            source.bin.get_state(Gst.CLOCK_TIME_NONE)
+        sinkpad = self.streammux.get_static_pad("sink_%d" % source.source_id)
+        if sinkpad:
+            # Clears the flushing state the stopped source left on the pad
+            sinkpad.send_event(Gst.Event.new_flush_stop(False))
+        self.pipeline.remove(source.bin)
+        source.bin = None
+
+    def remove_source(self, source_id):
+        """ Stop, unlink and release the bin of a source. """
+        if source_id not in self.sources:
+            raise SourceError("no source %s" % source_id)
+        source = self.sources[source_id]
+        if source.timer_id is not None:
+            GLib.source_remove(source.timer_id)
+        if source.bin is not None:
+            self.stop_bin(source)
+        sinkpad = self.streammux.get_static_pad("sink_%d" % source_id)
+        if sinkpad:
+            self.streammux.release_request_pad(sinkpad)
+        print("Removed source %d: %s" % (source_id, source.uri))
+        self.notify("removed", source_id)
+        del self.sources[source_id]
+
+    def notify(self, event, source_id):
+        if self.on_change:
+            self.on_change(event, source_id, self.sources[source_id].uri)
+
+    def last_frame_ns(self, source_id):
+        perf_data = self.perf_data
+        if perf_data is None or source_id >= perf_data.num_streams:
+            return 0
+        return perf_data.last_frame_ns[source_id]
+
+    def list_sources(self):
+        now = time.perf_counter_ns()
+        sources = []
+        for source_id, source in sorted(self.sources.items()):
+            last_frame = self.last_frame_ns(source_id)
+            sources.append({
+                "id": source_id,
+                "uri": source.uri,
+                "health": source.state,
+                "state": Gst.Element.state_get_name(source.bin.get_state(0)[1])
+                if source.bin is not None else "NULL",
+                "errors": source.errors,
+                "reconnects": source.reconnects,
+                "last_error": source.last_error,
+                "last_frame_age": round((now - last_frame) / 1e9, 3) if last_frame else None,
+            })
+        return sources
+
+    def should_reconnect(self, source):
+        if self.reconnect == "all":
+            return True
+        return self.reconnect == "live" and source.uri.startswith(LIVE_SCHEMES)
+
+    def source_of(self, element):
+        """ Return the SourceState whose bin contains element, or None. """
+        for source in self.sources.values():
+            if source.bin is not None and (element == source.bin
+                                           or element.has_as_ancestor(source.bin)):
+                return source
+        return None
+
+    def bus_call(self, bus, message, loop):
+        """ Bus watch to connect instead of common.bus_call.bus_call.
+
+            Errors raised inside the bin of a reconnected source take that
+            source down instead of quitting the loop, the other streams go
+            on. The nvstreammux stream-eos message removes the source when
+            remove_on_eos is set. Everything else goes to bus_call.
+        """
+        if message.type == Gst.MessageType.ERROR:
+            source = self.source_of(message.src)
+            if source is not None and self.should_reconnect(source):
+                err, debug = message.parse_error()
+                sys.stderr.write("Error from source %d: %s: %s\n" % (source.source_id, err, debug))
+                source.errors += 1
+                source.last_error = str(err)
+                self.source_down(source)
+                return True
+        elif self.remove_on_eos and message.type == Gst.MessageType.ELEMENT:
+            struct = message.get_structure()
+            if struct is not None and struct.has_name("stream-eos"):
+                parsed, stream_id = struct.get_uint("stream-id")
+                if parsed and stream_id in self.sources:
+                    # Not from the bus callback: the source is still streaming
+                    GLib.idle_add(self.remove_after_eos, stream_id)
+                return True
+        return bus_call(bus, message, loop)
+
+    def remove_after_eos(self, source_id):
+        if source_id in self.sources:
+            self.remove_source(source_id)
+        return False
+
+    def source_down(self, source):
+        """ Tear the bin of a source down and schedule its rebuild. """
+        if source.state == "down":
+            return
+        if source.timer_id is not None:
+            GLib.source_remove(source.timer_id)
+            source.timer_id = None
+        source.set_state("down")
+        self.notify("down", source.source_id)
+        # Not from the bus callback: elements of the bin may still be
+        # posting messages from their streaming threads
+        GLib.idle_add(self.stop_and_schedule, source.source_id)
+
+    def stop_and_schedule(self, source_id):
+        source = self.sources.get(source_id)
+        if source is None or source.state != "down":
+            return False
+        if source.bin is not None:
+            self.stop_bin(source)
+        if self.max_attempts and source.attempts >= self.max_attempts:
+            sys.stderr.write("Giving up on source %d after %d attempts\n"
+                             % (source_id, source.attempts))
+            return False
+        delay = min(self.backoff_min * 2 ** source.attempts, self.backoff_max)
+        print("Reconnecting source %d in %.1f s" % (source_id, delay))
+        source.timer_id = GLib.timeout_add(int(delay * 1000), self.rebuild, source_id)
+        return False
+
+    def rebuild(self, source_id):
+        """ Recreate the bin of a source and link it to its muxer pad. """
+        source = self.sources.get(source_id)
+        if source is None:
+            return False
+        source.timer_id = None
+        source.attempts += 1
+        source.reconnects += 1
+        source_bin = self.make_bin(source_id, source.uri)
+        sinkpad = self.streammux.get_static_pad("sink_%d" % source_id)
+        if source_bin:
+            self.pipeline.add(source_bin)
+            srcpad = source_bin.get_static_pad("src")
+            if srcpad and sinkpad and srcpad.link(sinkpad) == Gst.PadLinkReturn.OK:
+                source.bin = source_bin
+                source.set_state("reconnecting")
+                source_bin.sync_state_with_parent()
+                return False
+            self.pipeline.remove(source_bin)
+        source.errors += 1
+        source.last_error = "unable to rebuild the source bin"
+        # Still down: schedule the next attempt
+        return self.stop_and_schedule(source_id)
+
+    def check_health(self):
+        """ Periodic check: sources delivering frames again are up, up
+            sources without frames for stall_timeout are down.
+        """
+        now = time.perf_counter_ns()
+        for source_id, source in list(self.sources.items()):
+            last_frame = self.last_frame_ns(source_id)
+            if source.state == "reconnecting" and last_frame > source.changed_ns:
+                source.set_state("up")
+                source.attempts = 0
+                self.notify("up", source_id)
+            elif source.state == "up" and now - last_frame > self.stall_timeout * 1e9 \
+                    and self.should_reconnect(source):
+                source.last_error = "no frame for %.0f s" % self.stall_timeout
+                source.errors += 1
+                self.source_down(source)
+        return True
+
+    def start_health_checks(self, interval=1.0):
+        """ Run check_health every interval seconds on the main loop. Needs
+            perf_data, updated by a probe with the frame pad_index.
+        """
+        if self.health_timer is None and self.perf_data is not None:
+            self.health_timer = GLib.timeout_add(int(interval * 1000), self.check_health)
+
+    def register_metrics(self, registry):
+        """ Expose the source health in a common.metrics_exporter registry. """
+        up = registry.gauge("source_up", "1 when the source delivers frames", ["source"])
+        health = registry.gauge("source_health", "1 for the current health of the source",
+                                ["source", "health"])
+        errors = registry.gauge("source_errors", "Errors and stalls of the source", ["source"])
+        reconnects = registry.gauge("source_reconnects", "Rebuilds of the source bin",
+                                    ["source"])
+        age = registry.gauge("source_last_frame_age_seconds",
+                             "Seconds since the last frame of the source", ["source"])
+
+        def collect():
+            now = time.perf_counter_ns()
+            # Drop the series of removed sources
+            for metric in (up, health, errors, reconnects, age):
+                metric.children = {}
+            # Reads a snapshot: the dict may change on the main loop
+            for source_id, source in list(self.sources.items()):
+                up.labels(source_id).set(1 if source.state == "up" else 0)
+                for state in SOURCE_HEALTH_STATES:
+                    health.labels(source_id, state).set(1 if source.state == state else 0)
+                errors.labels(source_id).set(source.errors)
+                reconnects.labels(source_id).set(source.reconnects)
+                last_frame = self.last_frame_ns(source_id)
+                if last_frame:
+                    age.labels(source_id).set(round((now - last_frame) / 1e9, 3))
+
+        registry.add_collector(collect)
+
+    def call_in_main_loop(self, function, *args, timeout=CONTROL_TIMEOUT):
+        """ Run function(*args) on the main loop thread and return its result,
+            or raise its exception.
+        """
+        done = threading.Event()
+        outcome = {}
+
+        def run():
+            try:
+                outcome["result"] = function(*args)
+            except Exception as e:
+                outcome["error"] = e
+            done.set()
+            return False
+
+        GLib.idle_add(run)
+        if not done.wait(timeout):
+            raise SourceError("the main loop did not answer within %.1f s" % timeout)
+        if "error" in outcome:
+            raise outcome["error"]
+        return outcome.get("result")
+
+
+class ControlServer:
+    """ Localhost HTTP API of a SourceManager, served from a daemon thread.
+        Port 0 picks a free port, see self.port.
+    """
+    def __init__(self, manager, port, address="127.0.0.1"):
+        self.manager = manager
+        self.address = address
+        self.port = port
+        self.httpd = None
+        self.thread = None
+
+    def make_handler(self):
+        manager = self.manager
+
+        class Handler(BaseHTTPRequestHandler):
+            def send_json(self, status, data):
+                body = json.dumps(data).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def call(self, error_status, function, *args):
+                """ Run function on the main loop, answering errors. """
+                try:
+                    return True, manager.call_in_main_loop(function, *args)
+                except SourceError as e:
+                    self.send_json(error_status, {"error": str(e)})
+                except Exception as e:
+                    self.send_json(500, {"error": "%s: %s" % (type(e).__name__, e)})
+                return False, None
+
+            def do_GET(self):
+                if self.path.rstrip("/") != "/sources":
+                    self.send_error(404)
+                    return
+                ok, sources = self.call(503, manager.list_sources)
+                if ok:
+                    self.send_json(200, sources)
+
+            def do_POST(self):
+                if self.path.rstrip("/") != "/sources":
+                    self.send_error(404)
+                    return
+                try:
+                    length = int(self.headers.get("Content-Length", 0))
+                    uri = json.loads(self.rfile.read(length) or b"{}")["uri"]
+                except (ValueError, KeyError, TypeError):
+                    self.send_json(400, {"error": 'expected {"uri": "<uri>"}'})
+                    return
+                ok, source_id = self.call(409, manager.add_source, uri)
+                if ok:
+                    self.send_json(201, {"id": source_id, "uri": uri})
+
+            def do_DELETE(self):
+                parts = self.path.strip("/").split("/")
+                if len(parts) != 2 or parts[0] != "sources" or not parts[1].isdigit():
+                    self.send_error(404)
+                    return
+                ok, _ = self.call(404, manager.remove_source, int(parts[1]))
+                if ok:
+                    self.send_json(200, {"id": int(parts[1])})
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        self.httpd = ThreadingHTTPServer((self.address, self.port), self.make_handler())
+        self.httpd.daemon_threads = True
+        self.port = self.httpd.server_address[1]
+        self.thread = threading.Thread(target=self.httpd.serve_forever,
+                                       name="control-server", daemon=True)
+        self.thread.start()
+        print("Serving the source control API on http://%s:%d/sources"
+              % (self.address, self.port))
+        return self
+
+    def stop(self):
+        if self.httpd:
+            self.httpd.shutdown()
+            self.httpd.server_close()
+            self.httpd = None
@@ -0,0 +1,181 @@
+"""
+    Helpers for probes decoding raw output tensors in Python.
+
+    With output-tensor-meta=1 (and network-type=100 to disable the built-in
+    parsing), nvinfer attaches the output layers of every frame as
+    NVDSINFER_TENSOR_OUTPUT_META user meta. These helpers view the layers
+    as NumPy arrays and add the decoded objects to the frame meta.
+"""
+
+import sys
+import ctypes
+
+import numpy as np
+import pyds
+import gi
+gi.require_version('Gst', '1.0')
+from gi.repository import Gst
+
+UNTRACKED_OBJECT_ID = 0xFFFFFFFFFFFFFFFF
+
+
+def frame_tensor_metas(batch_meta):
+    """ Yield (frame_meta, tensor_meta) for every frame carrying output
+        tensors, and mark the frames as inferred.
+    """
+    l_frame = batch_meta.frame_meta_list
+    while l_frame is not None:
+        frame_meta = pyds.NvDsFrameMeta.cast(l_frame.data)
+        l_user = frame_meta.frame_user_meta_list
+        while l_user is not None:
+            user_meta = pyds.NvDsUserMeta.cast(l_user.data)
+            if user_meta.base_meta.meta_type == pyds.NvDsMetaType.NVDSINFER_TENSOR_OUTPUT_META:
+                yield frame_meta, pyds.NvDsInferTensorMeta.cast(user_meta.user_meta_data)
+            l_user = l_user.next
+        frame_meta.bInferDone = True
+        l_frame = l_frame.next
+
+
+def layer_array(layer):
+    """ View a float32 layer buffer as an array of the layer dimensions.
+        No copy is made: the array is only valid while the buffer is.
+    """
+    dims = layer.inferDims
+    shape = tuple(dims.d[:dims.numDims])
+    ptr = ctypes.cast(pyds.get_ptr(layer.buffer), ctypes.POINTER(ctypes.c_float))
+    return np.ctypeslib.as_array(ptr, shape=shape)
+
+
+def output_layers(tensor_meta, names=None):
+    """ Return a dict of layer name to array view of the output layers,
+        only keeping names if it is given.
+    """
+    layers = {}
+    for i in range(tensor_meta.num_output_layers):
+        layer = pyds.get_nvds_LayerInfo(tensor_meta, i)
+        if names is None or layer.layerName in names:
+            layers[layer.layerName] = layer_array(layer)
+    return layers
+
+
+def network_scale(tensor_meta, frame_width, frame_height):
+    """ Return the (x, y) factors scaling network coordinates to the frame
+        resolution, for a network input stretched to the frame.
+    """
+    network_info = tensor_meta.network_info
+    return frame_width / network_info.width, frame_height / network_info.height
+
+
+def add_object(batch_meta, frame_meta, left, top, width, height, class_id, confidence,
+               label, component_id=1):
+    """ Add a detected object to the frame meta and return its NvDsObjectMeta.
+        Coordinates are in frame (muxer output) resolution.
+    """
+    obj_meta = pyds.nvds_acquire_obj_meta_from_pool(batch_meta)
+    obj_meta.unique_component_id = component_id
+    rect_params = obj_meta.rect_params
+    rect_params.left = left
+    rect_params.top = top
+    rect_params.width = width
+    rect_params.height = height
+    rect_params.has_bg_color = 0
+    rect_params.border_width = 3
+    rect_params.border_color.set(1, 0, 0, 1)
+    obj_meta.confidence = confidence
+    obj_meta.class_id = class_id
+    # There is no tracking ID upon detection. The tracker will assign an ID.
+    obj_meta.object_id = UNTRACKED_OBJECT_ID
+    obj_meta.obj_label = label
+
+    txt_params = obj_meta.text_params
+    if txt_params.display_text:
+        pyds.free_buffer(txt_params.display_text)
+    txt_params.x_offset = int(left)
+    txt_params.y_offset = max(0, int(top) - 10)
+    txt_params.display_text = "%s %.3f" % (label, confidence)
+    txt_params.font_params.font_name = "Serif"
+    txt_params.font_params.font_size = 10
+    txt_params.font_params.font_color.set(1.0, 1.0, 1.0, 1.0)
+    txt_params.set_bg_clr = 1
+    txt_params.text_bg_clr.set(0.0, 0.0, 0.0, 1.0)
+
+    pyds.nvds_add_obj_meta_to_frame(frame_meta, obj_meta, None)
+    return obj_meta
+
+
+def add_objects(batch_meta, frame_meta, boxes, scores, class_ids, labels, scale=(1.0, 1.0),
+                component_id=1):
+    """ Add decoded detections to the frame meta.
+
+        Keyword arguments:
+        - boxes : (N, 4) left, top, width, height in network resolution
+        - scores, class_ids : (N,) arrays
+        - labels : label names indexed by class id
+        - scale : (x, y) factors to the frame resolution, see network_scale
+
+        Return:
+        - the list of the NvDsObjectMeta added
+    """
+    scaled = np.asarray(boxes, dtype=np.float64) * (scale[0], scale[1], scale[0], scale[1])
+    obj_metas = []
+    for (left, top, width, height), confidence, class_id in zip(
+            scaled.tolist(), np.asarray(scores).tolist(), np.asarray(class_ids).tolist()):
+        label = labels[class_id] if class_id < len(labels) else str(class_id)
+        obj_metas.append(add_object(batch_meta, frame_meta, left, top, width, height,
+                                    class_id, confidence, label, component_id))
+    return obj_metas
+
+
+def parser_probe(pad, info, u_data):
+    """ Pad probe decoding the tensor meta of every frame with the parser
+        given as user data (see common.parser_registry) and adding the
+        objects to the frame meta.
+
+        The user data may also be (parser, scheduler), with a
+        common.inference_scheduler.InferenceScheduler: the frames it skips
+        are not parsed and get the objects of the last parsed frame of
+        their stream.
+    """
+    if isinstance(u_data, tuple):
+        parser, scheduler = u_data
+    else:
+        parser, scheduler = u_data, None
+    gst_buffer = info.get_buffer()
+    if not gst_buffer:
+        print("Unable to get GstBuffer ")
+        return Gst.PadProbeReturn.OK
+    batch_meta = pyds.gst_buffer_get_nvds_batch_meta(hash(gst_buffer))
+    output_names = parser.output_names
+    for frame_meta, tensor_meta in frame_tensor_metas(batch_meta):
+        stream_id = frame_meta.pad_index
+        if scheduler is not None and not scheduler.should_infer(stream_id):
+            held = scheduler.held(stream_id)
+            if held is not None:
+                add_parsed_objects(parser, batch_meta, frame_meta, *held)
+            continue
+        outputs = output_layers(tensor_meta, output_names)
+        if len(outputs) != len(output_names):
+            if not parser.warned:
+                sys.stderr.write("Parser %s: missing output layers %s\n" % (
+                    parser.name, ", ".join(sorted(set(output_names) - set(outputs)))))
+                parser.warned = True
+            continue
+        boxes, scores, class_ids, extra = parser.decode(outputs)
+        scale = network_scale(tensor_meta, parser.frame_width, parser.frame_height)
+        if scheduler is not None:
+            scheduler.observe_detections(stream_id, len(boxes))
+            # Copies: the results may view the tensors of this batch
+            scheduler.hold(stream_id, tuple(
+                np.array(value) if isinstance(value, np.ndarray) else value
+                for value in (boxes, scores, class_ids, extra)) + (scale,))
+        add_parsed_objects(parser, batch_meta, frame_meta, boxes, scores, class_ids, extra,
+                           scale)
+    return Gst.PadProbeReturn.OK
+
+
+def add_parsed_objects(parser, batch_meta, frame_meta, boxes, scores, class_ids, extra, scale):
+    """ Add the objects decoded by a parser to the frame meta. """
+    obj_metas = add_objects(batch_meta, frame_meta, boxes, scores, class_ids,
+                            parser.labels, scale)
+    if obj_metas:
+        parser.annotate(batch_meta, frame_meta, obj_metas, extra, scale)
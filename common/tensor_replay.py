@@ -0,0 +1,290 @@
+"""
+    Offline replay of output tensors through the Python parsers.
+
+    Output tensors are recorded from a live pipeline (TensorRecorder, see
+    the --record-tensors option of the apps) or generated (make_*_outputs)
+    and saved to a .npz file. They are then replayed at full speed through
+    any parser of common.parser_registry, on a CPU, without GStreamer:
+
+        frames = load_recording("yunet.npz")
+        report = replay(frames, create_parser("yunet", 1920, 1080))
+        print_report(report)
+
+    FakeLayerInfo and install_fake_pyds stand in for the pyds objects the
+    parsers expect. The replay always uses the stand-in, as the real pyds
+    functions only accept the layers of a live pipeline.
+"""
+
+import sys
+import time
+import types
+import ctypes
+from collections import OrderedDict
+
+import numpy as np
+
+# Replay stages, in order
+REPLAY_STAGES = ("view", "decode", "materialize")
+
+
+class FakeInferDims:
+    def __init__(self, dims):
+        self.d = list(dims)
+        self.numDims = len(dims)
+        self.numElements = int(np.prod(dims))
+
+
+class FakeLayerInfo:
+    """ Stand-in for pyds.NvDsInferLayerInfo backed by a NumPy array. """
+    def __init__(self, name, array):
+        self.layerName = name
+        self.dataType = 0
+        self.buffer = np.ascontiguousarray(array, dtype=np.float32).ravel()
+        self.inferDims = FakeInferDims(np.shape(array))
+
+
+class FakeObjectDetectionInfo:
+    __slots__ = ("classId", "left", "top", "width", "height", "detectionConfidence")
+
+
+class FakeMetaType:
+    """ Stand-in for the pyds metadata types: the nodes of fake metadata
+        lists hold the metas themselves, so cast returns its argument.
+    """
+    @staticmethod
+    def cast(data):
+        return data
+
+
+def install_fake_pyds(force=False):
+    """ Register a pyds stand-in exposing what the parsers use, unless the
+        real pyds is available. Return True if the stand-in is used.
+
+        Keyword arguments:
+        - force : replace the real pyds too, needed to replay FakeLayerInfo
+          objects, which the real pyds functions do not accept. Must be
+          called before the parsers are imported.
+    """
+    if not force:
+        try:
+            import pyds  # noqa: F401
+            return False
+        except ImportError:
+            pass
+    fake = types.ModuleType("pyds")
+    fake.get_detections = lambda buffer, index: float(buffer[index])
+    fake.get_ptr = lambda buffer: buffer.ctypes.data
+    fake.NvDsInferObjectDetectionInfo = FakeObjectDetectionInfo
+    fake.NvDsFrameMeta = FakeMetaType
+    fake.NvDsObjectMeta = FakeMetaType
+    sys.modules["pyds"] = fake
+    return True
+
+
+def make_layers(outputs):
+    """ Return FakeLayerInfo objects of a dict of layer name to array. """
+    return [FakeLayerInfo(name, array) for name, array in outputs.items()]
+
+
+def view_layers(layers, names=None):
+    """ View layer buffers as arrays like common.tensor_meta.output_layers
+        does in a probe, through pyds.get_ptr.
+    """
+    import pyds
+    outputs = {}
+    for layer in layers:
+        if names is None or layer.layerName in names:
+            dims = layer.inferDims
+            ptr = ctypes.cast(pyds.get_ptr(layer.buffer), ctypes.POINTER(ctypes.c_float))
+            outputs[layer.layerName] = np.ctypeslib.as_array(
+                ptr, shape=tuple(dims.d[:dims.numDims]))
+    return outputs
+
+
+def make_ssd_outputs(rng, max_detections=100, class_nb=91):
+    """ Random but plausible TensorFlow SSD outputs of one frame. """
+    y1x1 = rng.uniform(0.0, 0.9, (max_detections, 2))
+    y2x2 = y1x1 + rng.uniform(0.0, 0.3, (max_detections, 2))
+    return OrderedDict([
+        ("num_detections", np.array([max_detections], dtype=np.float32)),
+        ("detection_scores", np.sort(rng.uniform(0.0, 1.0, max_detections))[::-1]
+         .astype(np.float32)),
+        ("detection_classes", rng.integers(1, class_nb, max_detections).astype(np.float32)),
+        ("detection_boxes", np.concatenate([y1x1, y2x2], axis=1).astype(np.float32)),
+    ])
+
+
+def make_yunet_outputs(rng, faces=10, input_width=640, input_height=640, strides=(8, 16, 32)):
+    """ YuNet outputs of one frame with faces strong priors, each one
+        surrounded by weaker duplicates for the NMS to remove.
+    """
+    outputs = OrderedDict()
+    for stride in strides:
+        count = (input_width // stride) * (input_height // stride)
+        outputs["cls_%d" % stride] = rng.uniform(0.0, 0.3, (1, count, 1)).astype(np.float32)
+        outputs["obj_%d" % stride] = rng.uniform(0.0, 0.3, (1, count, 1)).astype(np.float32)
+        outputs["bbox_%d" % stride] = rng.normal(0.0, 0.2, (1, count, 4)).astype(np.float32)
+        outputs["kps_%d" % stride] = rng.normal(0.0, 0.5, (1, count, 10)).astype(np.float32)
+    for _ in range(faces):
+        stride = strides[rng.integers(len(strides))]
+        cols = input_width // stride
+        count = cols * (input_height // stride)
+        center = rng.integers(count)
+        for prior in (center, center - 1, center + 1, center - cols, center + cols):
+            if 0 <= prior < count:
+                outputs["cls_%d" % stride][0, prior] = rng.uniform(0.7, 1.0)
+                outputs["obj_%d" % stride][0, prior] = rng.uniform(0.7, 1.0)
+                outputs["bbox_%d" % stride][0, prior, 2:] = np.log(rng.uniform(2.0, 6.0))
+    return outputs
+
+
+def make_peoplenet_outputs(rng, objects=10, input_width=960, input_height=544, stride=16,
+                           bbox_norm=35.0, offset=0.5, class_nb=3):
+    """ PeopleNet outputs of one frame with objects covering several cells. """
+    cols = input_width // stride
+    rows = input_height // stride
+    coverage = rng.uniform(0.0, 0.1, (class_nb, rows, cols)).astype(np.float32)
+    bbox = rng.normal(0.0, 0.1, (4 * class_nb, rows, cols)).astype(np.float32)
+    centers_x = (np.arange(cols) * stride + offset) / bbox_norm
+    centers_y = (np.arange(rows) * stride + offset) / bbox_norm
+    for _ in range(objects):
+        class_id = rng.integers(class_nb)
+        x1, y1 = rng.uniform(0, input_width - 64), rng.uniform(0, input_height - 64)
+        x2, y2 = x1 + rng.uniform(32, 160), y1 + rng.uniform(32, 240)
+        c1, c2 = int(x1 // stride), min(int(x2 // stride) + 1, cols)
+        r1, r2 = int(y1 // stride), min(int(y2 // stride) + 1, rows)
+        coverage[class_id, r1:r2, c1:c2] = rng.uniform(0.5, 1.0, (r2 - r1, c2 - c1))
+        jitter = rng.normal(0.0, 1.0, (4, r2 - r1, c2 - c1)) / bbox_norm
+        bbox[4 * class_id + 0, r1:r2, c1:c2] = centers_x[c1:c2] - x1 / bbox_norm + jitter[0]
+        bbox[4 * class_id + 1, r1:r2, c1:c2] = (centers_y[r1:r2] - y1 / bbox_norm)[:, None] \
+            + jitter[1]
+        bbox[4 * class_id + 2, r1:r2, c1:c2] = x2 / bbox_norm - centers_x[c1:c2] + jitter[2]
+        bbox[4 * class_id + 3, r1:r2, c1:c2] = (y2 / bbox_norm - centers_y[r1:r2])[:, None] \
+            + jitter[3]
+    return OrderedDict([
+        ("output_bbox/BiasAdd:0", bbox[None]),
+        ("output_cov/Sigmoid:0", coverage[None]),
+    ])
+
+
+SYNTHETIC_OUTPUTS = {
+    "ssd": make_ssd_outputs,
+    "yunet": make_yunet_outputs,
+    "peoplenet": make_peoplenet_outputs,
+}
+
+
+def synthetic_frames(parser_name, frames=100, seed=0):
+    """ Return frames of synthetic outputs for a registered parser name. """
+    rng = np.random.default_rng(seed)
+    return [SYNTHETIC_OUTPUTS[parser_name](rng) for _ in range(frames)]
+
+
+class TensorRecorder:
+    """ Copies the output tensors of frames and saves them as a .npz file.
+        Used from a probe, see record_batch, or with outputs dicts.
+    """
+    def __init__(self, path, max_frames=1000):
+        self.path = path
+        self.max_frames = max_frames
+        self.frames = []
+
+    def record(self, outputs):
+        """ Copy a dict of layer name to array. Return False when full. """
+        if len(self.frames) >= self.max_frames:
+            return False
+        self.frames.append(OrderedDict((name, np.array(array, copy=True))
+                                       for name, array in outputs.items()))
+        return True
+
+    def record_batch(self, batch_meta):
+        """ Record the tensor meta of every frame of a batch. """
+        from common.tensor_meta import frame_tensor_metas, output_layers
+        for _, tensor_meta in frame_tensor_metas(batch_meta):
+            if not self.record(output_layers(tensor_meta)):
+                return False
+        return True
+
+    def save(self):
+        save_recording(self.path, self.frames)
+        print("Recorded %d frames of output tensors to %s" % (len(self.frames), self.path))
+
+
+def save_recording(path, frames):
+    """ Save frames (list of dicts of layer name to array) to a .npz file.
+        Layer names are stored apart as they may not be valid file names.
+    """
+    names = sorted({name for outputs in frames for name in outputs})
+    arrays = {"layer_names": np.array(names)}
+    for frame_index, outputs in enumerate(frames):
+        for name, array in outputs.items():
+            arrays["f%06d_l%03d" % (frame_index, names.index(name))] = array
+    np.savez(path, **arrays)
+
+
+def load_recording(path):
+    """ Load the frames saved by save_recording. """
+    frames = []
+    with np.load(path) as data:
+        names = data["layer_names"].tolist()
+        for key in sorted(k for k in data.files if k != "layer_names"):
+            frame_index, layer_index = int(key[1:7]), int(key[9:])
+            while len(frames) <= frame_index:
+                frames.append(OrderedDict())
+            frames[frame_index][names[layer_index]] = data[key]
+    return frames
+
+
+def replay(frames, parser, repeat=1, scale=(1.0, 1.0)):
+    """ Run every frame through parser as the tensor probe would, timing
+        each REPLAY_STAGES stage:
+        - view : layer buffers viewed as arrays through pyds.get_ptr
+        - decode : parser.decode
+        - materialize : boxes scaled and converted to Python values, as
+          common.tensor_meta.add_objects does before filling obj metas
+
+        Return:
+        - a report dict, see print_report
+    """
+    layer_frames = [make_layers(outputs) for outputs in frames]
+    output_names = parser.output_names
+    stage_ns = dict.fromkeys(REPLAY_STAGES, 0)
+    detections = 0
+    scale4 = (scale[0], scale[1], scale[0], scale[1])
+    start = time.perf_counter_ns()
+    for _ in range(repeat):
+        for layers in layer_frames:
+            t0 = time.perf_counter_ns()
+            outputs = view_layers(layers, output_names)
+            t1 = time.perf_counter_ns()
+            boxes, scores, class_ids, _ = parser.decode(outputs)
+            t2 = time.perf_counter_ns()
+            objects = list(zip((np.asarray(boxes, dtype=np.float64) * scale4).tolist(),
+                               np.asarray(scores).tolist(), np.asarray(class_ids).tolist()))
+            t3 = time.perf_counter_ns()
+            stage_ns["view"] += t1 - t0
+            stage_ns["decode"] += t2 - t1
+            stage_ns["materialize"] += t3 - t2
+            detections += len(objects)
+    elapsed = (time.perf_counter_ns() - start) / 1e9
+    frame_count = len(frames) * repeat
+    return {
+        "parser": parser.name,
+        "frames": frame_count,
+        "detections": detections,
+        "seconds": elapsed,
+        "frames_per_sec": frame_count / elapsed if elapsed else 0.0,
+        "detections_per_sec": detections / elapsed if elapsed else 0.0,
+        "stage_us": {stage: ns / frame_count / 1e3 if frame_count else 0.0
+                     for stage, ns in stage_ns.items()},
+    }
+
+
+def print_report(report):
+    print("parser=%s frames=%d detections=%d (%.1f per frame)" % (
+        report["parser"], report["frames"], report["detections"],
+        report["detections"] / report["frames"] if report["frames"] else 0.0))
+    print("throughput : %10.1f frames/s %12.1f detections/s" % (
+        report["frames_per_sec"], report["detections_per_sec"]))
+    for stage, us in report["stage_us"].items():
+        print("%-11s: %10.1f us/frame" % (stage, us))
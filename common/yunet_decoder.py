@@ -0,0 +1,119 @@
+"""
+    NumPy decoder of the YuNet face detector outputs.
+
+    YuNet has 3 detection heads of strides 8, 16 and 32. For an input of
+    640x640 they predict 6400 + 1600 + 400 priors, each with:
+    - cls_<stride>, obj_<stride> : class and objectness scores [N, 1]
+    - bbox_<stride> : center offset and log size in strides [N, 4]
+    - kps_<stride> : 5 landmarks (x, y) offsets in strides [N, 10]
+
+    The score of a prior is sqrt(cls * obj). The grid of every head is
+    computed once, decoding only touches the priors above the score
+    threshold before the NMS.
+
+        decoder = YuNetDecoder(640, 640)
+        boxes, scores, landmarks = decoder.decode(outputs)
+
+    outputs maps layer names to arrays and can come from the tensor meta
+    (common.tensor_meta.output_layers) or from synthetic tensors.
+"""
+
+import numpy as np
+
+from common.nms_engine import batched_nms
+
+YUNET_STRIDES = (8, 16, 32)
+YUNET_LANDMARKS = 5
+
+
+class YuNetLevel:
+    """ Prior grid of one detection head. """
+    __slots__ = ("stride", "count", "grid_x", "grid_y", "cls_name", "obj_name",
+                 "bbox_name", "kps_name")
+
+    def __init__(self, stride, input_width, input_height):
+        self.stride = stride
+        cols = input_width // stride
+        rows = input_height // stride
+        self.count = cols * rows
+        # Top left corner of every prior cell, in input pixels, row major
+        self.grid_x = np.tile(np.arange(cols, dtype=np.float32) * stride, rows)
+        self.grid_y = np.repeat(np.arange(rows, dtype=np.float32) * stride, cols)
+        self.cls_name = "cls_%d" % stride
+        self.obj_name = "obj_%d" % stride
+        self.bbox_name = "bbox_%d" % stride
+        self.kps_name = "kps_%d" % stride
+
+
+class YuNetDecoder:
+    """ Decodes YuNet outputs into boxes, scores and landmarks.
+
+        Keyword arguments:
+        - input_width, input_height : network input resolution
+        - score_threshold : minimum sqrt(cls * obj) of a face
+        - iou_threshold : NMS overlap threshold
+        - top_k : maximum number of faces per frame
+        - nms_method : "greedy", or "sweep" for crowded frames
+    """
+    def __init__(self, input_width=640, input_height=640, score_threshold=0.6,
+                 iou_threshold=0.3, top_k=750, strides=YUNET_STRIDES, nms_method="greedy"):
+        self.input_width = input_width
+        self.input_height = input_height
+        self.score_threshold = score_threshold
+        self.iou_threshold = iou_threshold
+        self.top_k = top_k
+        self.nms_method = nms_method
+        self.levels = [YuNetLevel(stride, input_width, input_height) for stride in strides]
+
+    @property
+    def output_names(self):
+        return [getattr(level, name) for name in ("cls_name", "obj_name", "bbox_name", "kps_name")
+                for level in self.levels]
+
+    def decode(self, outputs):
+        """ Decode the outputs of one frame.
+
+            Return:
+            - boxes : (N, 4) float32 left, top, width, height in input pixels
+            - scores : (N,) float32
+            - landmarks : (N, 10) float32 x0, y0, ... x4, y4 in input pixels
+        """
+        boxes = []
+        scores = []
+        landmarks = []
+        for level in self.levels:
+            cls = np.clip(outputs[level.cls_name].reshape(-1), 0.0, 1.0)
+            obj = np.clip(outputs[level.obj_name].reshape(-1), 0.0, 1.0)
+            level_scores = np.sqrt(cls * obj)
+            selected = np.flatnonzero(level_scores > self.score_threshold)
+            if not len(selected):
+                continue
+            stride = level.stride
+            grid_x = level.grid_x[selected]
+            grid_y = level.grid_y[selected]
+            bbox = outputs[level.bbox_name].reshape(level.count, 4)[selected]
+            kps = outputs[level.kps_name].reshape(level.count, 2 * YUNET_LANDMARKS)[selected]
+            width = np.exp(bbox[:, 2]) * stride
+            height = np.exp(bbox[:, 3]) * stride
+            level_boxes = np.empty((len(selected), 4), dtype=np.float32)
+            level_boxes[:, 0] = grid_x + bbox[:, 0] * stride - width * 0.5
+            level_boxes[:, 1] = grid_y + bbox[:, 1] * stride - height * 0.5
+            level_boxes[:, 2] = width
+            level_boxes[:, 3] = height
+            level_kps = np.empty((len(selected), 2 * YUNET_LANDMARKS), dtype=np.float32)
+            level_kps[:, 0::2] = kps[:, 0::2] * stride + grid_x[:, None]
+            level_kps[:, 1::2] = kps[:, 1::2] * stride + grid_y[:, None]
+            boxes.append(level_boxes)
+            scores.append(level_scores[selected])
+            landmarks.append(level_kps)
+        if not boxes:
+            return (np.empty((0, 4), np.float32), np.empty(0, np.float32),
+                    np.empty((0, 2 * YUNET_LANDMARKS), np.float32))
+        boxes = np.concatenate(boxes)
+        scores = np.concatenate(scores).astype(np.float32)
+        landmarks = np.concatenate(landmarks)
+        corners = boxes.copy()
+        corners[:, 2:] += corners[:, :2]
+        keep, _ = batched_nms(corners, scores, np.zeros(len(scores), dtype=np.int32),
+                              self.iou_threshold, self.nms_method, max_keep=self.top_k)
+        return boxes[keep], scores[keep], landmarks[keep]
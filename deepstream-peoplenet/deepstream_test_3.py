@@ -32,8 +32,16 @@ import sys
 import math
 import platform
 from common.platform_info import PlatformInfo
-from common.bus_call import bus_call
 from common.FPS import PERF_DATA
+from common.metrics_exporter import MetricsRegistry, MetricsServer, PipelineMetrics
+from common.probe_profiler import ProbeProfiler, count_batch_work
+from common.peoplenet_decoder import CLUSTER_MODES
+from common.parser_registry import check_config_layers, create_parser, parser_names
+from common.tensor_meta import parser_probe
+from common.tensor_replay import TensorRecorder
+from common.batch_controller import BatchTimeoutController
+from common.inference_scheduler import InferenceScheduler
+from common.source_manager import RECONNECT_POLICIES, ControlServer, SourceError, SourceManager
 
 import pyds
 
@@ -42,6 +50,20 @@ silent = False
 file_loop = False
 perf_data = None
 measure_latency = False
+metrics_port = None
+metrics = None
+profile_probes = False
+parser_name = None
+record_tensors_path = None
+cluster_mode = "nms"
+control_port = None
+max_sources = None
+reconnect = "live"
+latency_slo_ms = None
+max_pgie_interval = 0
+batch_controller = None
+max_skip_frames = 0
+scheduler = None
 
 MAX_DISPLAY_LEN=64
 PGIE_CLASS_ID_PERSON = 0
@@ -57,6 +79,22 @@ OSD_PROCESS_MODE= 0
 OSD_DISPLAY_TEXT= 1
 pgie_classes_str= ["Person", "Bag", "Face"]
 
+# record_tensors_probe copies the output tensors of every frame for offline
+# replay, see benchmarks/replay_tensors.py
+def record_tensors_probe(pad,info,u_data):
+    recorder = u_data
+    gst_buffer = info.get_buffer()
+    if gst_buffer:
+        recorder.record_batch(pyds.gst_buffer_get_nvds_batch_meta(hash(gst_buffer)))
+    return Gst.PadProbeReturn.OK
+
+# batch_pushed_probe times the batches entering pgie for the batch controller
+def batch_pushed_probe(pad,info,u_data):
+    gst_buffer = info.get_buffer()
+    if gst_buffer:
+        u_data.batch_pushed(gst_buffer.pts)
+    return Gst.PadProbeReturn.OK
+
 # pgie_src_pad_buffer_probe  will extract metadata received on tiler sink pad
 # and update params for drawing rectangle, object information etc.
 def pgie_src_pad_buffer_probe(pad,info,u_data):
@@ -81,6 +119,8 @@ def pgie_src_pad_buffer_probe(pad,info,u_data):
             print("Unable to get number of sources in GstBuffer for latency measurement")
 
     batch_meta = pyds.gst_buffer_get_nvds_batch_meta(hash(gst_buffer))
+    if batch_controller:
+        batch_controller.batch_inferred(gst_buffer.pts, batch_meta.num_frames_in_batch)
     l_frame = batch_meta.frame_meta_list
     while l_frame is not None:
         try:
@@ -116,9 +156,10 @@ def pgie_src_pad_buffer_probe(pad,info,u_data):
             print("Frame Number=", frame_number, "Number of Objects=",num_rects,"Bag_count=",obj_counter[PGIE_CLASS_ID_BAG],"Person_count=",obj_counter[PGIE_CLASS_ID_PERSON])
 
         # Update frame rate through this probe
-        stream_index = "stream{0}".format(frame_meta.pad_index)
         global perf_data
-        perf_data.update_fps(stream_index)
+        perf_data.update_fps(frame_meta.pad_index)
+        if metrics:
+            metrics.count_frame(frame_meta.pad_index, obj_counter)
 
         try:
             l_frame=l_frame.next
@@ -210,8 +251,15 @@ def create_source_bin(index,uri):
     return nbin
 
 def main(args, requested_pgie=None, config=None, disable_probe=False):
+    # Sources added at runtime use the free streammux pads, up to batch_size
+    batch_size = max(len(args), max_sources or 0)
     global perf_data
-    perf_data = PERF_DATA(len(args))
+    perf_data = PERF_DATA(batch_size)
+    global metrics
+    if metrics_port is not None:
+        registry = MetricsRegistry()
+        metrics = PipelineMetrics(registry, perf_data, pgie_classes_str)
+        MetricsServer(registry, metrics_port).start()
 
     number_sources=len(args)
 
@@ -235,24 +283,36 @@ def main(args, requested_pgie=None, config=None, disable_probe=False):
         sys.stderr.write(" Unable to create NvStreamMux \n")
 
     pipeline.add(streammux)
+    global scheduler
+    if max_skip_frames and parser_name:
+        scheduler = InferenceScheduler(batch_size, max_interval=max_skip_frames)
+        if metrics:
+            scheduler.register_metrics(metrics.registry)
+
+    def on_source_change(event, source_id, uri):
+        # A new source on a pad starts with the history of none
+        if event == "added" and scheduler:
+            scheduler.reset(source_id)
+
+    # With the control API, streams are removed when they end instead of
+    # ending the pipeline with the last one. Frame times of the pgie probe
+    # tell the health of the sources.
+    source_manager = SourceManager(pipeline, streammux, batch_size, create_source_bin,
+                                   remove_on_eos=control_port is not None,
+                                   on_change=on_source_change, reconnect=reconnect,
+                                   perf_data=None if disable_probe else perf_data)
+    if metrics:
+        source_manager.register_metrics(metrics.registry)
     for i in range(number_sources):
         print("Creating source_bin ",i," \n ")
         uri_name=args[i]
         print(f"uri for source {i}: {uri_name}\n")
         if uri_name.find("rtsp://") == 0 :
             is_live = True
-        source_bin=create_source_bin(i, uri_name)
-        if not source_bin:
-            sys.stderr.write("Unable to create source bin \n")
-        pipeline.add(source_bin)
-        padname=f"sink_{i}"
-        sinkpad= streammux.request_pad_simple(padname) 
-        if not sinkpad:
-            sys.stderr.write("Unable to create sink pad bin \n")
-        srcpad=source_bin.get_static_pad("src")
-        if not srcpad:
-            sys.stderr.write("Unable to create src pad bin \n")
-        srcpad.link(sinkpad)
+        try:
+            source_manager.add_source(uri_name)
+        except SourceError as e:
+            sys.stderr.write("Unable to add source %s: %s \n" % (uri_name, e))
     queue1=Gst.ElementFactory.make("queue","queue1")
     queue2=Gst.ElementFactory.make("queue","queue2")
     queue3=Gst.ElementFactory.make("queue","queue3")
@@ -265,6 +325,8 @@ def main(args, requested_pgie=None, config=None, disable_probe=False):
     pipeline.add(queue5)
 
     nvdslogger = None
+    profiler = None
+    recorder = None
 
     print("Creating Pgie \n ")
     if requested_pgie != None and (requested_pgie == 'nvinferserver' or requested_pgie == 'nvinferserver-grpc') :
@@ -331,13 +393,13 @@ def main(args, requested_pgie=None, config=None, disable_probe=False):
     if not sink:
         sys.stderr.write(" Unable to create sink element \n")
 
-    if is_live:
+    if is_live or control_port is not None:
         print("At least one of the sources is live")
         streammux.set_property('live-source', 1)
 
     streammux.set_property('width', 1920)
     streammux.set_property('height', 1080)
-    streammux.set_property('batch-size', number_sources)
+    streammux.set_property('batch-size', batch_size)
     streammux.set_property('batched-push-timeout', MUXER_BATCH_TIMEOUT_USEC)
     
     if requested_pgie == "nvinferserver" and config != None:
@@ -352,11 +414,22 @@ def main(args, requested_pgie=None, config=None, disable_probe=False):
     max_batch_size = pgie.get_property("unique-id")
     print(max_batch_size)
 
-    if(pgie_batch_size != number_sources):
-        print("WARNING: Overriding infer-config batch-size",pgie_batch_size," with number of sources ", number_sources," \n")
-        pgie.set_property("batch-size",number_sources)
-    tiler_rows=int(math.sqrt(number_sources))
-    tiler_columns=int(math.ceil((1.0*number_sources)/tiler_rows))
+    if(pgie_batch_size != batch_size):
+        print("WARNING: Overriding infer-config batch-size",pgie_batch_size," with number of sources ", batch_size," \n")
+        pgie.set_property("batch-size",batch_size)
+    global batch_controller
+    if latency_slo_ms is not None and not disable_probe:
+        # Retunes batched-push-timeout (and the pgie interval) from the
+        # frame rates and the batch latency measured by the probes
+        batch_controller = BatchTimeoutController(
+            batch_size, latency_slo_ms / 1000.0, max_interval=max_pgie_interval,
+            timeout_usec=MUXER_BATCH_TIMEOUT_USEC,
+            on_timeout=lambda usec: streammux.set_property('batched-push-timeout', usec),
+            on_interval=lambda interval: pgie.set_property('interval', interval))
+        pgie.get_static_pad("sink").add_probe(Gst.PadProbeType.BUFFER, batch_pushed_probe, batch_controller)
+        GLib.timeout_add(1000, batch_controller.poll, perf_data)
+    tiler_rows=int(math.sqrt(batch_size))
+    tiler_columns=int(math.ceil((1.0*batch_size)/tiler_rows))
     tiler.set_property("rows",tiler_rows)
     tiler.set_property("columns",tiler_columns)
     tiler.set_property("width", TILED_OUTPUT_WIDTH)
@@ -396,15 +469,50 @@ def main(args, requested_pgie=None, config=None, disable_probe=False):
     loop = GLib.MainLoop()
     bus = pipeline.get_bus()
     bus.add_signal_watch()
-    bus.connect ("message", bus_call, loop)
+    # Routes the errors of the source bins to their reconnection, and the
+    # rest to bus_call
+    bus.connect ("message", source_manager.bus_call, loop)
+    if metrics:
+        # Buffers dropped by the sinks and decoders with qos on
+        bus.connect("message::qos", metrics.on_qos_message)
+        for queue in (queue1, queue2, queue3, queue4, queue5):
+            metrics.watch_queue(queue)
+    control_server = None
+    if control_port is not None:
+        control_server = ControlServer(source_manager, control_port).start()
     pgie_src_pad=pgie.get_static_pad("src")
     if not pgie_src_pad:
         sys.stderr.write(" Unable to get src pad \n")
     else:
+        if record_tensors_path:
+            recorder = TensorRecorder(record_tensors_path)
+            pgie_src_pad.add_probe(Gst.PadProbeType.BUFFER, record_tensors_probe, recorder)
+        if parser_name:
+            # Added first so that the probes below see the decoded objects
+            parser = create_parser(parser_name, MUXER_OUTPUT_WIDTH, MUXER_OUTPUT_HEIGHT, cluster_mode=cluster_mode)
+            if config:
+                check_config_layers(parser, config)
+            if scheduler:
+                # Skips the parsing of the frames of idle streams
+                pgie_src_pad.add_probe(Gst.PadProbeType.BUFFER, parser_probe, (parser, scheduler))
+                # Effective inference rate of every stream
+                GLib.timeout_add(5000, scheduler.print_report)
+            else:
+                pgie_src_pad.add_probe(Gst.PadProbeType.BUFFER, parser_probe, parser)
         if not disable_probe:
-            pgie_src_pad.add_probe(Gst.PadProbeType.BUFFER, pgie_src_pad_buffer_probe, 0)
+            probe = pgie_src_pad_buffer_probe
+            if profile_probes or metrics:
+                # The profiler also feeds the metrics probe time histogram
+                profiler = ProbeProfiler(metrics, track_gc=profile_probes)
+                probe = profiler.wrap(probe, "pgie_src",
+                                      count_batch_work if profile_probes else None)
+                if profile_probes:
+                    # kill -USR1 <pid> starts a cProfile/stack capture, the next one dumps it
+                    profiler.install_signal_handler()
+            pgie_src_pad.add_probe(Gst.PadProbeType.BUFFER, probe, 0)
             # perf callback function to print fps every 5 sec
             GLib.timeout_add(5000, perf_data.perf_print_callback)
+            source_manager.start_health_checks()
 
     # Enable latency measurement via probe if environment variable NVDS_ENABLE_LATENCY_MEASUREMENT=1 is set.
     # To enable component level latency measurement, please set environment variable
@@ -428,7 +536,15 @@ def main(args, requested_pgie=None, config=None, disable_probe=False):
         pass
     # cleanup
     print("Exiting app\n")
+    if profile_probes and profiler:
+        profiler.print_report()
+    if batch_controller:
+        print("Batch controller:", batch_controller.stats())
+    if control_server:
+        control_server.stop()
     pipeline.set_state(Gst.State.NULL)
+    if recorder:
+        recorder.save()
 
 def parse_args():
 
@@ -486,6 +602,83 @@ def parse_args():
         dest='silent',
         help="Disable verbose output",
     )
+    parser.add_argument(
+        "--metrics-port",
+        type=int,
+        default=None,
+        dest="metrics_port",
+        help="Serve OpenMetrics on http://127.0.0.1:<port>/metrics",
+    )
+    parser.add_argument(
+        "--profile-probes",
+        action="store_true",
+        default=False,
+        dest="profile_probes",
+        help="Profile the probe functions, send SIGUSR1 to capture cProfile and stacks",
+    )
+    parser.add_argument(
+        "--parser",
+        default=None,
+        choices=parser_names(),
+        dest="parser",
+        help="Decode the output tensors with a Python parser, use with a *_tensor_meta.txt config",
+    )
+    parser.add_argument(
+        "--record-tensors",
+        default=None,
+        dest="record_tensors",
+        help="Record the output tensors to a .npz file for benchmarks/replay_tensors.py",
+    )
+    parser.add_argument(
+        "--cluster-mode",
+        default="nms",
+        choices=CLUSTER_MODES,
+        dest="cluster_mode",
+        help="Clustering of the --parser peoplenet detections",
+    )
+    parser.add_argument(
+        "--control-port",
+        type=int,
+        default=None,
+        dest="control_port",
+        help="Add and remove sources at runtime through http://127.0.0.1:<port>/sources",
+    )
+    parser.add_argument(
+        "--max-sources",
+        type=int,
+        default=None,
+        dest="max_sources",
+        help="Batch size, the maximum number of sources (default: the number of -i inputs)",
+    )
+    parser.add_argument(
+        "--reconnect",
+        default="live",
+        choices=RECONNECT_POLICIES,
+        dest="reconnect",
+        help="Sources rebuilt with backoff after an error or a stall: off, live (rtsp) or all",
+    )
+    parser.add_argument(
+        "--latency-slo-ms",
+        type=float,
+        default=None,
+        dest="latency_slo_ms",
+        help="Tune batched-push-timeout at runtime for this frame latency (default: fixed timeout)",
+    )
+    parser.add_argument(
+        "--max-pgie-interval",
+        type=int,
+        default=0,
+        dest="max_pgie_interval",
+        help="Highest pgie interval the --latency-slo-ms controller may set when overloaded",
+    )
+    parser.add_argument(
+        "--max-skip-frames",
+        type=int,
+        default=0,
+        dest="max_skip_frames",
+        help="Frames of a stream with little activity whose output tensors are not parsed (default: 0, parse every frame). "
+        "Needs --parser. Skipped frames go on through the pipeline with the objects of the last parsed frame",
+    )
     # Check input arguments
     if len(sys.argv) == 1:
         parser.print_help(sys.stderr)
@@ -499,9 +692,33 @@ def parse_args():
     global no_display
     global silent
     global file_loop
+    global metrics_port
+    global profile_probes
+    global parser_name
+    global record_tensors_path
+    global cluster_mode
+    global control_port
+    global max_sources
+    global reconnect
+    global latency_slo_ms
+    global max_pgie_interval
+    global max_skip_frames
     no_display = args.no_display
     silent = args.silent
     file_loop = args.file_loop
+    metrics_port = args.metrics_port
+    profile_probes = args.profile_probes
+    parser_name = args.parser
+    record_tensors_path = args.record_tensors
+    cluster_mode = args.cluster_mode
+    control_port = args.control_port
+    max_sources = args.max_sources
+    reconnect = args.reconnect
+    latency_slo_ms = args.latency_slo_ms
+    max_pgie_interval = args.max_pgie_interval
+    max_skip_frames = args.max_skip_frames
+    if max_skip_frames and not parser_name:
+        sys.stderr.write("--max-skip-frames needs --parser, ignored\n")
 
     if config and not pgie or pgie and not config:
         sys.stderr.write ("\nEither pgie or configfile is missing. Please specify both! Exiting...\n\n\n\n")
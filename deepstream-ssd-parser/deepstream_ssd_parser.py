@@ -20,13 +20,18 @@
 """ Example of deepstream using SSD neural network and parsing SSD's outputs. """
 
 import sys
-import io
 sys.path.append("../")
 import gi
 gi.require_version("Gst", "1.0")
 from gi.repository import GLib, Gst
 from common.bus_call import bus_call
-from ssd_parser import nvds_infer_parse_custom_tf_ssd, DetectionParam, NmsParam, BoxSizeParam
+from common.label_registry import LabelRegistry
+from common.pipeline_builder import PipelineBuilder, PipelineSpecError
+from common.postprocess_pool import PostprocessPool
+from common.probe_profiler import ProbeProfiler, count_batch_work
+from common.tensor_meta import layer_array
+from ssd_parser import (nvds_infer_parse_custom_tf_ssd, nvds_infer_parse_custom_tf_ssd_batch,
+                        make_nodi_list, DetectionParam, NmsParam, BoxSizeParam)
 import pyds
 
 
@@ -41,33 +46,115 @@ MIN_BOX_WIDTH = 32
 MIN_BOX_HEIGHT = 32
 TOP_K = 20
 IOU_THRESHOLD = 0.3
+# "array" (vectorized) or "per_index" (one pyds.get_detections call per value)
+DECODE_MODE = "array"
+# Decode and cluster every frame of a batch in one call instead of frame by frame
+PARSE_WHOLE_BATCH = True
+# Decode the frames in this many worker processes (0 decodes in the probe)
+POSTPROCESS_WORKERS = 0
+# Seconds the probe waits for the workers before decoding the rest itself
+POSTPROCESS_TIMEOUT = 0.02
+LABEL_FILE = "labels.txt"
+# Re-read the label file when it changes on disk
+LABEL_HOT_RELOAD = False
+# Measure the probes, SIGUSR1 starts a cProfile/stack capture and the next one dumps it
+PROFILE_PROBES = False
 OUTPUT_VIDEO_NAME = "./out.mp4"
 MUXER_BATCH_TIMEOUT_USEC = 33000
-
-def get_label_names_from_file(filepath):
-    """ Read a label file and convert it to string list """
-    f = io.open(filepath, "r")
-    labels = f.readlines()
-    labels = [elm[:-1] for elm in labels]
-    f.close()
-    return labels
-
-
-def make_elm_or_print_err(factoryname, name, printedname, detail=""):
-    """ Creates an element with Gst Element Factory make.
-        Return the element  if successfully created, otherwise print
-        to stderr and return None.
+# Queues inserted in front of these element factories, and their properties
+# (e.g. {"leaky": 2, "max-size-buffers": 4} to drop frames instead of blocking)
+QUEUE_BEFORE = []
+QUEUE_PROPERTIES = {}
+
+class ParserContext:
+    """ Labels and parser parameters, created once at startup and shared by
+        the probes through their user data.
+    """
+    def __init__(self, label_file, hot_reload=False):
+        self.labels = LabelRegistry(label_file, hot_reload)
+        self.detection_params = DetectionParam(CLASS_NB, ACCURACY_ALL_CLASS)
+        self.box_size_param = BoxSizeParam(IMAGE_HEIGHT, IMAGE_WIDTH,
+                                           MIN_BOX_WIDTH, MIN_BOX_HEIGHT)
+        self.nms_param = NmsParam(TOP_K, IOU_THRESHOLD)
+        self.pool = None
+        if POSTPROCESS_WORKERS:
+            # Normalized boxes, like nvds_infer_parse_custom_tf_ssd
+            self.pool = PostprocessPool("ssd", IMAGE_WIDTH, IMAGE_HEIGHT, POSTPROCESS_WORKERS,
+                                        timeout=POSTPROCESS_TIMEOUT, class_nb=CLASS_NB,
+                                        threshold=ACCURACY_ALL_CLASS,
+                                        min_box_size=MIN_BOX_WIDTH, top_k=TOP_K,
+                                        iou_threshold=IOU_THRESHOLD, input_width=1,
+                                        input_height=1)
+
+
+def pipeline_spec(input_file, pgie_probe, osd_probe, context):
+    """ Return the PipelineBuilder spec of the app:
+        file-source -> h264-parser -> nvh264-decoder -> nvstreammux ->
+        nvinferserver -> nvvidconv -> nvosd -> queue -> nvvidconv2 ->
+        capsfilter -> encoder -> mpeg4 parser -> qtmux -> filesink
     """
-    print("Creating", printedname)
-    elm = Gst.ElementFactory.make(factoryname, name)
-    if not elm:
-        sys.stderr.write("Unable to create " + printedname + " \n")
-        if detail:
-            sys.stderr.write(detail)
-    return elm
+    # On Jetson, there is a problem with the encoder failing to initialize
+    # due to limitation on TLS usage. To work around this, preload libgomp.
+    # Add a reminder here in case the user forgets.
+    preload_reminder = "If the following error is encountered:\n" + \
+                       "/usr/lib/aarch64-linux-gnu/libgomp.so.1: cannot allocate memory in static TLS block\n" + \
+                       "Preload the offending library:\n" + \
+                       "export LD_PRELOAD=/usr/lib/aarch64-linux-gnu/libgomp.so.1\n"
+    return {
+        "name": "ssd-pipeline",
+        "elements": [
+            # Source element for reading from the file
+            {"name": "file-source", "factory": "filesrc", "properties": {"location": input_file}},
+            # Since the data format in the input file is elementary h264 stream,
+            # we need a h264parser
+            {"name": "h264-parser", "factory": "h264parse"},
+            # Use nvdec_h264 for hardware accelerated decode on GPU
+            {"name": "nvv4l2-decoder", "factory": "nvv4l2decoder"},
+            # Create nvstreammux instance to form batches from one or more sources.
+            {"name": "Stream-muxer", "factory": "nvstreammux", "properties": {
+                "width": IMAGE_WIDTH,
+                "height": IMAGE_HEIGHT,
+                "batch-size": 1,
+                "batched-push-timeout": MUXER_BATCH_TIMEOUT_USEC,
+            }},
+            # Use nvinferserver to run inferencing on decoder's output,
+            # behaviour of inferencing is set through config file
+            {"name": "primary-inference", "factory": "nvinferserver",
+             "properties": {"config-file-path": "dstest_ssd_nopostprocess.txt"}},
+            # Use convertor to convert from NV12 to RGBA as required by nvosd
+            {"name": "convertor", "factory": "nvvideoconvert"},
+            # Create OSD to draw on the converted RGBA buffer
+            {"name": "onscreendisplay", "factory": "nvdsosd"},
+            # Finally encode and save the osd output, in its own thread
+            {"name": "convertor2", "factory": "nvvideoconvert", "queue": True},
+            {"name": "capsfilter", "factory": "capsfilter",
+             "properties": {"caps": "video/x-raw, format=I420"}},
+            {"name": "encoder", "factory": "avenc_mpeg4", "detail": preload_reminder,
+             "properties": {"bitrate": 2000000}},
+            {"name": "mpeg4-parser", "factory": "mpeg4videoparse"},
+            {"name": "qtmux", "factory": "qtmux"},
+            {"name": "filesink", "factory": "filesink",
+             "properties": {"location": OUTPUT_VIDEO_NAME, "sync": 0, "async": 0}},
+        ],
+        "links": [
+            ["file-source", "h264-parser", "nvv4l2-decoder", "Stream-muxer.sink_0"],
+            ["Stream-muxer", "primary-inference", "convertor", "onscreendisplay", "convertor2",
+             "capsfilter", "encoder", "mpeg4-parser", "qtmux", "filesink"],
+        ],
+        "queues": {"before": QUEUE_BEFORE, "properties": QUEUE_PROPERTIES},
+        "probes": [
+            # Add a probe on the primary-infer source pad to get inference output tensors
+            {"pad": "primary-inference.src", "callback": pgie_probe, "data": context},
+            # Lets add probe to get informed of the meta data generated, we add probe to
+            # the sink pad of the osd element, since by that time, the buffer would have
+            # had got all the metadata.
+            {"pad": "onscreendisplay.sink", "callback": osd_probe, "data": context},
+        ],
+    }
 
 
 def osd_sink_pad_buffer_probe(pad, info, u_data):
+    context = u_data
     frame_number = 0
     # Intiallizing object counter with 0.
     obj_counter = dict(enumerate([0] * CLASS_NB))
@@ -82,6 +169,8 @@ def osd_sink_pad_buffer_probe(pad, info, u_data):
     # Note that pyds.gst_buffer_get_nvds_batch_meta() expects the
     # C address of gst_buffer as input, which is obtained with hash(gst_buffer)
     batch_meta = pyds.gst_buffer_get_nvds_batch_meta(hash(gst_buffer))
+    car_id = context.labels.index_of("car")
+    person_id = context.labels.index_of("person")
     l_frame = batch_meta.frame_meta_list
     while l_frame is not None:
         try:
@@ -119,16 +208,12 @@ def osd_sink_pad_buffer_probe(pad, info, u_data):
         # memory will not be claimed by the garbage collector.
         # Reading the display_text field here will return the C address of the
         # allocated string. Use pyds.get_string() to get the string content.
-        id_dict = {
-            val: index
-            for index, val in enumerate(get_label_names_from_file("labels.txt"))
-        }
         disp_string = "Frame Number={} Number of Objects={} Vehicle_count={} Person_count={}"
         py_nvosd_text_params.display_text = disp_string.format(
             frame_number,
             num_rects,
-            obj_counter[id_dict["car"]],
-            obj_counter[id_dict["person"]],
+            obj_counter[car_id],
+            obj_counter[person_id],
         )
 
         # Now set the offsets where the string should appear
@@ -156,7 +241,7 @@ def osd_sink_pad_buffer_probe(pad, info, u_data):
     return Gst.PadProbeReturn.OK
 
 
-def add_obj_meta_to_frame(frame_object, batch_meta, frame_meta, label_names):
+def add_obj_meta_to_frame(frame_object, batch_meta, frame_meta, labels):
     """ Inserts an object into the metadata """
     # this is a good place to insert objects into the metadata.
     # Here's an example of inserting a single object.
@@ -184,12 +269,9 @@ def add_obj_meta_to_frame(frame_object, batch_meta, frame_meta, label_names):
     # assign an ID.
     obj_meta.object_id = UNTRACKED_OBJECT_ID
 
-    lbl_id = frame_object.classId
-    if lbl_id >= len(label_names):
-        lbl_id = 0
-
     # Set the object classification label.
-    obj_meta.obj_label = label_names[lbl_id]
+    label = labels.name_of(frame_object.classId)
+    obj_meta.obj_label = label
 
     # Set display text for the object.
     txt_params = obj_meta.text_params
@@ -199,7 +281,7 @@ def add_obj_meta_to_frame(frame_object, batch_meta, frame_meta, label_names):
     txt_params.x_offset = int(rect_params.left)
     txt_params.y_offset = max(0, int(rect_params.top) - 10)
     txt_params.display_text = (
-        label_names[lbl_id] + " " + "{:04.3f}".format(frame_object.detectionConfidence)
+        label + " " + "{:04.3f}".format(frame_object.detectionConfidence)
     )
     # Font , font-color and font-size
     txt_params.font_params.font_name = "Serif"
@@ -218,6 +300,7 @@ def add_obj_meta_to_frame(frame_object, batch_meta, frame_meta, label_names):
 
 
 def pgie_src_pad_buffer_probe(pad, info, u_data):
+    context = u_data
 
     gst_buffer = info.get_buffer()
     if not gst_buffer:
@@ -230,13 +313,13 @@ def pgie_src_pad_buffer_probe(pad, info, u_data):
     batch_meta = pyds.gst_buffer_get_nvds_batch_meta(hash(gst_buffer))
     l_frame = batch_meta.frame_meta_list
 
-    detection_params = DetectionParam(CLASS_NB, ACCURACY_ALL_CLASS)
-    box_size_param = BoxSizeParam(IMAGE_HEIGHT, IMAGE_WIDTH,
-                                  MIN_BOX_WIDTH, MIN_BOX_HEIGHT)
-    nms_param = NmsParam(TOP_K, IOU_THRESHOLD)
-
-    label_names = get_label_names_from_file("labels.txt")
+    # The OSD probe sees the same labels, so reloading here is enough.
+    context.labels.refresh()
 
+    # Gather the output layers of every frame first so that the whole batch
+    # can be parsed at once, then scatter the objects back to their frame.
+    frame_metas = []
+    batch_layers_info = []
     while l_frame is not None:
         try:
             # Note that l_frame.data needs a cast to pyds.NvDsFrameMeta
@@ -260,38 +343,59 @@ def pgie_src_pad_buffer_probe(pad, info, u_data):
 
             if (
                     user_meta.base_meta.meta_type
-                    != pyds.NvDsMetaType.NVDSINFER_TENSOR_OUTPUT_META
+                    == pyds.NvDsMetaType.NVDSINFER_TENSOR_OUTPUT_META
             ):
-                continue
+                tensor_meta = pyds.NvDsInferTensorMeta.cast(user_meta.user_meta_data)
 
-            tensor_meta = pyds.NvDsInferTensorMeta.cast(user_meta.user_meta_data)
+                # Boxes in the tensor meta should be in network resolution which is
+                # found in tensor_meta.network_info. Use this info to scale boxes to
+                # the input frame resolution.
+                layers_info = []
 
-            # Boxes in the tensor meta should be in network resolution which is
-            # found in tensor_meta.network_info. Use this info to scale boxes to
-            # the input frame resolution.
-            layers_info = []
+                for i in range(tensor_meta.num_output_layers):
+                    layer = pyds.get_nvds_LayerInfo(tensor_meta, i)
+                    layers_info.append(layer)
 
-            for i in range(tensor_meta.num_output_layers):
-                layer = pyds.get_nvds_LayerInfo(tensor_meta, i)
-                layers_info.append(layer)
-
-            frame_object_list = nvds_infer_parse_custom_tf_ssd(
-                layers_info, detection_params, box_size_param, nms_param
-            )
+                frame_metas.append(frame_meta)
+                batch_layers_info.append(layers_info)
             try:
                 l_user = l_user.next
             except StopIteration:
                 break
 
-            for frame_object in frame_object_list:
-                add_obj_meta_to_frame(frame_object, batch_meta, frame_meta, label_names)
-
         try:
             # indicate inference is performed on the frame
             frame_meta.bInferDone = True
             l_frame = l_frame.next
         except StopIteration:
             break
+
+    if context.pool:
+        results = context.pool.decode_batch([
+            {layer.layerName: layer_array(layer) for layer in layers_info}
+            for layers_info in batch_layers_info
+        ])
+        batch_object_list = [
+            make_nodi_list(boxes[:, 0], boxes[:, 1], boxes[:, 2], boxes[:, 3], scores, class_ids)
+            for boxes, scores, class_ids, _ in results
+        ]
+    elif PARSE_WHOLE_BATCH:
+        batch_object_list = nvds_infer_parse_custom_tf_ssd_batch(
+            batch_layers_info, context.detection_params, context.box_size_param,
+            context.nms_param
+        )
+    else:
+        batch_object_list = [
+            nvds_infer_parse_custom_tf_ssd(
+                layers_info, context.detection_params, context.box_size_param,
+                context.nms_param, DECODE_MODE
+            )
+            for layers_info in batch_layers_info
+        ]
+
+    for frame_meta, frame_object_list in zip(frame_metas, batch_object_list):
+        for frame_object in frame_object_list:
+            add_obj_meta_to_frame(frame_object, batch_meta, frame_meta, context.labels)
     return Gst.PadProbeReturn.OK
 
 
@@ -301,120 +405,30 @@ def main(args):
         sys.stderr.write("usage: %s <media file or uri>\n" % args[0])
         sys.exit(1)
 
+    # Labels and parser parameters are loaded once and shared by both probes
+    context = ParserContext(LABEL_FILE, LABEL_HOT_RELOAD)
+
     # Standard GStreamer initialization
     Gst.init(None)
 
-    # Create gstreamer elements
-    # Create Pipeline element that will form a connection of other elements
-    print("Creating Pipeline \n ")
-    pipeline = Gst.Pipeline()
-
-    if not pipeline:
-        sys.stderr.write(" Unable to create Pipeline \n")
-
-    # Source element for reading from the file
-    source = make_elm_or_print_err("filesrc", "file-source", "Source")
-
-    # Since the data format in the input file is elementary h264 stream,
-    # we need a h264parser
-    h264parser = make_elm_or_print_err("h264parse", "h264-parser", "H264Parser")
-
-    # Use nvdec_h264 for hardware accelerated decode on GPU
-    decoder = make_elm_or_print_err("nvv4l2decoder", "nvv4l2-decoder", "Decoder")
-
-    # Create nvstreammux instance to form batches from one or more sources.
-    streammux = make_elm_or_print_err("nvstreammux", "Stream-muxer", "NvStreamMux")
-
-    # Use nvinferserver to run inferencing on decoder's output,
-    # behaviour of inferencing is set through config file
-    pgie = make_elm_or_print_err("nvinferserver", "primary-inference", "Nvinferserver")
-
-    # Use convertor to convert from NV12 to RGBA as required by nvosd
-    nvvidconv = make_elm_or_print_err("nvvideoconvert", "convertor", "Nvvidconv")
-
-    # Create OSD to draw on the converted RGBA buffer
-    nvosd = make_elm_or_print_err("nvdsosd", "onscreendisplay", "OSD (nvosd)")
-
-
-    # Finally encode and save the osd output
-    queue = make_elm_or_print_err("queue", "queue", "Queue")
-
-    nvvidconv2 = make_elm_or_print_err("nvvideoconvert", "convertor2", "Converter 2 (nvvidconv2)")
-
-    capsfilter = make_elm_or_print_err("capsfilter", "capsfilter", "capsfilter")
-
-    caps = Gst.Caps.from_string("video/x-raw, format=I420")
-    capsfilter.set_property("caps", caps)
-
-    # On Jetson, there is a problem with the encoder failing to initialize
-    # due to limitation on TLS usage. To work around this, preload libgomp.
-    # Add a reminder here in case the user forgets.
-    preload_reminder = "If the following error is encountered:\n" + \
-                       "/usr/lib/aarch64-linux-gnu/libgomp.so.1: cannot allocate memory in static TLS block\n" + \
-                       "Preload the offending library:\n" + \
-                       "export LD_PRELOAD=/usr/lib/aarch64-linux-gnu/libgomp.so.1\n"
-    encoder = make_elm_or_print_err("avenc_mpeg4", "encoder", "Encoder", preload_reminder)
-
-    encoder.set_property("bitrate", 2000000)
-
-    codeparser = make_elm_or_print_err("mpeg4videoparse", "mpeg4-parser", 'Code Parser')
-
-    container = make_elm_or_print_err("qtmux", "qtmux", "Container")
-
-    sink = make_elm_or_print_err("filesink", "filesink", "Sink")
-
-    sink.set_property("location", OUTPUT_VIDEO_NAME)
-    sink.set_property("sync", 0)
-    sink.set_property("async", 0)
+    pgie_probe = pgie_src_pad_buffer_probe
+    osd_probe = osd_sink_pad_buffer_probe
+    if PROFILE_PROBES:
+        profiler = ProbeProfiler()
+        pgie_probe = profiler.wrap(pgie_probe, "pgie_src", count_batch_work)
+        osd_probe = profiler.wrap(osd_probe, "osd_sink", count_batch_work)
+        profiler.install_signal_handler()
 
+    # Create, add and link the elements and add the probes
     print("Playing file %s " % args[1])
-    source.set_property("location", args[1])
-    streammux.set_property("width", IMAGE_WIDTH)
-    streammux.set_property("height", IMAGE_HEIGHT)
-    streammux.set_property("batch-size", 1)
-    streammux.set_property("batched-push-timeout", MUXER_BATCH_TIMEOUT_USEC)
-    pgie.set_property("config-file-path", "dstest_ssd_nopostprocess.txt")
-
-    print("Adding elements to Pipeline \n")
-    pipeline.add(source)
-    pipeline.add(h264parser)
-    pipeline.add(decoder)
-    pipeline.add(streammux)
-    pipeline.add(pgie)
-    pipeline.add(nvvidconv)
-    pipeline.add(nvosd)
-    pipeline.add(queue)
-    pipeline.add(nvvidconv2)
-    pipeline.add(capsfilter)
-    pipeline.add(encoder)
-    pipeline.add(codeparser)
-    pipeline.add(container)
-    pipeline.add(sink)
-
-    # we link the elements together
-    # file-source -> h264-parser -> nvh264-decoder ->
-    # nvinfer -> nvvidconv -> nvosd -> video-renderer
-    print("Linking elements in the Pipeline \n")
-    source.link(h264parser)
-    h264parser.link(decoder)
-
-    sinkpad = streammux.request_pad_simple("sink_0")
-    if not sinkpad:
-        sys.stderr.write(" Unable to get the sink pad of streammux \n")
-    srcpad = decoder.get_static_pad("src")
-    if not srcpad:
-        sys.stderr.write(" Unable to get source pad of decoder \n")
-    srcpad.link(sinkpad)
-    streammux.link(pgie)
-    pgie.link(nvvidconv)
-    nvvidconv.link(nvosd)
-    nvosd.link(queue)
-    queue.link(nvvidconv2)
-    nvvidconv2.link(capsfilter)
-    capsfilter.link(encoder)
-    encoder.link(codeparser)
-    codeparser.link(container)
-    container.link(sink)
+    try:
+        pipeline = PipelineBuilder(pipeline_spec(args[1], pgie_probe, osd_probe,
+                                                 context)).build()
+    except PipelineSpecError as e:
+        sys.stderr.write("%s\n" % e)
+        if context.pool:
+            context.pool.close()
+        return 1
 
     # create an event loop and feed gstreamer bus mesages to it
     loop = GLib.MainLoop()
@@ -422,22 +436,6 @@ def main(args):
     bus.add_signal_watch()
     bus.connect("message", bus_call, loop)
 
-    # Add a probe on the primary-infer source pad to get inference output tensors
-    pgiesrcpad = pgie.get_static_pad("src")
-    if not pgiesrcpad:
-        sys.stderr.write(" Unable to get src pad of primary infer \n")
-
-    pgiesrcpad.add_probe(Gst.PadProbeType.BUFFER, pgie_src_pad_buffer_probe, 0)
-
-    # Lets add probe to get informed of the meta data generated, we add probe to
-    # the sink pad of the osd element, since by that time, the buffer would have
-    # had got all the metadata.
-    osdsinkpad = nvosd.get_static_pad("sink")
-    if not osdsinkpad:
-        sys.stderr.write(" Unable to get sink pad of nvosd \n")
-
-    osdsinkpad.add_probe(Gst.PadProbeType.BUFFER, osd_sink_pad_buffer_probe, 0)
-
     # start play back and listen to events
     print("Starting pipeline \n")
     pipeline.set_state(Gst.State.PLAYING)
@@ -446,7 +444,12 @@ def main(args):
     except:
         pass
     # cleanup
+    if PROFILE_PROBES:
+        profiler.print_report()
     pipeline.set_state(Gst.State.NULL)
+    if context.pool:
+        print("Post-processing pool:", context.pool.stats())
+        context.pool.close()
 
 
 if __name__ == "__main__":
@@ -19,51 +19,79 @@
     Non Maximum Supression algorithm translated from
     src_utils_nvdsinferserver_infer_postprocess.cpp
     The function that should be imported is cluster_and_fill_detection_output_nms
+    The suppression itself is done by the NumPy engine in common/nms_engine.py
 """
 
-def overlap_1d(x1min, x1max, x2min, x2max):
-    """ Return the overlap distance between 2 segments. """
-    if x1min > x2min:
-        x1min, x2min = x2min, x1min
-        x1max, x2max = x2max, x1max
-    return 0 if x1max < x2min else min(x1max, x2max) - x2min
-
-
-def compute_iou(bbox1, bbox2):
-    """ Compute the result of the intersection over union of 2 boxes. """
-    overlap_x = overlap_1d(
-        bbox1.left, bbox1.left + bbox1.width, bbox2.left, bbox2.left + bbox2.width
-    )
-    overlap_y = overlap_1d(
-        bbox1.top, bbox1.top + bbox1.height, bbox2.top, bbox2.top + bbox2.height
-    )
-    area_1 = bbox1.width * bbox1.height
-    area_2 = bbox2.width * bbox2.height
-    intersection = overlap_x * overlap_y
-    union = area_1 + area_2 - intersection
-    return 0 if union == 0 else intersection / union
-
-
-def non_maximum_suppression(score_index, bbox, nms_threshold):
-    """ Test boxes overlapping. Returns indices of boxes that do not overlap more
-    than nms_threshold.
+import numpy as np
+from common.nms_engine import SOFT_NMS_METHODS, batched_nms, ltwh_to_corners
+
+
+def objects_to_arrays(object_list):
+    """ Convert a NvDsInferObjectDetectionInfo list to NumPy arrays.
+
+        Return:
+        - (N, 4) float32 corner boxes
+        - (N,) float32 scores
+        - (N,) int32 class ids
+    """
+    count = len(object_list)
+    columns = np.empty((6, count), dtype=np.float32)
+    for i, obj in enumerate(object_list):
+        columns[:, i] = (obj.left, obj.top, obj.width, obj.height,
+                         obj.detectionConfidence, obj.classId)
+    boxes = ltwh_to_corners(columns[0], columns[1], columns[2], columns[3])
+    return boxes, columns[4], columns[5].astype(np.int32)
+
+
+def cluster_detection_arrays(boxes, scores, class_ids, topk=20, iou_threshold=0.4,
+                             method="greedy", sigma=0.5, score_threshold=0.001,
+                             pre_nms_top_k=0):
+    """ Array version of cluster_and_fill_detection_output_nms.
+
+        The suppression stops once topk boxes are kept instead of clustering
+        every box and truncating the result.
+
+        Return:
+        - indices of the kept boxes, sorted by decreasing score and limited
+          to topk (0 means no limit).
+        - scores of the kept boxes (decayed for soft-nms).
     """
-    indices = []
-    for pair in score_index:
-        idx = pair[1]
-        keep = True
-        for indice in indices:
-            if keep:
-                overlap = compute_iou(bbox[idx], bbox[indice])
-                keep = overlap <= nms_threshold
-            else:
-                break
-        if keep:
-            indices.append(idx)
-    return indices
-
-
-def cluster_and_fill_detection_output_nms(object_list, topk=20, iou_threshold=0.4):
+    return batched_nms(boxes, scores, class_ids, iou_threshold, method, sigma,
+                       score_threshold, max_keep=topk, pre_nms_top_k=pre_nms_top_k)
+
+
+def cluster_batch_arrays(boxes, scores, class_ids, frame_ids, class_nb, topk=20,
+                         iou_threshold=0.4, method="greedy", sigma=0.5,
+                         score_threshold=0.001, pre_nms_top_k=0):
+    """ Cluster the detections of several frames in a single NMS call.
+
+        Boxes only suppress boxes of the same frame and class, and topk is
+        applied per frame, like pre_nms_top_k per frame and class.
+
+        Return:
+        - indices of the kept boxes, sorted by decreasing score.
+        - scores of the kept boxes (decayed for soft-nms).
+    """
+    keys = frame_ids.astype(np.int64) * class_nb + class_ids
+    keep, kept_scores = batched_nms(boxes, scores, keys, iou_threshold,
+                                    method, sigma, score_threshold,
+                                    pre_nms_top_k=pre_nms_top_k)
+    if topk != 0 and len(keep) > topk:
+        # Rank of every kept box inside its frame, a stable sort preserves
+        # the decreasing score order within each frame.
+        kept_frames = frame_ids[keep]
+        by_frame = np.argsort(kept_frames, kind="stable")
+        sorted_frames = kept_frames[by_frame]
+        rank = np.arange(len(by_frame)) - np.searchsorted(sorted_frames, sorted_frames)
+        selected = np.sort(by_frame[rank < topk])
+        keep = keep[selected]
+        kept_scores = kept_scores[selected]
+    return keep, kept_scores
+
+
+def cluster_and_fill_detection_output_nms(object_list, topk=20, iou_threshold=0.4,
+                                          method="greedy", sigma=0.5,
+                                          score_threshold=0.001, pre_nms_top_k=0):
     """ Post-process object list in order to remove redundant boxes and limit
         the number of boxes.
 
@@ -71,29 +99,27 @@ def cluster_and_fill_detection_output_nms(object_list, topk=20, iou_threshold=0.
         - object_list : list of NvDsInferObjectDetectionInfo objects
         - topk : maximum number of boxes kept (default 20)
         - iou_threshold : maximum overlap allowance between 2 boxes (default 0.4)
+        - method : "greedy", "sweep" (greedy result computed on overlapping
+          boxes only, faster on crowded frames), or "linear"/"gaussian" for
+          soft-nms (default greedy)
+        - sigma : gaussian soft-nms spread (default 0.5)
+        - score_threshold : soft-nms minimum decayed score (default 0.001)
+        - pre_nms_top_k : maximum number of boxes of every class entering the
+          suppression, a bound for crowded frames (default 0, no limit)
 
         Return:
-        - Cleaned NvDsInferObjectDetectionInfo object list.
+        - Cleaned NvDsInferObjectDetectionInfo object list, sorted by
+          decreasing confidence.
     """
-    clustered_b_boxes = []
-    per_class_object_list = {}
-    for obj in object_list:
-        cl_id = obj.classId
-        if cl_id not in per_class_object_list:
-            per_class_object_list[cl_id] = []
-        per_class_object_list[cl_id].append(obj)
-
-    for key in per_class_object_list:
-        class_objs = per_class_object_list[key]
-        score_index = [(elm.detectionConfidence, i) for i, elm in enumerate(class_objs)]
-        score_index.sort(key=lambda x: x[0], reverse=True)
-
-        indices = non_maximum_suppression(score_index, class_objs, iou_threshold)
-        for idx in indices:
-            clustered_b_boxes.append(class_objs[idx])
-
-    if topk != 0 and len(clustered_b_boxes) > topk:
-        clustered_b_boxes.sort(lambda x: x.detectionConfidence, reverse=True)
-        clustered_b_boxes = clustered_b_boxes[:topk]
+    if not object_list:
+        return []
+    boxes, scores, class_ids = objects_to_arrays(object_list)
+    keep, kept_scores = cluster_detection_arrays(boxes, scores, class_ids, topk,
+                                                 iou_threshold, method, sigma,
+                                                 score_threshold, pre_nms_top_k)
 
+    clustered_b_boxes = [object_list[idx] for idx in keep]
+    if method in SOFT_NMS_METHODS:
+        for obj, score in zip(clustered_b_boxes, kept_scores):
+            obj.detectionConfidence = float(score)
     return clustered_b_boxes
@@ -18,11 +18,27 @@
 """
     Simple python SSD output parser.
     The function `nvds_infer_parse_custom_tf_ssd` should be used.
+
+    Two decode modes are available:
+    - "array" (default) views the output layers as NumPy arrays once per
+      frame, filters them with vectorized masks and only creates
+      NvDsInferObjectDetectionInfo objects for the boxes kept by NMS.
+    - "per_index" reads the layers one value at a time with
+      pyds.get_detections, as the original sample does.
+
+    `nvds_infer_parse_custom_tf_ssd_batch` decodes every frame of a batch
+    with a single vectorized call.
 """
 
 import sys
+import ctypes
+import numpy as np
 import pyds
-from nms import cluster_and_fill_detection_output_nms
+from nms import (cluster_and_fill_detection_output_nms, cluster_detection_arrays,
+                 cluster_batch_arrays)
+from common.nms_engine import ltwh_to_corners
+
+DECODE_MODES = ("array", "per_index")
 
 
 class BoxSizeParam:
@@ -44,10 +60,22 @@ class BoxSizeParam:
 
 
 class NmsParam:
-    """ Contains parametter for non maximal suppression algorithm. """
-    def __init__(self, top_k=20, iou_threshold=0.4):
+    """ Contains parametter for non maximal suppression algorithm.
+        method is "greedy", "sweep" (the greedy result computed on the
+        overlapping boxes only, for crowded frames), or "linear"/"gaussian"
+        for soft-nms, in which case sigma and score_threshold are used as
+        well.
+        pre_nms_top_k bounds the boxes of every class entering the
+        suppression (0 means no limit).
+    """
+    def __init__(self, top_k=20, iou_threshold=0.4, method="greedy",
+                 sigma=0.5, score_threshold=0.001, pre_nms_top_k=0):
         self.top_k = top_k
         self.iou_threshold = iou_threshold
+        self.method = method
+        self.sigma = sigma
+        self.score_threshold = score_threshold
+        self.pre_nms_top_k = pre_nms_top_k
 
 
 class DetectionParam:
@@ -115,8 +143,140 @@ def make_nodi(index, layers, detection_param, box_size_param):
     return res
 
 
+def layer_as_array(layer, count):
+    """ View the first count floats of a layer buffer as a NumPy array.
+        No copy is made: the array is only valid while the buffer is.
+    """
+    ptr = ctypes.cast(pyds.get_ptr(layer.buffer), ctypes.POINTER(ctypes.c_float))
+    return np.ctypeslib.as_array(ptr, shape=(count,))
+
+
+def decode_detection_arrays(scores, classes, boxes, detection_param, box_size_param):
+    """ Vectorized equivalent of make_nodi over every detection index.
+
+        Keyword arguments:
+        - scores : (N,) detection_scores values
+        - classes : (N,) detection_classes values
+        - boxes : (N, 4) detection_boxes values as (y1, x1, y2, x2)
+        - detection_param : contains per class threshold. (DetectionParam)
+        - box_size_param : minimum box size. (BoxSizeParam)
+
+        Return:
+        - (left, top, width, height, score, class_id) arrays of the
+          detections passing every filter.
+        - the boolean mask of the input detections passing every filter.
+    """
+    class_ids = classes.astype(np.int32)
+    thresholds = np.asarray(detection_param.classes_threshold, dtype=np.float64)
+    valid = (class_ids >= 0) & (class_ids < detection_param.class_nb)
+    valid &= scores >= thresholds[np.where(valid, class_ids, 0)]
+
+    boxes = np.clip(boxes.astype(np.float64), 0.0, 1.0)
+    top = boxes[:, 0]
+    left = boxes[:, 1]
+    height = boxes[:, 2] - top
+    width = boxes[:, 3] - left
+    valid &= box_size_param.screen_width * width > box_size_param.min_box_width
+    valid &= box_size_param.screen_height * height > box_size_param.min_box_height
+
+    return (left[valid], top[valid], width[valid], height[valid],
+            scores[valid], class_ids[valid], valid)
+
+
+def make_nodi_list(left, top, width, height, scores, class_ids):
+    """ Creates NvDsInferObjectDetectionInfo objects from decoded arrays. """
+    object_list = []
+    for values in zip(left.tolist(), top.tolist(), width.tolist(), height.tolist(),
+                      scores.tolist(), class_ids.tolist()):
+        res = pyds.NvDsInferObjectDetectionInfo()
+        res.left, res.top, res.width, res.height = values[:4]
+        res.detectionConfidence = values[4]
+        res.classId = values[5]
+        object_list.append(res)
+    return object_list
+
+
+def parse_layers_per_index(x3_layers, num_detection, detection_param,
+                           box_size_param, nms_param):
+    """ Original decode path: one make_nodi call per detection index. """
+    object_list = []
+    for i in range(num_detection):
+        obj = make_nodi(i, x3_layers, detection_param, box_size_param)
+        if obj:
+            object_list.append(obj)
+
+    if object_list:
+        object_list = cluster_and_fill_detection_output_nms(object_list, nms_param.top_k,
+                                                            nms_param.iou_threshold,
+                                                            nms_param.method,
+                                                            nms_param.sigma,
+                                                            nms_param.score_threshold,
+                                                            nms_param.pre_nms_top_k)
+    return object_list
+
+
+def view_ssd_layers(x3_layers, num_detection):
+    """ Return (scores, classes, boxes) NumPy views of the first
+        num_detection detections of the score/class/box layers.
+    """
+    score_layer, class_layer, box_layer = x3_layers
+    scores = layer_as_array(score_layer, num_detection)
+    classes = layer_as_array(class_layer, num_detection)
+    boxes = layer_as_array(box_layer, num_detection * 4).reshape(num_detection, 4)
+    return scores, classes, boxes
+
+
+def parse_layers_array(x3_layers, num_detection, detection_param,
+                       box_size_param, nms_param):
+    """ Array decode path: filter and cluster on NumPy views of the layers,
+        then materialize the kept boxes only.
+    """
+    if num_detection == 0:
+        return []
+    scores, classes, boxes = view_ssd_layers(x3_layers, num_detection)
+
+    left, top, width, height, scores, class_ids, _ = decode_detection_arrays(
+        scores, classes, boxes, detection_param, box_size_param
+    )
+    if not len(scores):
+        return []
+
+    corners = ltwh_to_corners(left, top, width, height)
+    keep, kept_scores = cluster_detection_arrays(corners, scores, class_ids,
+                                                 nms_param.top_k,
+                                                 nms_param.iou_threshold,
+                                                 nms_param.method,
+                                                 nms_param.sigma,
+                                                 nms_param.score_threshold,
+                                                 nms_param.pre_nms_top_k)
+    return make_nodi_list(left[keep], top[keep], width[keep], height[keep],
+                          kept_scores, class_ids[keep])
+
+
+def find_ssd_layers(output_layer_info):
+    """ Return the number of detections and the score/class/box layers of
+        output_layer_info, or None if some layers are missing.
+    """
+    num_detection_layer = layer_finder(output_layer_info, "num_detections")
+    score_layer = layer_finder(output_layer_info, "detection_scores")
+    class_layer = layer_finder(output_layer_info, "detection_classes")
+    box_layer = layer_finder(output_layer_info, "detection_boxes")
+
+    if not num_detection_layer or not score_layer or not class_layer or not box_layer:
+        sys.stderr.write("ERROR: some layers missing in output tensors\n")
+        return None
+
+    num_detection = 0
+
+    if num_detection_layer.buffer:
+        num_detection = int(pyds.get_detections(num_detection_layer.buffer, 0))
+        num_detection = clip(num_detection, 0, class_layer.inferDims.d[0])
+
+    return num_detection, (score_layer, class_layer, box_layer)
+
+
 def nvds_infer_parse_custom_tf_ssd(output_layer_info, detection_param, box_size_param,
-                                   nms_param=NmsParam()):
+                                   nms_param=NmsParam(), decode_mode="array"):
     """ Get data from output_layer_info and fill object_list
         with several NvDsInferObjectDetectionInfo.
 
@@ -129,33 +289,77 @@ def nvds_infer_parse_custom_tf_ssd(output_layer_info, detection_param, box_size_
             that are too small. (BoxSizeParam)
         - nms_param : contains information for performing non maximal
             suppression. (NmsParam)
+        - decode_mode : one of DECODE_MODES. (default "array")
 
         Return:
         - Bounding boxes. (NvDsInferObjectDetectionInfo list)
     """
-    num_detection_layer = layer_finder(output_layer_info, "num_detections")
-    score_layer = layer_finder(output_layer_info, "detection_scores")
-    class_layer = layer_finder(output_layer_info, "detection_classes")
-    box_layer = layer_finder(output_layer_info, "detection_boxes")
+    found = find_ssd_layers(output_layer_info)
+    if not found:
+        return []
 
-    if not num_detection_layer or not score_layer or not class_layer or not box_layer:
-        sys.stderr.write("ERROR: some layers missing in output tensors\n")
+    num_detection, x3_layers = found
+    if decode_mode == "per_index":
+        return parse_layers_per_index(x3_layers, num_detection, detection_param,
+                                      box_size_param, nms_param)
+    if decode_mode != "array":
+        sys.stderr.write("ERROR: unknown decode mode %s\n" % decode_mode)
         return []
+    return parse_layers_array(x3_layers, num_detection, detection_param,
+                              box_size_param, nms_param)
 
-    num_detection = 0
 
-    if num_detection_layer.buffer:
-        num_detection = int(pyds.get_detections(num_detection_layer.buffer, 0))
-        num_detection = clip(num_detection, 0, class_layer.inferDims.d[0])
+def nvds_infer_parse_custom_tf_ssd_batch(batch_layer_info, detection_param,
+                                         box_size_param, nms_param=NmsParam()):
+    """ Parse the outputs of every frame of a batch at once.
 
-    x3_layers = score_layer, class_layer, box_layer
-    object_list = []
-    for i in range(num_detection):
-        obj = make_nodi(i, x3_layers, detection_param, box_size_param)
-        if obj:
-            object_list.append(obj)
+        The detections of all frames are stacked into single arrays, decoded
+        and clustered with one vectorized NMS call (boxes only suppress boxes
+        of the same frame and class), then split back per frame.
 
-    if object_list:
-        object_list = cluster_and_fill_detection_output_nms(object_list, nms_param.top_k,
-                                                            nms_param.iou_threshold)
-    return object_list
+        Keyword arguments:
+        - batch_layer_info : one NvDsInferLayerInfo list per frame.
+        - detection_param, box_size_param, nms_param : see
+            nvds_infer_parse_custom_tf_ssd.
+
+        Return:
+        - One bounding box list per frame, in batch_layer_info order.
+            (list of NvDsInferObjectDetectionInfo lists)
+    """
+    batch_object_list = [[] for _ in batch_layer_info]
+    stacked = []
+    for frame_idx, output_layer_info in enumerate(batch_layer_info):
+        found = find_ssd_layers(output_layer_info)
+        if not found or found[0] == 0:
+            continue
+        num_detection, x3_layers = found
+        scores, classes, boxes = view_ssd_layers(x3_layers, num_detection)
+        stacked.append((scores, classes, boxes,
+                        np.full(num_detection, frame_idx, dtype=np.int32)))
+
+    if not stacked:
+        return batch_object_list
+
+    scores, classes, boxes, frame_ids = (np.concatenate(column) for column in zip(*stacked))
+    left, top, width, height, scores, class_ids, valid = decode_detection_arrays(
+        scores, classes, boxes, detection_param, box_size_param
+    )
+    if not len(scores):
+        return batch_object_list
+
+    frame_ids = frame_ids[valid]
+    corners = ltwh_to_corners(left, top, width, height)
+    keep, kept_scores = cluster_batch_arrays(corners, scores, class_ids, frame_ids,
+                                             detection_param.class_nb,
+                                             nms_param.top_k,
+                                             nms_param.iou_threshold,
+                                             nms_param.method,
+                                             nms_param.sigma,
+                                             nms_param.score_threshold,
+                                             nms_param.pre_nms_top_k)
+
+    object_list = make_nodi_list(left[keep], top[keep], width[keep], height[keep],
+                                 kept_scores, class_ids[keep])
+    for frame_idx, obj in zip(frame_ids[keep].tolist(), object_list):
+        batch_object_list[frame_idx].append(obj)
+    return batch_object_list
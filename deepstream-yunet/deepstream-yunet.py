@@ -7,11 +7,14 @@
 ################################################################################
 
 import sys
+
+sys.path.append("../")
 import gi
 
 gi.require_version("Gst", "1.0")
 from gi.repository import Gst, GLib
 import pyds
+from common.offload_queue import DetectionRecord, OffloadQueue, print_detections
 
 # Change these class IDs / strings according to your model
 PGIE_CLASS_ID_VEHICLE = 0
@@ -19,6 +22,9 @@ PGIE_CLASS_ID_BICYCLE = 1
 PGIE_CLASS_ID_PERSON = 2
 PGIE_CLASS_ID_ROADSIGN = 3
 
+# Detections are printed by a worker thread so the probe returns immediately
+detection_queue = None
+
 
 # Simple function to handle GStreamer Bus Messages (errors, EOS, state changes).
 def bus_call(bus, message, loop):
@@ -56,22 +62,28 @@ def pgie_src_pad_buffer_probe(pad, info, u_data):
             PGIE_CLASS_ID_ROADSIGN: 0,
         }
 
+        records = []
         l_obj = frame_meta.obj_meta_list
         while l_obj is not None:
             obj_meta = pyds.NvDsObjectMeta.cast(l_obj.data)
             obj_counter[obj_meta.class_id] += 1
             l_obj = l_obj.next
-            # Get bounding box coordinates
+            # Copy the fields the worker needs, the metadata does not outlive the buffer
             rect_params = obj_meta.rect_params
-            left = int(rect_params.left)
-            top = int(rect_params.top)
-            width = int(rect_params.width)
-            height = int(rect_params.height)
-            print(
-                f"Frame={frame_number}, Object={obj_meta.object_id}, "
-                f"Class={obj_meta.class_id}, "
-                f"Bounding Box=({left},{top}),({left+width},{top+height})"
+            records.append(
+                DetectionRecord(
+                    frame_number,
+                    frame_meta.pad_index,
+                    obj_meta.class_id,
+                    obj_meta.object_id,
+                    obj_meta.confidence,
+                    rect_params.left,
+                    rect_params.top,
+                    rect_params.width,
+                    rect_params.height,
+                )
             )
+        detection_queue.put_many(records)
 
         # print(f"Frame={frame_number}, Total Objects={num_rects}, "
         #       f"Vehicle={obj_counter[PGIE_CLASS_ID_VEHICLE]}, "
@@ -99,6 +111,9 @@ def cb_newpad(decodebin, decoder_src_pad, data):
 
 
 def main(input_uri, pgie_config_path):
+    global detection_queue
+    detection_queue = OffloadQueue(print_detections)
+
     # Standard GStreamer initialization
     Gst.init(None)
 
@@ -181,6 +196,9 @@ def main(input_uri, pgie_config_path):
     # Cleanup
     print("Exiting app...")
     pipeline.set_state(Gst.State.NULL)
+    detection_queue.close()
+    if detection_queue.dropped:
+        print("Dropped %d detection records" % detection_queue.dropped)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,177 @@
+"""
+    Zero-copy NumPy access to the frames of appsink samples.
+
+        frame_access = FrameAccess(ring_size=4)
+
+        def on_new_sample(sink):
+            sample = sink.emit("pull-sample")
+            with frame_access.map_sample(sample) as mapped:
+                frame = mapped.frame              # (H, W, C) uint8 view of the buffer
+                owned = frame_access.copy(frame)  # only if the frame must be kept
+
+    The layout (shape and row stride) is computed once per negotiated caps.
+    The view honors the row stride, so padded rows are skipped, not copied,
+    and the stride and offset of a GstVideoMeta take precedence over the caps.
+
+    The view points into the mapped buffer, which is unmapped when the with
+    block ends and the last view of it is gone: a view kept past the block
+    never reads freed memory, but it holds the buffer out of its pool and can
+    stall the pipeline. copy() copies the frame into a ring of preallocated
+    arrays instead: an array stays valid until ring_size more frames are
+    copied, and no memory is allocated per frame.
+"""
+
+import gi
+gi.require_version('Gst', '1.0')
+gi.require_version('GstVideo', '1.0')
+from gi.repository import Gst, GstVideo
+import numpy as np
+
+# Bytes per pixel of the packed formats a frame can be viewed in
+PACKED_FORMATS = {
+    "RGBA": 4, "BGRA": 4, "ARGB": 4, "ABGR": 4,
+    "RGBx": 4, "BGRx": 4, "xRGB": 4, "xBGR": 4,
+    "RGB": 3, "BGR": 3,
+    "GRAY8": 1,
+}
+
+
+class FrameAccessError(Exception):
+    pass
+
+
+class FrameLayout:
+    """ Shape and row stride of the frames of a caps. """
+    __slots__ = ("format", "width", "height", "channels", "stride")
+
+    def __init__(self, caps):
+        structure = caps.get_structure(0)
+        self.format = structure.get_value("format")
+        if self.format not in PACKED_FORMATS:
+            raise FrameAccessError("unsupported frame format %s, use one of %s"
+                                   % (self.format, ", ".join(PACKED_FORMATS)))
+        self.width = structure.get_value("width")
+        self.height = structure.get_value("height")
+        self.channels = PACKED_FORMATS[self.format]
+        # Default GStreamer stride of packed formats: rows padded to 4 bytes
+        self.stride = (self.width * self.channels + 3) // 4 * 4
+
+    @property
+    def shape(self):
+        return (self.height, self.width, self.channels)
+
+    def view(self, data, offset=0, stride=None):
+        """ Return the read-only (H, W, C) view of a frame in data, a 1-D
+            uint8 array of the buffer.
+        """
+        stride = stride or self.stride
+        needed = offset + (self.height - 1) * stride + self.width * self.channels
+        if len(data) < needed:
+            raise FrameAccessError("buffer of %d bytes, %d expected for %dx%d %s"
+                                   % (len(data), needed, self.width, self.height, self.format))
+        return np.lib.stride_tricks.as_strided(data[offset:], shape=self.shape,
+                                               strides=(stride, self.channels, 1),
+                                               writeable=False)
+
+
+class MappedArray(np.ndarray):
+    """ Array over mapped buffer memory, referencing its BufferMapping. """
+    def __array_finalize__(self, obj):
+        self.mapping = getattr(obj, "mapping", None)
+
+
+class BufferMapping:
+    """ Owner of the arrays viewing a mapped buffer: the buffer is unmapped
+        when the last of them is freed.
+    """
+    def __init__(self, buffer, map_info):
+        self.buffer = buffer
+        self.map_info = map_info
+        # Keeps the memoryview of the mapping, the memory owner, referenced
+        self.data = np.frombuffer(map_info.data, dtype=np.uint8)
+
+    def array(self):
+        """ Return a 1-D uint8 array of the buffer keeping the mapping alive. """
+        array = self.data.view(MappedArray)
+        array.mapping = self
+        return array
+
+    def __del__(self):
+        self.buffer.unmap(self.map_info)
+
+
+class MappedFrame:
+    """ Context manager mapping the buffer of a sample for reading.
+
+        Inside the with block:
+        - frame : read-only (H, W, C) uint8 view of the buffer
+        - layout : the FrameLayout of the sample caps
+        - new_layout : whether the caps changed since the previous sample
+    """
+    def __init__(self, buffer, layout, new_layout):
+        self.buffer = buffer
+        self.layout = layout
+        self.new_layout = new_layout
+        self.frame = None
+
+    def __enter__(self):
+        result, map_info = self.buffer.map(Gst.MapFlags.READ)
+        if not result:
+            raise FrameAccessError("unable to map the buffer")
+        offset, stride = 0, None
+        meta = GstVideo.buffer_get_video_meta(self.buffer)
+        if meta is not None:
+            offset, stride = meta.offset[0], meta.stride[0]
+        # Unmaps the buffer when freed, on error below too
+        data = BufferMapping(self.buffer, map_info).array()
+        self.frame = self.layout.view(data, offset, stride)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # Unmaps the buffer now, unless a view of it is still referenced
+        self.frame = None
+        return False
+
+
+class FrameAccess:
+    """ Maps appsink samples as NumPy frames, see the module docstring.
+
+        Keyword arguments:
+        - ring_size : number of preallocated arrays copy() cycles through,
+          0 allocates a new array per copy
+    """
+    def __init__(self, ring_size=0):
+        self.ring_size = ring_size
+        self.caps = None
+        self.layout = None
+        self.ring = []
+        self.ring_pos = 0
+
+    def layout_of(self, caps):
+        """ Return the FrameLayout of caps and whether it changed. """
+        if self.caps is not None and (caps is self.caps or caps.is_equal(self.caps)):
+            return self.layout, False
+        self.layout = FrameLayout(caps)
+        self.caps = caps
+        # Arrays of the previous shape are of no use anymore
+        self.ring = []
+        self.ring_pos = 0
+        return self.layout, True
+
+    def map_sample(self, sample):
+        """ Return the MappedFrame context manager of a sample. """
+        layout, new_layout = self.layout_of(sample.get_caps())
+        return MappedFrame(sample.get_buffer(), layout, new_layout)
+
+    def copy(self, frame):
+        """ Copy a frame into the next array of the ring and return it. """
+        if not self.ring_size:
+            return np.array(frame)
+        if len(self.ring) < self.ring_size:
+            self.ring.append(np.empty(frame.shape, dtype=frame.dtype))
+        out = self.ring[self.ring_pos]
+        if out.shape != frame.shape:
+            out = self.ring[self.ring_pos] = np.empty(frame.shape, dtype=frame.dtype)
+        np.copyto(out, frame)
+        self.ring_pos = (self.ring_pos + 1) % self.ring_size
+        return out
@@ -1,9 +1,13 @@
 import gi
 gi.require_version('Gst', '1.0')
 from gi.repository import Gst, GLib
-import numpy as np
 import time
 
+from frame_access import FrameAccess, FrameAccessError
+
+# Preallocated arrays frame_access.copy() cycles through
+OUTPUT_RING_SIZE = 4
+
 def on_end_of_stream(bus, message, loop,start_time):
     """
     Called when EOS (End of Stream) message is posted on the bus.
@@ -11,37 +15,30 @@ def on_end_of_stream(bus, message, loop,start_time):
     end_time = time.time()
     print("Readed End of Stream")
     print(f"Total time: {end_time - start_time}")
-def on_new_sample(sink):
+def on_new_sample(sink, frame_access):
     """Callback triggered when a new sample is ready from appsink."""
     sample = sink.emit("pull-sample")
     if not sample:
         return Gst.FlowReturn.ERROR
 
-    # Get the buffer from the sample
-    buf = sample.get_buffer()
-    caps = sample.get_caps()
+    try:
+        # Maps the buffer, the frame is a view of it until the end of the block
+        with frame_access.map_sample(sample) as mapped:
+            frame = mapped.frame
+            if mapped.new_layout:
+                # Caps are only parsed again when they change
+                layout = mapped.layout
+                print(f"Width: {layout.width}, Height: {layout.height}, "
+                      f"Format: {layout.format}, Stride: {layout.stride}")
+                print("Frame shape:", frame.shape)
 
-    # Map the buffer data (i.e., get the actual bytes of the frame)
-    result, map_info = buf.map(Gst.MapFlags.READ)
-    if not result:
+            # Process the (height, width, channels) frame here, and copy
+            # what must outlive the block into the preallocated output ring,
+            # e.g. owned = frame_access.copy(frame)
+            del frame
+    except FrameAccessError as e:
+        print("Frame access failed:", e)
         return Gst.FlowReturn.ERROR
-    
-    # Get the frame dimensions
-    width = caps.get_structure(0).get_value("width")
-    height = caps.get_structure(0).get_value("height")
-    print(f"Width: {width}, Height: {height}")
-
-    try:
-        frame_data = map_info.data
-        # Since we've requested 'video/x-raw, format=RGBA' or 'RGB',
-        # we can interpret it as an 8-bit array
-        frame = np.frombuffer(frame_data, dtype=np.uint8)
-        print("Raw frame shape:", frame.shape)
-        
-        # You can reshape based on width/height if needed
-        # e.g. frame = frame.reshape((height, width, 4))  # if RGBA
-    finally:
-        buf.unmap(map_info)
 
     return Gst.FlowReturn.OK
 
@@ -73,7 +70,8 @@ def main():
     # Grab appsink element by name
     sink = pipeline.get_by_name("mysink")
     # Connect the callback for new samples
-    sink.connect("new-sample", on_new_sample)
+    frame_access = FrameAccess(ring_size=OUTPUT_RING_SIZE)
+    sink.connect("new-sample", on_new_sample, frame_access)
 
     # Start playing
     pipeline.set_state(Gst.State.PLAYING)
@@ -0,0 +1,73 @@
+""" Scrapes a MetricsServer on localhost and parses its OpenMetrics text. """
+
+import os
+import sys
+import types
+import unittest
+from urllib.request import urlopen
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.metrics_exporter import (OPENMETRICS_CONTENT_TYPE, MetricsRegistry, MetricsServer,
+                                     PipelineMetrics)
+
+
+def parse_samples(text):
+    """ Return {sample name with labels: value} of an OpenMetrics text. """
+    samples = {}
+    for line in text.splitlines():
+        if line and not line.startswith("#"):
+            name, value = line.rsplit(" ", 1)
+            samples[name] = float(value)
+    return samples
+
+
+class QosMessage:
+    def __init__(self, element, dropped):
+        self.src = types.SimpleNamespace(get_name=lambda: element)
+        self.dropped = dropped
+
+    def parse_qos_stats(self):
+        return None, 0, self.dropped
+
+
+class MetricsServerTest(unittest.TestCase):
+    def setUp(self):
+        self.registry = MetricsRegistry()
+        self.metrics = PipelineMetrics(self.registry, class_names=["person"])
+        self.server = MetricsServer(self.registry, 0).start()
+
+    def tearDown(self):
+        self.server.stop()
+
+    def scrape(self, path="/metrics"):
+        with urlopen("http://127.0.0.1:%d%s" % (self.server.port, path), timeout=5) as response:
+            return response.headers["Content-Type"], response.read().decode("utf-8")
+
+    def test_scrape(self):
+        self.metrics.count_frame(0, {0: 2})
+        self.metrics.count_frame(0, {0: 1})
+        self.metrics.probe_time.labels("pgie_src").observe(0.0003)
+        content_type, text = self.scrape()
+        self.assertEqual(content_type, OPENMETRICS_CONTENT_TYPE)
+        self.assertTrue(text.endswith("# EOF\n"))
+        samples = parse_samples(text)
+        self.assertEqual(samples['deepstream_frames_total{stream="0"}'], 2)
+        self.assertEqual(samples['deepstream_objects_total{stream="0",class="person"}'], 3)
+        self.assertEqual(
+            samples['deepstream_probe_duration_seconds_bucket{probe="pgie_src",le="0.0005"}'], 1)
+        self.assertEqual(samples['deepstream_probe_duration_seconds_count{probe="pgie_src"}'], 1)
+
+    def test_dropped_buffers_from_qos(self):
+        # QoS messages carry running totals, unknown as -1
+        for dropped in (3, 3, -1, 5):
+            self.metrics.on_qos_message(None, QosMessage("sink", dropped))
+        samples = parse_samples(self.scrape()[1])
+        self.assertEqual(samples['deepstream_dropped_buffers_total{element="sink"}'], 5)
+
+    def test_unknown_path(self):
+        with self.assertRaises(Exception):
+            self.scrape("/other")
+
+
+if __name__ == "__main__":
+    unittest.main()